@@ -0,0 +1,272 @@
+"""
+File: batch.py
+Created Date: Saturday, 17th October 2026 2:31:48 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import plac
+
+from ag_transe_cli.connection import latencies
+from ag_transe_cli.metrics import format_seconds, peak_rss_mb
+from ag_transe_cli.utils import parse_positive_int
+
+logging.basicConfig(
+    format="%(levelname)s - %(asctime)s: %(message)s",
+    datefmt="%H:%M:%S",
+    level=logging.INFO,
+)
+
+# Many imports and exports run in one process, so the interpreter, numpy and
+# franz are loaded once, 'ag_env' is read once, and every job shares the same
+# server handles and pooled connections.  Jobs are submitted in the order of
+# the manifest and a job only waits for earlier ones, so they never deadlock.
+
+COMMANDS = ("import", "export")
+# options that change the state of the whole process
+PROCESS_OPTIONS = ("ag_env", "metrics", "progress", "profile")
+# options that fork worker processes, which must not happen while other jobs
+# have threads running
+FORKING_OPTIONS = ("vocab_workers", "serialize_workers", "compress_workers")
+
+
+class Job(NamedTuple):
+    name: str
+    command: str
+    argv: List[str]
+    after: List[str]
+
+
+def load_manifest(path: Path) -> dict:
+    text = path.read_text()
+    suffix = path.suffix.lower()
+    if suffix == ".json":
+        return json.loads(text)
+    if suffix in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            sys.exit(f"PyYAML is required to read the manifest: '{path}'")
+        return yaml.safe_load(text)
+    if suffix == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                sys.exit(f"tomli is required to read the manifest: '{path}'")
+        return tomllib.loads(text)
+    sys.exit(f"manifest must be a '.json', '.yaml', '.yml' or '.toml' file: '{path}'")
+
+
+def job_argv(args: Any) -> List[str]:
+    # a list is passed as it is; in a mapping, true values are flags and
+    # false or null values are left out
+    if isinstance(args, list):
+        return [str(arg) for arg in args]
+    argv = []
+    for key, value in args.items():
+        if value is None or value is False:
+            continue
+        option = "-" + str(key).lstrip("-").replace("_", "-")
+        argv += [option] if value is True else [option, str(value)]
+    return argv
+
+
+def parse_jobs(manifest: dict, max_jobs: int) -> List[Job]:
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("jobs"), list):
+        sys.exit("manifest must have a list of 'jobs'")
+    jobs: List[Job] = []
+    for k, spec in enumerate(manifest["jobs"]):
+        if not isinstance(spec, dict):
+            sys.exit(f"job {k} must be a mapping")
+        command = spec.get("command")
+        if command not in COMMANDS:
+            sys.exit(f"'command' of job {k} must be one of {', '.join(COMMANDS)}")
+        name = str(spec.get("name", f"{command}-{k}"))
+        if any(job.name == name for job in jobs):
+            sys.exit(f"Name of job {k} is not unique: '{name}'")
+        argv = job_argv(spec.get("args", {}))
+        # '-vocab-workers', '--vocab-workers' and '--vocab-workers=4' all
+        # give the same option
+        options = {
+            arg.lstrip("-").split("=", 1)[0].replace("-", "_")
+            for arg in argv
+            if arg.startswith("-")
+        }
+        if "ag_env" in options:
+            sys.exit(f"'ag_env' is given to 'batch' for all jobs, not to job '{name}'")
+        if max_jobs > 1 and options & set(PROCESS_OPTIONS):
+            sys.exit(
+                f"'metrics', 'progress' and 'profile' of job '{name}' need 'max_jobs' to be 1"
+            )
+        if max_jobs > 1 and options & set(FORKING_OPTIONS):
+            sys.exit(
+                f"'vocab_workers', 'serialize_workers' and 'compress_workers' of job '{name}' need 'max_jobs' to be 1"
+            )
+        after = spec.get("after", [])
+        after = [after] if isinstance(after, str) else list(after)
+        for other in after:
+            if not any(job.name == other for job in jobs):
+                sys.exit(f"Job '{name}' can only run after earlier jobs: '{other}'")
+        jobs.append(Job(name, command, argv, after))
+    return jobs
+
+
+def subcommand(command: str) -> Callable:
+    # imported here once, not by several jobs at the same time
+    if command == "import":
+        from ag_transe_cli.import_data import import_data
+
+        return import_data
+    from ag_transe_cli.export_data import export_data
+
+    return export_data
+
+
+def describe(error: BaseException) -> str:
+    if isinstance(error, SystemExit):
+        return str(error.code)
+    return f"{type(error).__name__}: {error}"
+
+
+def run_jobs(jobs: List[Job], max_jobs: int) -> List[dict]:
+    functions = {command: subcommand(command) for command in {j.command for j in jobs}}
+    start = time.perf_counter()
+    futures: Dict[str, Future] = {}
+    results: Dict[str, dict] = {}
+    lock = threading.Lock()
+
+    def _run(job: Job) -> bool:
+        result = {"name": job.name, "command": job.command, "argv": job.argv}
+        failed = [other for other in job.after if not futures[other].result()]
+        if failed:
+            result.update(
+                status="skipped",
+                error=f"failed: {', '.join(failed)}",
+                start_seconds=None,
+                wall_seconds=None,
+            )
+            logging.warning("Job '%s' skipped after '%s' failed", job.name, failed[0])
+        else:
+            logging.info("Job '%s' started", job.name)
+            started = time.perf_counter()
+            try:
+                plac.call(functions[job.command], job.argv)
+                result.update(status="ok", error=None)
+            except (Exception, SystemExit) as error:
+                result.update(status="failed", error=describe(error))
+            result.update(
+                start_seconds=started - start,
+                wall_seconds=time.perf_counter() - started,
+            )
+            if result["status"] == "ok":
+                logging.info(
+                    "Job '%s' finished in %s",
+                    job.name,
+                    format_seconds(result["wall_seconds"]),
+                )
+            else:
+                logging.error("Job '%s' failed: %s", job.name, result["error"])
+        with lock:
+            results[job.name] = result
+        return result["status"] == "ok"
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        for job in jobs:
+            futures[job.name] = executor.submit(_run, job)
+    return [results[job.name] for job in jobs]
+
+
+@plac.annotations(
+    manifest=(
+        "A JSON, YAML or TOML file with a list of 'jobs', each of them a 'command', 'import' or 'export', its 'args' as a mapping of options or a list of arguments, and optionally a 'name' and the names of earlier jobs to run 'after'",
+        "option",
+    ),
+    ag_env=(
+        "A text file that has environment varibles for connecting to AllegroGraph, e.g. 'AGRAPH_HOST', 'AGRAPH_PORT'; default to be 'ag_env' of the manifest",
+        "option",
+    ),
+    max_jobs=(
+        "Number of jobs running at the same time; default to be 1",
+        "option",
+    ),
+    report=(
+        "File to write the status, error, start and wall time of every job to, as JSON",
+        "option",
+    ),
+)
+def batch(
+    manifest: str,
+    ag_env: Optional[str],
+    max_jobs: Optional[str],
+    report: Optional[str],
+):
+    if not manifest:
+        sys.exit("'manifest' is not given")
+    manifest = Path(manifest)
+    if not manifest.exists():
+        sys.exit(f"manifest doesn't exist: '{manifest.absolute()}'")
+    spec = load_manifest(manifest)
+    max_jobs = parse_positive_int("max_jobs", max_jobs, 1)
+    jobs = parse_jobs(spec, max_jobs)
+
+    ag_env = ag_env or spec.get("ag_env")
+    if ag_env:
+        from dotenv import load_dotenv
+
+        ag_env = Path(ag_env)
+        if not ag_env.exists():
+            sys.exit(f"ag_env file doesn't exist: '{ag_env.absolute()}''")
+        try:
+            load_dotenv(ag_env, verbose=True)
+        except Exception as _:
+            logging.warning(
+                f"Cannot load environment variables from ag_env file: '{ag_env.absolute()}'"
+            )
+
+    logging.info("Running %d jobs, %d at a time", len(jobs), max_jobs)
+    start = time.perf_counter()
+    results = run_jobs(jobs, max_jobs)
+    wall_seconds = time.perf_counter() - start
+    counts = {
+        status: sum(result["status"] == status for result in results)
+        for status in ("ok", "failed", "skipped")
+    }
+    logging.info(
+        "%d jobs ok, %d failed and %d skipped in %s",
+        counts["ok"],
+        counts["failed"],
+        counts["skipped"],
+        format_seconds(wall_seconds),
+    )
+    if report:
+        Path(report).write_text(
+            json.dumps(
+                {
+                    "manifest": str(manifest),
+                    "max_jobs": max_jobs,
+                    "wall_seconds": wall_seconds,
+                    "peak_rss_mb": peak_rss_mb(),
+                    "counts": counts,
+                    "server_calls": latencies(),
+                    "jobs": results,
+                },
+                indent=2,
+            )
+        )
+        logging.info("Report has been written to '%s'", report)
+    if counts["failed"] or counts["skipped"]:
+        sys.exit(
+            f"{counts['failed'] + counts['skipped']} of {len(jobs)} jobs did not succeed"
+        )
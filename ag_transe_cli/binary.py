@@ -0,0 +1,84 @@
+"""
+File: binary.py
+Created Date: Saturday, 17th October 2026 2:36:15 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import struct
+from pathlib import Path
+
+import numpy as np
+
+# Binary layout of a training data folder, which 'export' writes and 'import'
+# reads without parsing any text: the folders 'entity2id' and 'relation2id'
+# each hold a saved Vocabulary, i.e. one utf-8 buffer of all names with an
+# index of their offsets, and 'train2id.npy', 'valid2id.npy' and
+# 'test2id.npy' hold (n, 3) int32 arrays of head, tail and relation ids.
+# Everything can be loaded with np.load(mmap_mode="r").
+
+OUTPUT_FORMATS = ("text", "binary", "both")
+VOCAB_NAMES = ("entity2id.txt", "relation2id.txt")
+TRIPLE_NAMES = ("train2id.txt", "valid2id.txt", "test2id.txt")
+
+
+def binary_path(data_dir: Path, fname: str) -> Path:
+    # 'entity2id.txt' -> 'entity2id', 'train2id.txt' -> 'train2id.npy'
+    stem = Path(fname).stem
+    return data_dir.joinpath(stem if fname in VOCAB_NAMES else f"{stem}.npy")
+
+
+def has_binary_layout(data_dir: Path) -> bool:
+    return all(
+        binary_path(data_dir, fname).exists() for fname in VOCAB_NAMES + TRIPLE_NAMES
+    )
+
+
+def training_file(data_dir: Path, fname: str) -> Path:
+    # the binary layout is preferred when a folder has both
+    if has_binary_layout(data_dir):
+        return binary_path(data_dir, fname)
+    return data_dir.joinpath(fname)
+
+
+def save_triple_ids(path: Path, ids: np.ndarray) -> None:
+    np.save(path, np.ascontiguousarray(ids, dtype=np.int32).reshape(-1, 3))
+
+
+def load_triple_ids(path: Path) -> np.ndarray:
+    ids = np.load(path, mmap_mode="r")
+    if ids.dtype != np.int32 or ids.ndim != 2 or ids.shape[1] != 3:
+        raise ValueError(f"Triple ids in '{path}' are not an (n, 3) int32 array")
+    return ids
+
+
+HEADER_SIZE = 128
+
+
+def _npy_header(n_triples: int) -> bytes:
+    # a version 1.0 '.npy' header padded to a fixed size, so that it can be
+    # patched in place once the number of triples is known
+    header = f"{{'descr': '<i4', 'fortran_order': False, 'shape': ({n_triples}, 3), }}"
+    header = header.ljust(HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode()
+
+
+class TripleArrayWriter:
+    # a '*2id.npy' file written while its triples arrive, like TripleWriter
+    def __init__(self, path: Path):
+        self._fp = path.open("wb")
+        self._fp.write(_npy_header(0))
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write(self, ids: np.ndarray) -> None:
+        if len(ids):
+            self._fp.write(np.ascontiguousarray(ids, dtype="<i4").tobytes())
+            self._size += len(ids)
+
+    def close(self) -> None:
+        self._fp.seek(0)
+        self._fp.write(_npy_header(self._size))
+        self._fp.close()
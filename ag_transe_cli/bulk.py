@@ -0,0 +1,67 @@
+"""
+File: bulk.py
+Created Date: Saturday, 17th October 2026 2:05:17 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import logging
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Generator, List, Optional
+
+from ag_transe_cli.metrics import METRICS
+
+if TYPE_CHECKING:
+    from franz.openrdf.repository.repository import RepositoryConnection
+
+# A bulk load fills a freshly created repository from a file the server reads
+# itself.  While it runs, duplicates are not suppressed and only the primary
+# index is maintained; the other indices are added back and the duplicates
+# removed once, at the end, instead of for every chunk as it arrives.
+
+PRIMARY_INDEX = "spogi"
+
+
+def _policy(conn: "RepositoryConnection") -> Optional[str]:
+    # None or 'false' when duplicates are kept
+    policy = conn.getDuplicateSuppressionPolicy()
+    return None if policy in (None, "false") else policy
+
+
+@contextmanager
+def deferred_indexing(conn: "RepositoryConnection") -> Generator[None, None, None]:
+    # the indices and the policy are restored even if the load fails
+    policy = _policy(conn)
+    indices: List[str] = list(conn.listIndices())
+    kept = PRIMARY_INDEX if PRIMARY_INDEX in indices else indices[0]
+    dropped = [index for index in indices if index != kept]
+    if policy is not None:
+        conn.disableDuplicateSuppression()
+    for index in dropped:
+        conn.dropIndex(index)
+    conn.commit()
+    logging.info(
+        "Duplicate suppression is off and only index '%s' is kept during the load", kept
+    )
+    try:
+        yield
+    finally:
+        with METRICS.timed("reindex"):
+            for index in dropped:
+                conn.addIndex(index)
+            conn.commit()
+            conn.optimizeIndices(wait=True)
+            if policy is not None:
+                conn.deleteDuplicates(policy)
+                conn.setDuplicateSuppressionPolicy(policy)
+                conn.commit()
+        logging.info(
+            "Indices %s have been rebuilt%s",
+            ", ".join(f"'{index}'" for index in dropped) or "(none)",
+            f" and '{policy}' duplicates removed" if policy is not None else "",
+        )
+
+
+def load_server_file(conn: "RepositoryConnection", server_path: str) -> None:
+    # `server_path` is opened by the server, not sent by the client
+    conn.addFile(server_path, format="application/n-triples", serverSide=True)
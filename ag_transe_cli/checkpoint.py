@@ -0,0 +1,79 @@
+"""
+File: checkpoint.py
+Created Date: Friday, 16th October 2026 8:14:03 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+# A checkpoint is written around every commit of a streamed import: the batch
+# about to be committed is recorded as 'pending' first, and moved to
+# 'committed' once the commit returned.  A batch is identified by the file it
+# comes from, its first and end rows in that file and a digest of its
+# NTriples serialization, so that a resumed import can check it regenerates
+# the very same batches; 'size' is the size of the repository after its commit.
+# Batches are uploaded in a session without autocommit, so the repository
+# only grows at commits and its size always matches one of the two records.
+
+
+class Unit(NamedTuple):
+    source: str
+    start: int
+    end: int
+    digest: str
+    size: int
+
+
+def batch_digest(batch: bytes) -> str:
+    return hashlib.blake2b(batch, digest_size=16).hexdigest()
+
+
+class Checkpoint:
+    def __init__(self, path: Path, header: dict):
+        self.path = path
+        self.header = header
+        self.committed: Optional[Unit] = None
+
+    @classmethod
+    def load(cls, path: Path) -> Optional[dict]:
+        try:
+            state = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        for key in ("committed", "pending"):
+            if state.get(key):
+                state[key] = Unit(**state[key])
+        return state
+
+    def _write(self, pending: Optional[Unit]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        tmp.write_text(
+            json.dumps(
+                {
+                    "header": self.header,
+                    "committed": self.committed._asdict() if self.committed else None,
+                    "pending": pending._asdict() if pending else None,
+                },
+                indent=2,
+            )
+        )
+        os.replace(tmp, self.path)
+
+    def begin(self, unit: Unit) -> None:
+        self._write(unit)
+
+    def commit(self, unit: Unit) -> None:
+        self.committed = unit
+        self._write(None)
+
+    def clear(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
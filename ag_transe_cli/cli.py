@@ -7,19 +7,47 @@ Author: Tianyu Gu (gty@franz.com)
 
 import sys
 
-import plac
+from ag_transe_cli import __version__
+
+# Nothing but the standard library is loaded before a subcommand is chosen,
+# so that '-h' and '--version' are answered right away.
+
+USAGE = """usage: ag-transe-cli [-h] [--version] {import,export,batch} ...
+
+A command line tool for importing data into or exporting data from AllegroGraph.
+
+subcommands:
+  import      Import triples from OpenKE training data into a repository or an NTriples file
+  export      Export OpenKE training data from a repository
+  batch       Run the imports and exports of a manifest in one process
+
+Use 'ag-transe-cli <subcommand> -h' for the options of a subcommand."""
 
 
 def main():
-    if sys.argv[1] == "import":
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print(USAGE)
+    elif sys.argv[1] == "--version":
+        print(f"ag-transe-cli {__version__}")
+    elif sys.argv[1] == "import":
+        import plac
+
         from ag_transe_cli.import_data import import_data
 
         plac.call(import_data, sys.argv[2:])
     elif sys.argv[1] == "export":
+        import plac
+
         from ag_transe_cli.export_data import export_data
 
         plac.call(export_data, sys.argv[2:])
+    elif sys.argv[1] == "batch":
+        import plac
+
+        from ag_transe_cli.batch import batch
+
+        plac.call(batch, sys.argv[2:])
     else:
         sys.exit(
-            f"Unknow subcommand: {sys.argv[1]}, there are two subcommands available, import and export"
+            f"Unknow subcommand: {sys.argv[1]}, there are three subcommands available, import, export and batch"
         )
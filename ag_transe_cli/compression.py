@@ -0,0 +1,92 @@
+"""
+File: compression.py
+Created Date: Friday, 16th October 2026 10:12:31 am
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import bz2
+import gzip
+import lzma
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Deque, List
+
+CODECS = {
+    "gzip": ".gz",
+    "bz2": ".bz2",
+    "xz": ".xz",
+}
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def compress_block(codec: str, block: bytes) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(block)
+    elif codec == "bz2":
+        return bz2.compress(block)
+    elif codec == "xz":
+        return lzma.compress(block, format=lzma.FORMAT_XZ)
+    raise ValueError(f"Unknown compression codec: '{codec}'")
+
+
+class ParallelCompressedWriter:
+    # Each block is compressed into a complete stream on a process pool, and
+    # the streams are written out in order; gzip, bz2 and xz all accept a
+    # concatenation of streams as one valid archive.
+    def __init__(self, path: Path, codec: str, workers: int):
+        self._fp = path.open("wb")
+        self._codec = codec
+        self._workers = workers
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._pending: Deque[Future] = deque()
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+
+    def write(self, data: bytes) -> int:
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= BLOCK_SIZE:
+            self._submit()
+        return len(data)
+
+    def _submit(self):
+        block = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._pending.append(
+            self._executor.submit(compress_block, self._codec, block)
+        )
+        while len(self._pending) > 2 * self._workers:
+            self._fp.write(self._pending.popleft().result())
+
+    def close(self):
+        try:
+            if self._buffered:
+                self._submit()
+            while self._pending:
+                self._fp.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown()
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_compressed(path: Path, codec: str, workers: int = 1) -> BinaryIO:
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec: '{codec}'")
+    if workers > 1:
+        return ParallelCompressedWriter(path, codec, workers)
+    elif codec == "gzip":
+        return gzip.open(path, "wb")
+    elif codec == "bz2":
+        return bz2.open(path, "wb")
+    else:
+        return lzma.open(path, "wb", format=lzma.FORMAT_XZ)
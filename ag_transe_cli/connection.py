@@ -4,12 +4,20 @@ Created Date: Monday, 16th November 2020 7:12:09 pm
 Author: Tianyu Gu (gty@franz.com)
 """
 
+import atexit
 import logging
 import os
-from typing import Dict
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Generator, Tuple
 
-from franz.openrdf.repository.repository import Repository, RepositoryConnection
-from franz.openrdf.sail.allegrographserver import AllegroGraphServer
+# franz and its HTTP backends are only imported once a server is contacted,
+# so that commands which never connect, e.g. '-save-ntriples-to', start fast
+if TYPE_CHECKING:
+    from franz.openrdf.repository.repository import Repository, RepositoryConnection
 
 logging.basicConfig(
     format="%(levelname)s - %(asctime)s: %(message)s",
@@ -17,6 +25,27 @@ logging.basicConfig(
     level=logging.INFO,
 )
 
+TRANSIENT_STATUS = (408, 429, 502, 503, 504)
+# Calls that read without changing the repository, so running them twice is
+# harmless.  Writes may have been applied by the server before the error, so
+# they are never replayed, and their errors are left to the caller.
+IDEMPOTENT_CALLS = frozenset(
+    {
+        "size",
+        "isEmpty",
+        "getSpec",
+        "getStatements",
+        "getContextIDs",
+        "getNamespace",
+        "getNamespaces",
+        "listIndices",
+        "getDuplicateSuppressionPolicy",
+        "prepareTupleQuery",
+        "prepareBooleanQuery",
+        "prepareGraphQuery",
+    }
+)
+
 
 def load_ag_env() -> Dict[str, str]:
     return {
@@ -27,27 +56,312 @@ def load_ag_env() -> Dict[str, str]:
     }
 
 
+@lru_cache(maxsize=None)
+def network_errors() -> Tuple[type, ...]:
+    errors: Tuple[type, ...] = (ConnectionError, TimeoutError)
+    try:
+        from pycurl import error as CurlError
+
+        errors += (CurlError,)
+    except ImportError:
+        pass
+    try:
+        from requests.exceptions import ConnectionError as RequestsConnectionError
+        from requests.exceptions import Timeout
+
+        errors += (RequestsConnectionError, Timeout)
+    except ImportError:
+        pass
+    return errors
+
+
+def is_transient(error: BaseException) -> bool:
+    from franz.miniclient.request import RequestError
+
+    if isinstance(error, RequestError):
+        return error.status in TRANSIENT_STATUS
+    return isinstance(error, network_errors())
+
+
+class _CountingOutput:
+    def __init__(self, output: Any):
+        self._output = output
+        self.written = 0
+
+    def write(self, chunk: bytes):
+        self.written += len(chunk)
+        return self._output.write(chunk)
+
+
+class _RetryingQuery:
+    def __init__(self, manager: "ConnectionManager", query: Any):
+        self._manager = manager
+        self._query = query
+
+    def evaluate(self, *args, output=None, **kwargs):
+        if output is None:
+            return self._manager.call(
+                "evaluate", self._query.evaluate, *args, **kwargs
+            )
+        # results that have been partly written to `output` can't be retried
+        output = _CountingOutput(output)
+        return self._manager.call(
+            "evaluate",
+            self._query.evaluate,
+            *args,
+            output=output,
+            retry_if=lambda: output.written == 0,
+            **kwargs,
+        )
+
+    def __getattr__(self, name: str):
+        return getattr(self._query, name)
+
+
+class _RetryingConnection:
+    # wraps every method of a RepositoryConnection with timing, and the ones
+    # in IDEMPOTENT_CALLS with retries
+    def __init__(self, manager: "ConnectionManager", conn: "RepositoryConnection"):
+        self._manager = manager
+        self._conn = conn
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._conn, name)
+        if not callable(attr):
+            return attr
+
+        def _call(*args, **kwargs):
+            result = self._manager.call(
+                name,
+                attr,
+                *args,
+                retry_if=lambda: name in IDEMPOTENT_CALLS,
+                **kwargs,
+            )
+            if name.startswith("prepare") and name.endswith("Query"):
+                return _RetryingQuery(self._manager, result)
+            return result
+
+        return _call
+
+
+class ConnectionManager:
+    # One server and catalog handle shared by every caller, with a pool of
+    # repository connections per repository, so that their HTTP handles are
+    # kept alive and reused instead of being set up for each AG_CONN.
+    def __init__(
+        self,
+        credential: Dict[str, str],
+        catalog: str,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        from franz.openrdf.sail.allegrographserver import AllegroGraphServer
+
+        self._server = AllegroGraphServer(**credential)
+        self._catalog = self._server.openCatalog(catalog)
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._lock = threading.Lock()
+        self._repos: Dict[str, "Repository"] = {}
+        self._pools: Dict[str, "queue.LifoQueue[RepositoryConnection]"] = {}
+        self._latency: Dict[str, list] = {}
+
+    @property
+    def catalog(self):
+        return self._catalog
+
+    def call(
+        self,
+        name: str,
+        fn: Callable,
+        *args,
+        retry_if: Callable[[], bool] = lambda: True,
+        **kwargs,
+    ):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except BaseException as error:
+                if (
+                    attempt >= self._max_retries
+                    or not is_transient(error)
+                    or not retry_if()
+                ):
+                    raise
+                attempt += 1
+                delay = self._backoff * 2 ** (attempt - 1)
+                logging.warning(
+                    "'%s' failed due to error: %s; retrying in %.1fs (%d/%d)",
+                    name,
+                    error,
+                    delay,
+                    attempt,
+                    self._max_retries,
+                )
+                time.sleep(delay)
+            finally:
+                self._record(name, time.perf_counter() - start)
+
+    def _record(self, name: str, elapsed: float):
+        with self._lock:
+            counter = self._latency.setdefault(name, [0, 0.0, 0.0])
+            counter[0] += 1
+            counter[1] += elapsed
+            counter[2] = max(counter[2], elapsed)
+
+    def latency(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {"count": count, "total": total, "max": longest}
+                for name, (count, total, longest) in self._latency.items()
+            }
+
+    def acquire(self, repo_name: str) -> "RepositoryConnection":
+        from franz.openrdf.repository.repository import Repository
+
+        with self._lock:
+            pool = self._pools.setdefault(repo_name, queue.LifoQueue())
+        try:
+            return pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            repo = self._repos.get(repo_name)
+        if repo is None:
+            repo = self.call(
+                "getRepository",
+                self._catalog.getRepository,
+                repo_name,
+                Repository.OPEN,
+            )
+            with self._lock:
+                repo = self._repos.setdefault(repo_name, repo)
+        return self.call("getConnection", repo.getConnection)
+
+    def release(
+        self, repo_name: str, conn: "RepositoryConnection", reuse: bool = True
+    ):
+        with self._lock:
+            pool = self._pools.get(repo_name)
+        if reuse and pool is not None:
+            pool.put(conn)
+        else:
+            conn.close()
+
+    def discard(self, repo_name: str):
+        # drops pooled connections, e.g. after the repository has been renewed
+        with self._lock:
+            pool = self._pools.pop(repo_name, None)
+            repo = self._repos.pop(repo_name, None)
+        while pool is not None and not pool.empty():
+            pool.get_nowait().close()
+        if repo is not None:
+            repo.shutDown()
+
+    def close(self):
+        with self._lock:
+            names = set(self._pools) | set(self._repos)
+        for name in names:
+            self.discard(name)
+        for name, counter in self.latency().items():
+            logging.debug(
+                "'%s': %d call(s), %.3fs in total, %.3fs at most",
+                name,
+                counter["count"],
+                counter["total"],
+                counter["max"],
+            )
+
+
+_managers: Dict[Tuple[str, ...], ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager() -> ConnectionManager:
+    # environment variables may be loaded from 'ag_env' after import, so the
+    # manager is created on first use, one per server, user and catalog
+    credential = load_ag_env()
+    catalog = os.environ.get("AGRAPH_CATALOG", "")
+    key = tuple(credential.values()) + (catalog,)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = ConnectionManager(credential, catalog)
+        return _managers[key]
+
+
+def latencies() -> Dict[str, Dict[str, float]]:
+    # latency of every kind of call, summed over all managers
+    with _managers_lock:
+        managers = list(_managers.values())
+    total: Dict[str, Dict[str, float]] = {}
+    for manager in managers:
+        for name, counter in manager.latency().items():
+            entry = total.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += counter["count"]
+            entry["total"] += counter["total"]
+            entry["max"] = max(entry["max"], counter["max"])
+    return total
+
+
+@atexit.register
+def close_managers():
+    with _managers_lock:
+        managers = list(_managers.values())
+        _managers.clear()
+    for manager in managers:
+        manager.close()
+
+
+@contextmanager
+def session(conn) -> Generator[Any, None, None]:
+    # A dedicated session without autocommit: what is added through `conn` is
+    # only seen by others once `conn.commit()` returns, and what was not
+    # committed is rolled back when the block fails.
+    conn.openSession(autocommit=False)
+    try:
+        yield conn
+    except BaseException:
+        try:
+            conn.rollback()
+        except Exception as error:
+            logging.warning("Cannot roll back the session due to error: %s", error)
+        raise
+    finally:
+        try:
+            conn.closeSession()
+        except Exception as error:
+            logging.warning("Cannot close the session due to error: %s", error)
+
+
 class AG_CONN:
-    _conn: RepositoryConnection
+    _conn: "RepositoryConnection"
 
     def __init__(self, repo_name: str):
-        self._ag_conn_credential = load_ag_env()
-        _ag_server = AllegroGraphServer(**self._ag_conn_credential)
-        _ag_catalog = _ag_server.openCatalog(os.environ.get("AGRAPH_CATALOG", ""))
-        self._repo = _ag_catalog.getRepository(repo_name, Repository.OPEN)
-        self._conn = self._repo.getConnection()
+        self._manager = get_manager()
+        self._repo_name = repo_name
+        self._conn = self._manager.acquire(repo_name)
 
     def __enter__(self):
-        return self._conn
+        return _RetryingConnection(self._manager, self._conn)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._conn.close()
-        self._repo.shutDown()
+        # a connection that saw an error is not handed out again
+        self._manager.release(self._repo_name, self._conn, reuse=exc_type is None)
+
+    @staticmethod
+    def exists(repo_name: str) -> bool:
+        return repo_name in get_manager().catalog.listRepositories()
 
     @staticmethod
     def renew_or_create(repo_name: str) -> None:
-        _ag_server = AllegroGraphServer(**load_ag_env())
-        _ag_catalog = _ag_server.openCatalog(os.environ.get("AGRAPH_CATALOG", ""))
+        from franz.openrdf.repository.repository import Repository
+
+        manager = get_manager()
+        manager.discard(repo_name)
+        _ag_catalog = manager.catalog
         try:
             if repo_name in _ag_catalog.listRepositories():
                 logging.info(f"Existing '%s' found", repo_name)
@@ -0,0 +1,118 @@
+"""
+File: csv_results.py
+Created Date: Friday, 16th October 2026 5:21:44 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import csv
+import io
+from abc import ABC, abstractmethod
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from ag_transe_cli.metrics import METRICS
+
+# SPARQL CSV results: a header line, then one line per row ending with CRLF;
+# franz hands the raw response to `write` chunk by chunk
+
+
+class _LineChunker(ABC):
+    def __init__(self):
+        self._rest = b""
+        self._header = True
+
+    def write(self, chunk: bytes) -> int:
+        data = self._rest + chunk
+        cut = data.rfind(b"\n") + 1
+        self._rest = data[cut:]
+        if self._header:
+            header_end = data.find(b"\n", 0, cut) + 1
+            if not header_end:
+                self._rest = data
+                return len(chunk)
+            self._header = False
+            data = data[header_end:cut]
+        else:
+            data = data[:cut]
+        if data:
+            self.lines(data)
+        return len(chunk)
+
+    def close(self):
+        if self._rest.strip() and not self._header:
+            self.lines(self._rest + b"\n")
+        self._rest = b""
+
+    @abstractmethod
+    def lines(self, data: bytes):
+        # complete lines, without the header
+        ...
+
+
+_SEPARATORS = bytes.maketrans(b",\r", b"  ")
+
+
+class IdRowsParser(_LineChunker):
+    # rows of `n_columns` integers, handed to `on_rows` as (n, n_columns) arrays
+    def __init__(self, n_columns: int, on_rows: Callable[[np.ndarray], None]):
+        super().__init__()
+        self._n_columns = n_columns
+        self._on_rows = on_rows
+
+    def lines(self, data: bytes):
+        with METRICS.timed("decode") as stage:
+            n_rows = data.count(b"\n")
+            ids = np.fromstring(data.translate(_SEPARATORS), dtype=np.int64, sep=" ")
+            if ids.size != n_rows * self._n_columns:
+                raise ValueError(f"Unexpected rows in query results: {data[:200]!r}")
+        stage.count(n_rows, len(data))
+        self._on_rows(ids.reshape(-1, self._n_columns))
+
+
+class NameIdRowsParser(_LineChunker):
+    # rows of a name and an integer id; every name is decoded exactly once
+    def __init__(self):
+        super().__init__()
+        self.pairs: List[Tuple[str, int]] = []
+
+    def lines(self, data: bytes):
+        n_pairs = len(self.pairs)
+        with METRICS.timed("decode") as stage:
+            for name, i in csv.reader(io.StringIO(data.decode("utf-8"), newline="")):
+                self.pairs.append((name, int(i)))
+        stage.count(len(self.pairs) - n_pairs, len(data))
+
+
+class NameRowsParser(_LineChunker):
+    # rows of `n_columns` names, handed to `on_rows` in batches of `batch_size`
+    def __init__(
+        self,
+        n_columns: int,
+        on_rows: Callable[[List[List[str]]], None],
+        batch_size: int = 100000,
+    ):
+        super().__init__()
+        self._n_columns = n_columns
+        self._on_rows = on_rows
+        self._batch_size = batch_size
+        self._rows: List[List[str]] = []
+
+    def lines(self, data: bytes):
+        with METRICS.timed("decode") as stage:
+            rows = list(csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+            if any(len(row) != self._n_columns for row in rows):
+                raise ValueError(f"Unexpected rows in query results: {data[:200]!r}")
+        stage.count(len(rows), len(data))
+        self._rows.extend(rows)
+        while len(self._rows) >= self._batch_size:
+            batch = self._rows[: self._batch_size]
+            self._rows = self._rows[self._batch_size :]
+            self._on_rows(batch)
+
+    def close(self):
+        super().close()
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self._on_rows(rows)
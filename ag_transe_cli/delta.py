@@ -0,0 +1,247 @@
+"""
+File: delta.py
+Created Date: Friday, 16th October 2026 7:25:40 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from ag_transe_cli.binary import training_file
+from ag_transe_cli.ntriples import TripleFormatter, vocabulary_blocks_iter
+from ag_transe_cli.terms import URI
+from ag_transe_cli.triples import (
+    fits_int64_keys,
+    hash_triple_ids,
+    pack_triple_ids,
+    unpack_triple_ids,
+)
+from ag_transe_cli.vocab import Vocabulary
+
+# The manifest of a repository records what was loaded into it last time:
+# digests of the training files, digests of content-defined chunks of every
+# '*2id.txt' file, snapshots of their ids and both vocabularies, and the size
+# of the repository afterwards.  A delta import only looks into the chunks
+# whose digests are not found in the manifest.
+
+MANIFEST = "manifest.json"
+VERSION = 1
+VOCAB_FILES = ("entity2id.txt", "relation2id.txt")
+TRIPLE_FILES = ("train2id.txt", "test2id.txt", "valid2id.txt")
+CHUNK_ROWS = 4096
+
+
+class Delta(NamedTuple):
+    n_entities: int
+    n_relations: int
+    # every copy of a removed triple goes, `added` may repeat a triple
+    removed: np.ndarray
+    added: np.ndarray
+    n_removed: int
+
+
+def file_digest(path: Path) -> str:
+    # a folder, e.g. a binary vocabulary, is digested file by file
+    digest = hashlib.blake2b(digest_size=16)
+    for part in sorted(path.iterdir()) if path.is_dir() else [path]:
+        if part != path:
+            digest.update(part.name.encode("utf-8"))
+        with part.open("rb") as fp:
+            for block in iter(lambda: fp.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_bounds(ids: np.ndarray, chunk_rows: int) -> np.ndarray:
+    # a chunk ends after every triple whose hash is a multiple of `chunk_rows`,
+    # so inserting or removing lines only changes the chunks around them
+    # instead of shifting all following ones; the hash only depends on the ids
+    # of the triple, not on the sizes of the vocabularies
+    cuts = np.nonzero(hash_triple_ids(ids) % np.uint64(chunk_rows) == 0)[0] + 1
+    return np.unique(np.concatenate(([0], cuts, [len(ids)])))
+
+
+def chunk_digests(ids: np.ndarray, chunk_rows: int) -> List[str]:
+    bounds = chunk_bounds(ids, chunk_rows)
+    ids = np.ascontiguousarray(ids, dtype=np.int32)
+    return [
+        hashlib.blake2b(ids[begin:end].tobytes(), digest_size=16).hexdigest()
+        for begin, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def _changed_keys(
+    ids: np.ndarray, keys: np.ndarray, known: set, chunk_rows: int
+) -> np.ndarray:
+    # keys in the chunks whose digests are not in `known`
+    bounds = chunk_bounds(ids, chunk_rows)
+    digests = chunk_digests(ids, chunk_rows)
+    parts = [
+        keys[begin:end]
+        for begin, end, digest in zip(bounds[:-1], bounds[1:], digests)
+        if digest not in known
+    ]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+def _copies_in(candidates: np.ndarray, keys: List[np.ndarray]) -> np.ndarray:
+    # occurrences of the (few, unique and sorted) candidates in all of `keys`;
+    # binary searches of all keys among the candidates, without sorting keys
+    copies = np.zeros(len(candidates), dtype=np.int64)
+    if not len(candidates):
+        return copies
+    for part in keys:
+        positions = np.searchsorted(candidates, part)
+        hit = candidates[np.minimum(positions, len(candidates) - 1)] == part
+        np.add.at(copies, positions[hit], 1)
+    return copies
+
+
+def load_manifest(manifest_dir: Path) -> Optional[dict]:
+    try:
+        manifest = json.loads(manifest_dir.joinpath(MANIFEST).read_text())
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == VERSION else None
+
+
+def save_manifest(
+    manifest_dir: Path,
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    triple_ids: Dict[str, np.ndarray],
+    entity_type: URI,
+    relation_type: URI,
+    size: int,
+) -> None:
+    manifest_dir.mkdir(parents=True, exist_ok=True)
+    # the snapshots are never trusted without the manifest written last
+    invalidate_manifest(manifest_dir)
+    entity2id.save(manifest_dir.joinpath("entity2id"))
+    relation2id.save(manifest_dir.joinpath("relation2id"))
+    chunks = {}
+    for fname, ids in triple_ids.items():
+        np.save(manifest_dir.joinpath(f"{Path(fname).stem}.npy"), ids)
+        chunks[fname] = chunk_digests(ids, CHUNK_ROWS)
+    manifest = {
+        "version": VERSION,
+        "entity_type": str(entity_type),
+        "relation_type": str(relation_type),
+        "size": size,
+        "chunk_rows": CHUNK_ROWS,
+        "files": {
+            fname: file_digest(training_file(training_data_dir, fname))
+            for fname in VOCAB_FILES + TRIPLE_FILES
+        },
+        "chunks": chunks,
+    }
+    tmp = manifest_dir.joinpath(f"{MANIFEST}.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, manifest_dir.joinpath(MANIFEST))
+
+
+def invalidate_manifest(manifest_dir: Path) -> None:
+    try:
+        manifest_dir.joinpath(MANIFEST).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def plan_delta(
+    manifest_dir: Path,
+    manifest: dict,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    triple_ids: Dict[str, np.ndarray],
+    suppress_duplicates: bool = False,
+) -> Optional[Delta]:
+    # None means that the changes can't be applied incrementally; without
+    # `suppress_duplicates`, the repository holds one copy of a triple for
+    # every time it appears in the files
+    old_entity2id = Vocabulary.load(manifest_dir.joinpath("entity2id"))
+    old_relation2id = Vocabulary.load(manifest_dir.joinpath("relation2id"))
+    if not entity2id.extends(old_entity2id):
+        logging.info("Ids of existing entities have changed")
+        return None
+    if not relation2id.extends(old_relation2id):
+        logging.info("Ids of existing relations have changed")
+        return None
+    if not fits_int64_keys(len(entity2id), len(relation2id)):
+        logging.info("Triples don't fit in int64 keys")
+        return None
+
+    # old and new ids are packed with the same bases, they only ever grow
+    n_entities, n_relations = len(entity2id), len(relation2id)
+    chunk_rows = manifest["chunk_rows"]
+    old_keys, new_keys, removed, added = [], [], [], []
+    for fname in TRIPLE_FILES:
+        old_ids = np.load(manifest_dir.joinpath(f"{Path(fname).stem}.npy"))
+        old = pack_triple_ids(old_ids, n_entities, n_relations)
+        new = pack_triple_ids(triple_ids[fname], n_entities, n_relations)
+        old_keys.append(old)
+        new_keys.append(new)
+        new_digests = chunk_digests(triple_ids[fname], chunk_rows)
+        removed.append(_changed_keys(old_ids, old, set(new_digests), chunk_rows))
+        added.append(
+            _changed_keys(
+                triple_ids[fname], new, set(manifest["chunks"][fname]), chunk_rows
+            )
+        )
+
+    # A triple out of a changed chunk may still be found in (or already be
+    # loaded from) any other chunk, so copies are counted over all files.
+    # Removing a triple removes all of its copies, so when there are to be
+    # fewer copies, the ones left are added back.
+    candidates = np.unique(np.concatenate(removed + added))
+    old_copies = _copies_in(candidates, old_keys)
+    new_copies = _copies_in(candidates, new_keys)
+    if suppress_duplicates:
+        old_copies = np.minimum(old_copies, 1)
+        new_copies = np.minimum(new_copies, 1)
+    fewer = new_copies < old_copies
+    copies = np.where(fewer, new_copies, new_copies - old_copies)
+    return Delta(
+        len(old_entity2id),
+        len(old_relation2id),
+        unpack_triple_ids(candidates[fewer], n_entities, n_relations),
+        unpack_triple_ids(np.repeat(candidates, copies), n_entities, n_relations),
+        int(old_copies[fewer].sum()),
+    )
+
+
+def apply_delta(
+    conn,
+    delta: Delta,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    batch_size: int,
+) -> int:
+    # returns the number of triples added minus the number of triples
+    # removed; nothing is committed here
+    formatter = TripleFormatter(entity2id, relation2id)
+    for start in range(0, len(delta.removed), batch_size):
+        conn.removeQuads(
+            formatter.quads(delta.removed[start : start + batch_size]), ntriples=True
+        )
+    n_added = 0
+    for blocks in (
+        vocabulary_blocks_iter(entity2id, entity_type, batch_size, delta.n_entities),
+        vocabulary_blocks_iter(
+            relation2id, relation_type, batch_size, delta.n_relations
+        ),
+        formatter.blocks(delta.added, batch_size),
+    ):
+        for n, block in blocks:
+            conn.addData(block, rdf_format="application/n-triples")
+            n_added += n
+    return n_added - delta.n_removed
@@ -6,20 +6,49 @@ Author: Tianyu Gu (gty@franz.com)
 
 
 import logging
-import random
+import secrets
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
+import numpy as np
 import plac
-import validators
-from bidict import bidict
-from dotenv import load_dotenv
-from franz.openrdf.model.value import URI
-from franz.openrdf.query.query import QueryLanguage
-from franz.openrdf.vocabulary import RDF, RDFS
 
-from ag_transe_cli.connection import AG_CONN
+from ag_transe_cli.binary import (
+    OUTPUT_FORMATS,
+    TripleArrayWriter,
+    binary_path,
+    load_triple_ids,
+    save_triple_ids,
+)
+from ag_transe_cli.connection import AG_CONN, latencies
+from ag_transe_cli.csv_results import IdRowsParser, NameIdRowsParser, NameRowsParser
+from ag_transe_cli.metrics import METRICS, recording
+from ag_transe_cli.openke import write_test_categories, write_type_constrain
+from ag_transe_cli.pipeline import Pipeline
+from ag_transe_cli.snapshot import Snapshot, load_snapshot, save_snapshot
+from ag_transe_cli.terms import RDF, RDFS, URI
+from ag_transe_cli.triples import (
+    TripleBuffer,
+    TripleSet,
+    TripleWriter,
+    hash_fractions,
+    read_triple_ids,
+    write_triple_ids,
+)
+from ag_transe_cli.uris import is_url
+from ag_transe_cli.utils import parse_positive_int
+from ag_transe_cli.vocab import Vocabulary
+from ag_transe_cli.vocab_cache import (
+    Checksum,
+    default_cache_dir,
+    load_cached_vocabulary,
+    save_cached_vocabulary,
+)
 
 logging.basicConfig(
     format="%(levelname)s - %(asctime)s: %(message)s",
@@ -28,95 +57,667 @@ logging.basicConfig(
 )
 
 
-def get_entity2id(repo: str, entity_type: URI) -> bidict[URI, int]:
-    entity2id = {}
-    with AG_CONN(repo) as conn:
-        query = f"""SELECT ?ent ?id WHERE {{
-  ?ent a {entity_type.toNTriples()} ;
-         <http://example.org/embeddings#hasID> ?id .
+def fetch_vocabulary(
+    repo: str, type_: URI, raw_results: bool, cache_dir: Optional[Path] = None
+) -> Vocabulary:
+    d, ids = fetch_sparse_vocabulary(repo, type_, raw_results, cache_dir)
+    if len(ids) and ids[-1] != len(ids) - 1:
+        raise ValueError(f"Ids must be unique and in the range of 0 to {len(ids) - 1}")
+    return d
+
+
+def fetch_sparse_vocabulary(
+    repo: str, type_: URI, raw_results: bool, cache_dir: Optional[Path] = None
+) -> Tuple[Vocabulary, np.ndarray]:
+    # names in the order of their hasID values, and those values, which may
+    # have gaps, e.g. once names have been removed; only vocabularies without
+    # gaps are cached.  The checksum is taken before the names, so a
+    # vocabulary cached while the repository changes is at worst fetched
+    # again next time.
+    if cache_dir is not None:
+        with METRICS.timed("vocabulary_cache"):
+            checksum = fetch_vocabulary_checksum(repo, type_)
+            d = load_cached_vocabulary(cache_dir, repo, type_, checksum)
+        if d is not None:
+            logging.info("%d names of '%s' read from the cache", len(d), type_)
+            return d, np.arange(len(d))
+    with METRICS.timed("query_vocabulary", "names") as stage:
+        pairs = sorted(
+            _fetch_vocabulary_pairs(repo, type_, raw_results), key=itemgetter(1)
+        )
+        ids = np.fromiter((i for _, i in pairs), dtype=np.int64, count=len(pairs))
+        if len(ids) and (ids[0] < 0 or (ids[1:] == ids[:-1]).any()):
+            raise ValueError("Ids must be unique and not negative")
+        d = Vocabulary.from_names([name for name, _ in pairs])
+    stage.count(len(d))
+    if cache_dir is not None and (not len(ids) or ids[-1] == len(ids) - 1):
+        with METRICS.timed("vocabulary_cache"):
+            save_cached_vocabulary(cache_dir, repo, type_, checksum, d)
+    return d, ids
+
+
+def digest_sum(left: str, right: str) -> str:
+    # SUM of a hash of two terms over all rows, computed by the server; the
+    # hash is the first 10 decimal digits of an MD5 hex digest, since SPARQL
+    # can't read hexadecimal numbers
+    digest = f'MD5(CONCAT(STR({left}), " ", STR({right})))'
+    return f'SUM({XSD_INTEGER}(CONCAT("0", SUBSTR(REPLACE({digest}, "[a-f]", ""), 1, 10))))'
+
+
+def fetch_vocabulary_checksum(repo: str, type_: URI) -> Checksum:
+    # number of names and the sum of a hash of every id with its URI
+    from franz.openrdf.query.query import QueryLanguage
+
+    query = f"""SELECT (COUNT(*) AS ?n) ({digest_sum("?id", "?ent")} AS ?digest) WHERE {{
+  ?ent a {type_.toNTriples()} ;
+         {HAS_ID} ?id .
 }}"""
-        tuple_query = conn.prepareTupleQuery(QueryLanguage.SPARQL, query)
-        with tuple_query.evaluate() as res:
+    with AG_CONN(repo) as conn:
+        with conn.prepareTupleQuery(QueryLanguage.SPARQL, query).evaluate() as res:
             for bindings in res:
-                ent = bindings.getValue("ent")
-                i = bindings.getValue("id").intValue()
-                entity2id[ent] = i
-    return bidict(entity2id)
+                n, digest = bindings.getValue("n"), bindings.getValue("digest")
+                return Checksum(
+                    n.intValue() if n is not None else 0,
+                    digest.intValue() if digest is not None else 0,
+                )
+    return Checksum(0, 0)
 
 
-def get_relation2id(repo: str, relation_type: URI) -> bidict[URI, int]:
-    relation2id = {}
-    with AG_CONN(repo) as conn:
-        query = f"""SELECT ?ent ?id WHERE {{
-  ?ent a {relation_type.toNTriples()} ;
+def _fetch_vocabulary_pairs(
+    repo: str, type_: URI, raw_results: bool
+) -> List[Tuple[str, int]]:
+    from franz.openrdf.query.query import QueryLanguage
+    from franz.openrdf.rio.tupleformat import TupleFormat
+
+    query = f"""SELECT ?ent ?id WHERE {{
+  ?ent a {type_.toNTriples()} ;
          <http://example.org/embeddings#hasID> ?id .
 }}"""
+    with AG_CONN(repo) as conn:
         tuple_query = conn.prepareTupleQuery(QueryLanguage.SPARQL, query)
+        if raw_results:
+            parser = NameIdRowsParser()
+            tuple_query.evaluate(output=parser, output_format=TupleFormat.CSV)
+            parser.close()
+            return parser.pairs
+        pairs = []
         with tuple_query.evaluate() as res:
             for bindings in res:
-                ent = bindings.getValue("ent")
+                ent = bindings.getValue("ent").getURI()
                 i = bindings.getValue("id").intValue()
-                relation2id[ent] = i
-    return bidict(relation2id)
+                pairs.append((ent, i))
+    return pairs
+
+
+def get_entity2id(
+    repo: str,
+    entity_type: URI,
+    raw_results: bool = False,
+    cache_dir: Optional[Path] = None,
+) -> Vocabulary:
+    return fetch_vocabulary(repo, entity_type, raw_results, cache_dir)
+
+
+def get_relation2id(
+    repo: str,
+    relation_type: URI,
+    raw_results: bool = False,
+    cache_dir: Optional[Path] = None,
+) -> Vocabulary:
+    return fetch_vocabulary(repo, relation_type, raw_results, cache_dir)
+
+
+def output_paths(output_dir: Path, fname: str, output_format: str) -> List[Path]:
+    # the text file, the binary file or folder, or both of them
+    paths = []
+    if output_format in ("text", "both"):
+        paths.append(output_dir.joinpath(fname))
+    if output_format in ("binary", "both"):
+        paths.append(binary_path(output_dir, fname))
+    return paths
 
 
 def write_entity2id_relation2id(
-    output_dir: Path, entity2id: bidict[URI, int], relation2id: bidict[URI, int]
+    output_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    output_format: str = "text",
 ):
-    def _writer(fname: str, d: bidict[URI, int]):
-        with output_dir.joinpath(fname).open("w") as fp:
-            fp.write(f"{len(d)}\n")
-            for i in range(0, len(d)):
-                ent = d.inverse[i]
-                fp.write(f"{ent.getURI()}\t{i}\n")
-        logging.info("'%s' has been written", fname)
+    def _writer(fname: str, d: Vocabulary):
+        for path in output_paths(output_dir, fname, output_format):
+            with METRICS.timed("write") as stage:
+                if path.suffix == ".txt":
+                    with path.open("w") as fp:
+                        fp.write(f"{len(d)}\n")
+                        for i, ent in enumerate(d.names()):
+                            fp.write(f"{ent}\t{i}\n")
+                    nbytes = path.stat().st_size
+                else:
+                    d.save(path)
+                    nbytes = path.joinpath("names.npy").stat().st_size
+            stage.count(len(d), nbytes)
+            logging.info("'%s' has been written", path.name)
 
     _writer("entity2id.txt", entity2id)
     _writer("relation2id.txt", relation2id)
 
 
+def map_triple_rows(
+    rows: List[List[str]],
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    relation_id: Optional[int] = None,
+) -> np.ndarray:
+    # one batched lookup per column instead of three dict lookups per row;
+    # rows with a name that is not in the vocabularies are dropped
+    with METRICS.timed("map_ids"):
+        columns = list(zip(*rows))
+        ids = np.stack(
+            [
+                entity2id.lookup(columns[0]),
+                entity2id.lookup(columns[1]),
+                relation2id.lookup(columns[2])
+                if relation_id is None
+                else np.full(len(rows), relation_id),
+            ],
+            axis=1,
+        )
+    return ids[(ids >= 0).all(axis=1)]
+
+
+def filter_raw_rows(
+    rows: np.ndarray,
+    n_entities: int,
+    n_relations: int,
+    relation_id: Optional[int] = None,
+) -> np.ndarray:
+    # rows of hasID values, with the relation id appended if it is given;
+    # ids out of the range of the vocabularies are dropped
+    if relation_id is not None:
+        rows = np.column_stack([rows, np.full(len(rows), relation_id)])
+    in_range = (
+        (rows >= 0).all(axis=1)
+        & (rows[:, 0] < n_entities)
+        & (rows[:, 1] < n_entities)
+        & (rows[:, 2] < n_relations)
+    )
+    return rows[in_range]
+
+
+def new_triple_set(entity2id: Vocabulary, relation2id: Vocabulary) -> TripleSet:
+    # duplicates are found by packing every triple into one int64 key
+    try:
+        return TripleSet(len(entity2id), len(relation2id))
+    except ValueError as err:
+        sys.exit(f"'dedup' can't be applied: {err}")
+
+
+def unique_ids(seen: TripleSet, ids: np.ndarray) -> np.ndarray:
+    # triples not seen before, for queries without DISTINCT
+    with METRICS.timed("dedup") as stage:
+        keep = seen.add(ids)
+    stage.count(len(ids))
+    return ids[keep]
+
+
+def fetch_triple_rows(
+    repo: str,
+    query: str,
+    n_columns: int,
+    on_rows: Callable[[List[List[str]]], None],
+    batch_size: int = 100000,
+) -> None:
+    # URIs of `n_columns` columns, handed to `on_rows` in batches of
+    # `batch_size`; results are streamed as CSV, so they are never all held
+    # in memory, unlike the bindings of a TupleQueryResult
+    from franz.openrdf.query.query import QueryLanguage
+    from franz.openrdf.rio.tupleformat import TupleFormat
+
+    stage = METRICS.stage("query_triples", watched=True)
+
+    def _on_rows(rows: List[List[str]]):
+        stage.count(len(rows))
+        with stage.paused():
+            on_rows(rows)
+
+    parser = NameRowsParser(n_columns, _on_rows, batch_size)
+    with AG_CONN(repo) as conn, stage.timed():
+        tuple_query = conn.prepareTupleQuery(QueryLanguage.SPARQL, query)
+        tuple_query.evaluate(output=parser, output_format=TupleFormat.CSV)
+        parser.close()
+
+
+def fetch_raw_triple_rows(
+    repo: str, query: str, n_columns: int, on_rows: Callable[[np.ndarray], None]
+) -> None:
+    # integers of `n_columns` columns, handed to `on_rows` chunk by chunk
+    from franz.openrdf.query.query import QueryLanguage
+    from franz.openrdf.rio.tupleformat import TupleFormat
+
+    stage = METRICS.stage("query_triples", watched=True)
+
+    def _on_rows(rows: np.ndarray):
+        stage.count(len(rows))
+        with stage.paused():
+            on_rows(rows)
+
+    parser = IdRowsParser(n_columns, _on_rows)
+    with AG_CONN(repo) as conn, stage.timed():
+        tuple_query = conn.prepareTupleQuery(QueryLanguage.SPARQL, query)
+        tuple_query.evaluate(output=parser, output_format=TupleFormat.CSV)
+        parser.close()
+
+
+def fetch_triple_ids(
+    repo: str,
+    query: str,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    relation_id: Optional[int] = None,
+    on_ids: Optional[Callable[[np.ndarray], None]] = None,
+) -> np.ndarray:
+    # rows bind ?ent1 ?ent2 and, unless the query is restricted to the
+    # relation `relation_id`, ?rel; ids are handed to `on_ids` batch by batch
+    # if it is given, instead of being collected and returned
+    triple_ids = TripleBuffer()
+    on_ids = on_ids or triple_ids.extend
+    fetch_triple_rows(
+        repo,
+        query,
+        2 if relation_id is not None else 3,
+        lambda rows: on_ids(map_triple_rows(rows, entity2id, relation2id, relation_id)),
+    )
+    return triple_ids.ids
+
+
+def fetch_raw_triple_ids(
+    repo: str,
+    query: str,
+    n_entities: int,
+    n_relations: int,
+    relation_id: Optional[int] = None,
+    on_ids: Optional[Callable[[np.ndarray], None]] = None,
+) -> np.ndarray:
+    # the query selects the hasID values ?h ?t and, unless it is restricted to
+    # the relation `relation_id`, ?r, so rows are parsed straight into ids
+    triple_ids = TripleBuffer()
+    on_ids = on_ids or triple_ids.extend
+    fetch_raw_triple_rows(
+        repo,
+        query,
+        2 if relation_id is not None else 3,
+        lambda rows: on_ids(
+            filter_raw_rows(rows, n_entities, n_relations, relation_id)
+        ),
+    )
+    return triple_ids.ids
+
+
+HAS_ID = "<http://example.org/embeddings#hasID>"
+XSD_INTEGER = "<http://www.w3.org/2001/XMLSchema#integer>"
+
+
+def triples_query(
+    entity_type: URI, relation_type: URI, raw_results: bool, distinct: bool = True
+) -> str:
+    # ?ent1 ?ent2 ?rel, or their hasID values ?h ?t ?r with raw results
+    ent_t = entity_type.toNTriples()
+    rel_t = relation_type.toNTriples()
+    select = "SELECT DISTINCT" if distinct else "SELECT"
+    if raw_results:
+        return f"""{select} ?h ?t ?r WHERE {{
+  ?ent1 a {ent_t} ; {HAS_ID} ?h .
+  ?ent2 a {ent_t} ; {HAS_ID} ?t .
+  ?rel a {rel_t} ; {HAS_ID} ?r .
+  ?ent1 ?rel ?ent2 .
+}}"""
+    return f"""{select} ?ent1 ?ent2 ?rel WHERE {{
+  ?ent1 a {ent_t} .
+  ?ent2 a {ent_t} .
+  ?rel a {rel_t} .
+  ?ent1 ?rel ?ent2 .
+}}"""
+
+
+def partition_query(
+    entity_type: URI, rel: str, raw_results: bool, distinct: bool = True
+) -> str:
+    # ?ent1 ?ent2, or ?h ?t with raw results, of the relation `rel`
+    ent_t = entity_type.toNTriples()
+    select = "SELECT DISTINCT" if distinct else "SELECT"
+    if raw_results:
+        return f"""{select} ?h ?t WHERE {{
+  ?ent1 a {ent_t} ; {HAS_ID} ?h .
+  ?ent2 a {ent_t} ; {HAS_ID} ?t .
+  ?ent1 {URI(rel).toNTriples()} ?ent2 .
+}}"""
+    return f"""{select} ?ent1 ?ent2 WHERE {{
+  ?ent1 a {ent_t} .
+  ?ent2 a {ent_t} .
+  ?ent1 {URI(rel).toNTriples()} ?ent2 .
+}}"""
+
+
 def load_all_triple_ids(
     repo: str,
-    entity2id: bidict[URI, int],
-    relation2id: bidict[URI, int],
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
     entity_type: URI,
     relation_type: URI,
-) -> List[List[int]]:
-    all_triple_ids = []
-    with AG_CONN(repo) as conn:
-        query = f"""SELECT DISTINCT ?ent1 ?ent2 ?rel WHERE {{
-  ?ent1 a {entity_type.toNTriples()} .
-  ?ent2 a {entity_type.toNTriples()} .
+    workers: int = 1,
+    raw_results: bool = False,
+    on_ids: Optional[Callable[[np.ndarray], None]] = None,
+    distinct: bool = True,
+) -> np.ndarray:
+    # without `distinct`, the server may send duplicates, which are dropped
+    # here instead
+    if workers == 1:
+        query = triples_query(entity_type, relation_type, raw_results, distinct)
+        seen = None if distinct else new_triple_set(entity2id, relation2id)
+        if seen is not None and on_ids is not None:
+            on_ids = partial(_on_unique_ids, seen, on_ids)
+        if raw_results:
+            ids = fetch_raw_triple_ids(
+                repo, query, len(entity2id), len(relation2id), on_ids=on_ids
+            )
+        else:
+            ids = fetch_triple_ids(repo, query, entity2id, relation2id, on_ids=on_ids)
+        return ids if seen is None or on_ids is not None else unique_ids(seen, ids)
+
+    # one independent query per relation; partitions are merged in relation
+    # id order so that '-random-state' still reproduces the same split
+    partitions = fetch_partitions(
+        repo,
+        list(relation2id.items()),
+        entity2id,
+        relation2id,
+        entity_type,
+        workers,
+        raw_results,
+        on_ids=on_ids,
+        distinct=distinct,
+    )
+    if not partitions:
+        return np.empty((0, 3), dtype=np.int32)
+    return np.concatenate(partitions)
+
+
+def _on_unique_ids(
+    seen: TripleSet, on_ids: Callable[[np.ndarray], None], ids: np.ndarray
+) -> None:
+    on_ids(unique_ids(seen, ids))
+
+
+def fetch_partitions(
+    repo: str,
+    relations: List[Tuple[str, int]],
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    workers: int = 1,
+    raw_results: bool = False,
+    entity_remap: Optional[np.ndarray] = None,
+    on_ids: Optional[Callable[[np.ndarray], None]] = None,
+    distinct: bool = True,
+) -> List[np.ndarray]:
+    # triples of every (relation, id) in `relations`; in raw results, hasID
+    # values of entities are translated through `entity_remap` if it is given
+    seen = None if distinct else new_triple_set(entity2id, relation2id)
+    if seen is not None and on_ids is not None:
+        on_ids = partial(_on_unique_ids, seen, on_ids)
+
+    def _fetch_partition(item: Tuple[str, int]) -> np.ndarray:
+        rel, i = item
+        query = partition_query(entity_type, rel, raw_results, distinct)
+        if raw_results and entity_remap is not None:
+            ids = fetch_raw_triple_ids(
+                repo, query, len(entity_remap), len(relation2id), i
+            )
+            ids[:, :2] = entity_remap[ids[:, :2]]
+            # hasID values in the gaps of the vocabulary
+            ids = ids[(ids[:, :2] >= 0).all(axis=1)]
+        elif raw_results:
+            ids = fetch_raw_triple_ids(
+                repo, query, len(entity2id), len(relation2id), i, on_ids
+            )
+        else:
+            ids = fetch_triple_ids(repo, query, entity2id, relation2id, i, on_ids)
+        return ids if seen is None or on_ids is not None else unique_ids(seen, ids)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_fetch_partition, relations))
+
+
+def pipelined_export(
+    repo: str,
+    entity_type: URI,
+    relation_type: URI,
+    workers: int,
+    raw_results: bool,
+    queue_size: int,
+    on_vocabularies: Callable[[Vocabulary, Vocabulary], None],
+    on_ids: Callable[[Optional[int], np.ndarray], None],
+    distinct: bool = True,
+    vocab_cache_dir: Optional[Path] = None,
+) -> Tuple[Vocabulary, Vocabulary]:
+    # Both vocabulary queries and the triple query start at once; query
+    # results, id mapping and `on_ids` run on their own threads, connected by
+    # pipes of `queue_size` batches.  Raw results don't need the vocabularies
+    # until their ids are range checked, so only the mapping stage waits for
+    # them, while `on_vocabularies` runs on this thread.  Batches are handed
+    # to `on_ids` with the id of their relation when there is one query per
+    # relation.  Without `distinct`, duplicates are dropped by the mapping
+    # stage.
+    pipeline = Pipeline()
+    rows_pipe = pipeline.pipe(queue_size)
+    ids_pipe = pipeline.pipe(queue_size)
+    vocabularies = ThreadPoolExecutor(max_workers=2)
+    entity_future = vocabularies.submit(
+        get_entity2id, repo, entity_type, raw_results, vocab_cache_dir
+    )
+    relation_future = vocabularies.submit(
+        get_relation2id, repo, relation_type, raw_results, vocab_cache_dir
+    )
+
+    def _fetch(query: str, relation_id: Optional[int]):
+        def _put(rows):
+            rows_pipe.put((relation_id, rows))
+
+        n_columns = 2 if relation_id is not None else 3
+        if raw_results:
+            fetch_raw_triple_rows(repo, query, n_columns, _put)
+        else:
+            fetch_triple_rows(repo, query, n_columns, _put)
+
+    def _query():
+        if workers == 1:
+            _fetch(
+                triples_query(entity_type, relation_type, raw_results, distinct), None
+            )
+        else:
+            # partitions need the relations, which is a small query
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(
+                    executor.map(
+                        lambda item: _fetch(
+                            partition_query(
+                                entity_type, item[0], raw_results, distinct
+                            ),
+                            item[1],
+                        ),
+                        relation_future.result().items(),
+                    )
+                )
+        rows_pipe.close()
+
+    def _map():
+        entity2id, relation2id = entity_future.result(), relation_future.result()
+        seen = None if distinct else new_triple_set(entity2id, relation2id)
+        for relation_id, rows in rows_pipe:
+            if raw_results:
+                ids = filter_raw_rows(
+                    rows, len(entity2id), len(relation2id), relation_id
+                )
+            else:
+                ids = map_triple_rows(rows, entity2id, relation2id, relation_id)
+            if seen is not None:
+                ids = unique_ids(seen, ids)
+            ids_pipe.put((relation_id, ids))
+        ids_pipe.close()
+
+    def _write():
+        for relation_id, ids in ids_pipe:
+            on_ids(relation_id, ids)
+
+    pipeline.stage("query", _query)
+    pipeline.stage("map", _map)
+    pipeline.stage("write", _write)
+    try:
+        entity2id, relation2id = entity_future.result(), relation_future.result()
+        on_vocabularies(entity2id, relation2id)
+    except BaseException:
+        pipeline.failed.set()
+        raise
+    finally:
+        vocabularies.shutdown(wait=False)
+    pipeline.join()
+    return entity2id, relation2id
+
+
+def fetch_change_markers(
+    repo: str, relation_type: URI
+) -> Tuple[int, Dict[str, Checksum]]:
+    # size of the repository, and the number of statements of every relation
+    # with the sum of a hash of their subjects and objects, so that replacing
+    # a statement by another of the same relation changes it too
+    from franz.openrdf.query.query import QueryLanguage
+
+    query = f"""SELECT ?rel (COUNT(*) AS ?n) ({digest_sum("?s", "?o")} AS ?digest) WHERE {{
   ?rel a {relation_type.toNTriples()} .
-  ?ent1 ?rel ?ent2 .
-}}"""
-        tuple_query = conn.prepareTupleQuery(QueryLanguage.SPARQL, query)
-        with tuple_query.evaluate() as res:
+  ?s ?rel ?o .
+}} GROUP BY ?rel"""
+    with AG_CONN(repo) as conn:
+        size = conn.size()
+        checksums = {}
+        with conn.prepareTupleQuery(QueryLanguage.SPARQL, query).evaluate() as res:
             for bindings in res:
-                ent1 = bindings.getValue("ent1")
-                ent2 = bindings.getValue("ent2")
-                rel = bindings.getValue("rel")
-                if ent1 in entity2id and ent2 in entity2id and rel in relation2id:
-                    all_triple_ids.append(
-                        [entity2id[ent1], entity2id[ent2], relation2id[rel]]
-                    )
-    return all_triple_ids
+                checksums[bindings.getValue("rel").getURI()] = Checksum(
+                    bindings.getValue("n").intValue(),
+                    bindings.getValue("digest").intValue(),
+                )
+    return size, checksums
+
+
+def load_incremental_triple_ids(
+    repo: str,
+    snapshot_dir: Path,
+    entity_type: URI,
+    relation_type: URI,
+    workers: int = 1,
+    raw_results: bool = False,
+    distinct: bool = True,
+    vocab_cache_dir: Optional[Path] = None,
+) -> Tuple[Vocabulary, Vocabulary, np.ndarray]:
+    # Names keep the ids of the last export and new names are appended, so
+    # ids no longer follow hasID values of the repository, which may also
+    # have gaps once names have been removed.  Only relations whose checksum
+    # has changed are fetched again.
+    snapshot = load_snapshot(snapshot_dir, repo, entity_type, relation_type)
+    size, checksums = fetch_change_markers(repo, relation_type)
+    if snapshot is not None and (snapshot.size, snapshot.checksums) == (
+        size,
+        checksums,
+    ):
+        logging.info("'%s' has not changed since the last export", repo)
+        return snapshot.entity2id, snapshot.relation2id, snapshot.triple_ids
+
+    try:
+        repo_entity2id, entity_ids = fetch_sparse_vocabulary(
+            repo, entity_type, raw_results, vocab_cache_dir
+        )
+        repo_relation2id, _ = fetch_sparse_vocabulary(
+            repo, relation_type, raw_results, vocab_cache_dir
+        )
+    except ValueError as err:
+        sys.exit(f"Illegal vocabulary in '{repo}': {err}")
+    if snapshot is None:
+        logging.info("No snapshot found in '%s'", snapshot_dir)
+        entity2id, relation2id = repo_entity2id, repo_relation2id
+        old_ids, old_checksums = np.empty((0, 3), dtype=np.int32), {}
+    else:
+        entity2id = snapshot.entity2id.merged(repo_entity2id)
+        relation2id = snapshot.relation2id.merged(repo_relation2id)
+        old_ids, old_checksums = snapshot.triple_ids, snapshot.checksums
+        # triples of entities that are gone can hide in any relation
+        if (repo_entity2id.lookup(list(snapshot.entity2id.names())) < 0).any():
+            logging.info("Entities have been removed from '%s'", repo)
+            old_checksums = {}
+
+    current = [(rel, i) for rel, i in relation2id.items() if rel in repo_relation2id]
+    changed = [
+        (rel, i) for rel, i in current if checksums.get(rel) != old_checksums.get(rel)
+    ]
+    logging.info(
+        "Fetching %d of %d relations from '%s'", len(changed), len(current), repo
+    )
+    # raw results hold hasID values, which are translated to the export's ids
+    entity_remap = None
+    dense = not len(entity_ids) or entity_ids[-1] == len(entity_ids) - 1
+    if raw_results and (entity2id is not repo_entity2id or not dense):
+        entity_remap = np.full(
+            entity_ids[-1] + 1 if len(entity_ids) else 0, -1, dtype=np.int32
+        )
+        entity_remap[entity_ids] = entity2id.lookup(list(repo_entity2id.names()))
+    fetched = dict(
+        zip(
+            (i for _, i in changed),
+            fetch_partitions(
+                repo,
+                changed,
+                entity2id,
+                relation2id,
+                entity_type,
+                workers,
+                raw_results,
+                entity_remap,
+                distinct=distinct,
+            ),
+        )
+    )
+
+    # merged in relation id order, like 'load_all_triple_ids' does
+    order = np.argsort(old_ids[:, 2], kind="stable")
+    bounds = np.searchsorted(old_ids[order, 2], np.arange(len(relation2id) + 1))
+    partitions = [
+        fetched[i] if i in fetched else old_ids[order[bounds[i] : bounds[i + 1]]]
+        for _, i in current
+    ]
+    triple_ids = (
+        np.concatenate(partitions) if partitions else np.empty((0, 3), dtype=np.int32)
+    )
+    save_snapshot(
+        snapshot_dir,
+        Snapshot(size, checksums, entity2id, relation2id, triple_ids),
+        repo,
+        entity_type,
+        relation_type,
+    )
+    return entity2id, relation2id, triple_ids
 
 
 def split_triples(
-    triple_ids: List[List[int]],
+    triple_ids: np.ndarray,
     train_size: float,
     validate_size: float,
     random_state: Optional[int],
-):
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     total = len(triple_ids)
     train_offset = int(total * train_size)
     validate_offset = int(total * (train_size + validate_size))
 
-    if random_state:
-        random.seed(random_state)
-
-    random.shuffle(triple_ids)
+    # None draws a fresh seed, 0 is a seed like any other
+    rng = np.random.default_rng(random_state)
+    triple_ids = triple_ids[rng.permutation(total)]
     return (
         triple_ids[0:train_offset],
         triple_ids[train_offset:validate_offset],
@@ -124,12 +725,99 @@ def split_triples(
     )
 
 
-def write_triples(output_dir: Path, fname: str, triple_ids: List[List[int]]):
-    with output_dir.joinpath(fname).open("w") as fp:
-        fp.write(f"{len(triple_ids)}\n")
-        for ids in triple_ids:
-            fp.write(f"{ids[0]}\t{ids[1]}\t{ids[2]}\n")
-    logging.info("'%s' has been written", fname)
+class SplitWriter:
+    # Assigns every triple to train, valid or test by a seeded hash of its ids
+    # and appends it to that file right away, so that nothing but the current
+    # batch is held in memory.  The sizes of the splits follow the ratios only
+    # approximately, but a triple always lands in the same split for the same
+    # seed, whatever the order the triples arrive in.
+    def __init__(
+        self,
+        output_dir: Path,
+        train_size: float,
+        validate_size: float,
+        seed: int,
+        output_format: str = "text",
+    ):
+        self._bounds = np.array([train_size, train_size + validate_size])
+        self._seed = seed
+        # one list of writers per split, one writer per output format
+        self._writers = [
+            [
+                (
+                    path,
+                    TripleWriter(path)
+                    if path.suffix == ".txt"
+                    else TripleArrayWriter(path),
+                )
+                for path in output_paths(output_dir, fname, output_format)
+            ]
+            for fname in ("train2id.txt", "valid2id.txt", "test2id.txt")
+        ]
+        self._lock = threading.Lock()
+
+    def write(self, ids: np.ndarray) -> None:
+        with METRICS.timed("split"):
+            split = np.searchsorted(
+                self._bounds, hash_fractions(ids, self._seed), side="right"
+            )
+        with self._lock, METRICS.timed("write") as stage:
+            for k, writers in enumerate(self._writers):
+                part = ids[split == k]
+                for _, writer in writers:
+                    writer.write(part)
+        stage.count(len(ids))
+
+    def close(self) -> None:
+        for writers in self._writers:
+            for path, writer in writers:
+                writer.close()
+                logging.info(
+                    "'%s' has been written with %d triples", path.name, len(writer)
+                )
+
+
+def write_triples(
+    output_dir: Path, fname: str, triple_ids: np.ndarray, output_format: str = "text"
+):
+    for path in output_paths(output_dir, fname, output_format):
+        with METRICS.timed("write") as stage:
+            if path.suffix == ".txt":
+                write_triple_ids(path, triple_ids)
+            else:
+                save_triple_ids(path, triple_ids)
+        stage.count(len(triple_ids), path.stat().st_size)
+        logging.info("'%s' has been written", path.name)
+
+
+def read_split(output_dir: Path, fname: str, output_format: str) -> np.ndarray:
+    # a split written by this export, from its binary file if there is one
+    path = output_paths(output_dir, fname, output_format)[-1]
+    return load_triple_ids(path) if path.suffix == ".npy" else read_triple_ids(path)
+
+
+def write_auxiliary_files(
+    output_dir: Path,
+    all_triple_ids: np.ndarray,
+    test: np.ndarray,
+    n_entities: int,
+    n_relations: int,
+):
+    # what OpenKE's 'n-n.py' derives from the splits, written next to them
+    with METRICS.timed("auxiliary") as stage:
+        n_constrained = write_type_constrain(
+            output_dir.joinpath("type_constrain.txt"), all_triple_ids, n_entities
+        )
+        counts = write_test_categories(
+            output_dir, all_triple_ids, test, n_entities, n_relations
+        )
+    stage.count(len(all_triple_ids))
+    logging.info(
+        "'type_constrain.txt' has been written with %d relations", n_constrained
+    )
+    for fname, n in counts.items():
+        logging.info("'%s' has been written with %d triples", fname, n)
+    logging.info("'test2id_all.txt' has been written with %d triples", len(test))
 
 
 @plac.annotations(
@@ -154,7 +842,7 @@ def write_triples(output_dir: Path, fname: str, triple_ids: List[List[int]]):
         "option",
     ),
     random_state=(
-        "An integer to intialize the random state which will be using during splitting data; it's usually used for reproducibility",
+        "A non-negative integer to intialize the random state which will be using during splitting data; it's usually used for reproducibility",
         "option",
     ),
     entity_type=(
@@ -165,6 +853,66 @@ def write_triples(output_dir: Path, fname: str, triple_ids: List[List[int]]):
         "Type of relations, default to rdf:Property if not given; Must be a valid uri",
         "option",
     ),
+    workers=(
+        "Number of connections running one query per relation at the same time, instead of a single query for all triples; default to be 1",
+        "option",
+    ),
+    raw_results=(
+        "If given, query results are parsed in large chunks, and triples are fetched as ids, instead of being decoded row by row",
+        "flag",
+    ),
+    incremental=(
+        "If given, a snapshot of the export is kept, so that the next export only fetches the relations that have changed; Ids of existing entities and relations are kept and new ones are appended",
+        "flag",
+    ),
+    snapshot_dir=(
+        "Folder of the snapshot used by 'incremental'; default to be '.ag-transe-snapshot' in 'output_dir'",
+        "option",
+    ),
+    streaming_split=(
+        "If given, every triple is assigned to train, valid or test by a hash of its ids seeded with 'random_state', and written while the query is still running, instead of shuffling all triples in memory; The sizes of the splits follow the ratios approximately",
+        "flag",
+    ),
+    output_format=(
+        "One of 'text', 'binary' and 'both'; 'binary' writes the folders 'entity2id' and 'relation2id' and the files 'train2id.npy', 'valid2id.npy', 'test2id.npy' instead of the OpenKE text files, all loadable with numpy.load(mmap_mode='r'); default to be 'text'",
+        "option",
+    ),
+    pipelined=(
+        "If given, the vocabulary and triple queries start at once, and query results, id mapping and writing 'train2id.txt', 'valid2id.txt', 'test2id.txt' run on their own threads connected by bounded queues; Triples are only written while the query runs with 'streaming_split'; Conflicts with 'incremental'",
+        "flag",
+    ),
+    queue_size=(
+        "Number of batches each queue of 'pipelined' holds before the stage feeding it waits; default to be 8",
+        "option",
+    ),
+    dedup=(
+        "If given, triples are queried without DISTINCT and duplicates are dropped here instead of by the server",
+        "flag",
+    ),
+    vocab_cache=(
+        "If given, the vocabularies fetched from 'repo' are kept on disk, and later exports read them from there while the number of names and the sum of a hash of every id with its URI, computed by 'repo', are the same",
+        "flag",
+    ),
+    vocab_cache_dir=(
+        "Folder of the vocabularies kept by 'vocab_cache'; default to be 'ag-transe-cli/vocabularies' in '$XDG_CACHE_HOME' or '~/.cache'",
+        "option",
+    ),
+    auxiliary_files=(
+        "If given, 'type_constrain.txt', '1-1.txt', '1-n.txt', 'n-1.txt', 'n-n.txt' and 'test2id_all.txt' are also written, as OpenKE's 'n-n.py' would write them from the splits",
+        "flag",
+    ),
+    metrics=(
+        "File to write wall and CPU time, rows, bytes and throughput of every stage, peak memory and latency of server calls to, as JSON",
+        "option",
+    ),
+    progress=(
+        "If given, the number of rows received from queries so far is logged every few seconds, with their rate",
+        "flag",
+    ),
+    profile=(
+        "File to dump cProfile statistics of the main thread to; They can be read with 'pstats' or 'snakeviz'",
+        "option",
+    ),
 )
 def export_data(
     output_dir: str,
@@ -175,91 +923,243 @@ def export_data(
     random_state: Optional[int],
     entity_type: Optional[str],
     relation_type: Optional[str],
+    workers: Optional[str],
+    raw_results: bool,
+    incremental: bool,
+    snapshot_dir: Optional[str],
+    streaming_split: bool,
+    output_format: Optional[str],
+    pipelined: bool,
+    queue_size: Optional[str],
+    dedup: bool,
+    vocab_cache: bool,
+    vocab_cache_dir: Optional[str],
+    auxiliary_files: bool,
+    metrics: Optional[str],
+    progress: bool,
+    profile: Optional[str],
 ):
-    if not output_dir:
-        sys.exit("'output_dir' is not given")
-    output_dir = Path(output_dir).absolute()
-    if not output_dir.exists():
-        output_dir.mkdir(parents=True)
-    if output_dir.exists() and not output_dir.is_dir():
-        sys.exit(f"'output_dir' is not a directory: '{output_dir}'")
-
-    if not repo:
-        sys.exit("Name of the repository is required")
-
-    if ag_env:
-        ag_env = Path(ag_env)
-        if not ag_env.exists():
-            sys.exit(f"ag_env file doesn't exist: '{ag_env.absolute()}''")
-        try:
-            load_dotenv(ag_env, verbose=True)
-        except Exception as _:
-            logging.warning(
-                f"Cannot load environment variables from ag_env file: '{ag_env.absolute()}'"
-            )
+    with recording(
+        metrics, progress, profile, lambda: {"server_calls": latencies()}
+    ):
+        if not output_dir:
+            sys.exit("'output_dir' is not given")
+        output_dir = Path(output_dir).absolute()
+        if not output_dir.exists():
+            output_dir.mkdir(parents=True)
+        if output_dir.exists() and not output_dir.is_dir():
+            sys.exit(f"'output_dir' is not a directory: '{output_dir}'")
+
+        if not repo:
+            sys.exit("Name of the repository is required")
+
+        if ag_env:
+            from dotenv import load_dotenv
+
+            ag_env = Path(ag_env)
+            if not ag_env.exists():
+                sys.exit(f"ag_env file doesn't exist: '{ag_env.absolute()}''")
+            try:
+                load_dotenv(ag_env, verbose=True)
+            except Exception as _:
+                logging.warning(
+                    f"Cannot load environment variables from ag_env file: '{ag_env.absolute()}'"
+                )
 
-    if not train_size:
-        train_size = 0.6
-    elif isinstance(train_size, str):
-        try:
-            train_size = float(train_size)
-            if train_size < 0.0 or train_size > 1.0:
+        if not train_size:
+            train_size = 0.6
+        elif isinstance(train_size, str):
+            try:
+                train_size = float(train_size)
+                if train_size < 0.0 or train_size > 1.0:
+                    sys.exit(f"train_size must be a valid float number: {train_size}")
+            except Exception as _:
                 sys.exit(f"train_size must be a valid float number: {train_size}")
-        except Exception as _:
-            sys.exit(f"train_size must be a valid float number: {train_size}")
-
-    if not validate_size:
-        validate_size = 0.2
-    elif isinstance(validate_size, str):
-        try:
-            validate_size = float(validate_size)
-            if validate_size < 0.0 or validate_size > 1.0:
+
+        if not validate_size:
+            validate_size = 0.2
+        elif isinstance(validate_size, str):
+            try:
+                validate_size = float(validate_size)
+                if validate_size < 0.0 or validate_size > 1.0:
+                    sys.exit(
+                        f"validate_size must be a valid float number: {validate_size}"
+                    )
+            except Exception as _:
                 sys.exit(f"validate_size must be a valid float number: {validate_size}")
-        except Exception as _:
-            sys.exit(f"validate_size must be a valid float number: {validate_size}")
 
-    test_size = 1.0 - train_size - validate_size
-    if test_size < 0.0 or test_size > 1.0:
-        sys.exit(f"test_size must be a valid float number: {test_size}")
+        test_size = 1.0 - train_size - validate_size
+        if test_size < 0.0 or test_size > 1.0:
+            sys.exit(f"test_size must be a valid float number: {test_size}")
+
+        if train_size + validate_size + test_size > 1.0:
+            sys.exit(
+                f"Illegal train_size and validate_size: '{train_size}', '{validate_size}'"
+            )
+
+        if random_state is not None:
+            try:
+                random_state = int(random_state)
+            except Exception as _:
+                sys.exit(f"random_state must be an integer: {random_state}")
+            # seeds of numpy generators and of the split hash can't be negative
+            if random_state < 0:
+                sys.exit(f"random_state must not be negative: {random_state}")
+
+        if not entity_type:
+            entity_type = RDFS.CLASS
+        elif is_url(entity_type):
+            entity_type = URI(entity_type)
+        else:
+            sys.exit(f"'entity_type' is not a valid uri: '{entity_type}'")
 
-    if train_size + validate_size + test_size > 1.0:
-        sys.exit(
-            f"Illegal train_size and validate_size: '{train_size}', '{validate_size}'"
+        if not relation_type:
+            relation_type = RDF.PROPERTY
+        elif is_url(relation_type):
+            relation_type = URI(relation_type)
+        else:
+            sys.exit(f"'relation_type' is not a valid uri: '{relation_type}'")
+
+        workers = parse_positive_int("workers", workers, 1)
+        queue_size = parse_positive_int("queue_size", queue_size, 8)
+        if pipelined and incremental:
+            sys.exit("'pipelined' conflicts with 'incremental'")
+
+        vocab_cache_dir = (
+            (Path(vocab_cache_dir) if vocab_cache_dir else default_cache_dir())
+            if vocab_cache
+            else None
         )
 
-    if random_state:
-        try:
-            random_state = int(random_state)
-        except Exception as _:
-            sys.exit(f"random_state must be an integer: {random_state}")
+        if not output_format:
+            output_format = "text"
+        elif output_format not in OUTPUT_FORMATS:
+            sys.exit(
+                f"output_format must be one of {', '.join(OUTPUT_FORMATS)}: '{output_format}'"
+            )
 
-    if not entity_type:
-        entity_type = RDFS.CLASS
-    elif validators.url(entity_type):
-        entity_type = URI(entity_type)
-    else:
-        sys.exit(f"'entity_type' is not a valid uri: '{entity_type}'")
+        writer = None
+        if streaming_split:
+            writer = SplitWriter(
+                output_dir,
+                train_size,
+                validate_size,
+                random_state if random_state is not None else secrets.randbits(64),
+                output_format,
+            )
 
-    if not relation_type:
-        relation_type = RDF.PROPERTY
-    elif validators.url(relation_type):
-        relation_type = URI(relation_type)
-    else:
-        sys.exit(f"'relation_type' is not a valid uri: '{relation_type}'")
+        if pipelined:
+            partitions: Dict[Optional[int], TripleBuffer] = {}
 
-    entity2id = get_entity2id(repo, entity_type)
-    relation2id = get_relation2id(repo, relation_type)
-    write_entity2id_relation2id(output_dir, entity2id, relation2id)
+            def _on_ids(relation_id: Optional[int], ids: np.ndarray):
+                if writer is not None:
+                    writer.write(ids)
+                else:
+                    partitions.setdefault(relation_id, TripleBuffer()).extend(ids)
 
-    all_triple_ids = load_all_triple_ids(
-        repo, entity2id, relation2id, entity_type, relation_type
-    )
-    train, validate, test = split_triples(
-        all_triple_ids, train_size, validate_size, random_state
-    )
-    write_triples(output_dir, "train2id.txt", train)
-    write_triples(output_dir, "valid2id.txt", validate)
-    write_triples(output_dir, "test2id.txt", test)
+            entity2id, relation2id = pipelined_export(
+                repo,
+                entity_type,
+                relation_type,
+                workers,
+                raw_results,
+                queue_size,
+                lambda entity2id, relation2id: write_entity2id_relation2id(
+                    output_dir, entity2id, relation2id, output_format
+                ),
+                _on_ids,
+                not dedup,
+                vocab_cache_dir,
+            )
+            # merged in relation id order, like 'load_all_triple_ids' does
+            all_triple_ids = (
+                np.concatenate(
+                    [
+                        partitions[k].ids
+                        for k in sorted(partitions, key=lambda k: -1 if k is None else k)
+                    ]
+                )
+                if partitions
+                else np.empty((0, 3), dtype=np.int32)
+            )
+        elif incremental:
+            entity2id, relation2id, all_triple_ids = load_incremental_triple_ids(
+                repo,
+                Path(snapshot_dir)
+                if snapshot_dir
+                else output_dir.joinpath(".ag-transe-snapshot"),
+                entity_type,
+                relation_type,
+                workers,
+                raw_results,
+                not dedup,
+                vocab_cache_dir,
+            )
+        else:
+            entity2id = get_entity2id(repo, entity_type, raw_results, vocab_cache_dir)
+            relation2id = get_relation2id(
+                repo, relation_type, raw_results, vocab_cache_dir
+            )
+            all_triple_ids = None
+        if not pipelined:
+            write_entity2id_relation2id(
+                output_dir, entity2id, relation2id, output_format
+            )
+
+        if writer is not None:
+            if all_triple_ids is None:
+                load_all_triple_ids(
+                    repo,
+                    entity2id,
+                    relation2id,
+                    entity_type,
+                    relation_type,
+                    workers,
+                    raw_results,
+                    writer.write,
+                    not dedup,
+                )
+            elif not pipelined:
+                writer.write(all_triple_ids)
+            writer.close()
+            if auxiliary_files:
+                # the splits were not kept in memory, so they are read back
+                train, validate, test = (
+                    read_split(output_dir, fname, output_format)
+                    for fname in ("train2id.txt", "valid2id.txt", "test2id.txt")
+                )
+                write_auxiliary_files(
+                    output_dir,
+                    np.concatenate([train, validate, test]),
+                    test,
+                    len(entity2id),
+                    len(relation2id),
+                )
+            return
+
+        if all_triple_ids is None:
+            all_triple_ids = load_all_triple_ids(
+                repo,
+                entity2id,
+                relation2id,
+                entity_type,
+                relation_type,
+                workers,
+                raw_results,
+                distinct=not dedup,
+            )
+        with METRICS.timed("split") as stage:
+            train, validate, test = split_triples(
+                all_triple_ids, train_size, validate_size, random_state
+            )
+        stage.count(len(all_triple_ids))
+        write_triples(output_dir, "train2id.txt", train, output_format)
+        write_triples(output_dir, "valid2id.txt", validate, output_format)
+        write_triples(output_dir, "test2id.txt", test, output_format)
+        if auxiliary_files:
+            write_auxiliary_files(
+                output_dir, all_triple_ids, test, len(entity2id), len(relation2id)
+            )
 
 
 if __name__ == "__main__":
@@ -5,25 +5,63 @@ Author: Tianyu Gu (gty@franz.com)
 """
 
 
-import bz2
 import logging
 import os
+import posixpath
+import queue
 import sys
-import urllib.parse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from shutil import copyfile
-from tempfile import TemporaryDirectory
-from typing import Generator, Optional, Tuple
+from tempfile import TemporaryDirectory, gettempdir
+from typing import TYPE_CHECKING, BinaryIO, Dict, Generator, List, Optional, Tuple
 
+import numpy as np
 import plac
-import validators
-from bidict import bidict
-from dotenv import load_dotenv
-from franz.openrdf.model.value import URI
-from franz.openrdf.repository.repository import RepositoryConnection
-from franz.openrdf.vocabulary import RDF, RDFS
 
-from ag_transe_cli.connection import AG_CONN
+from ag_transe_cli.binary import (
+    binary_path,
+    has_binary_layout,
+    load_triple_ids as load_binary_triple_ids,
+    save_triple_ids,
+    training_file,
+)
+from ag_transe_cli.bulk import deferred_indexing, load_server_file
+from ag_transe_cli.checkpoint import Checkpoint, Unit, batch_digest
+from ag_transe_cli.compression import CODECS, open_compressed
+from ag_transe_cli.connection import AG_CONN, latencies, session
+from ag_transe_cli.delta import (
+    TRIPLE_FILES,
+    VOCAB_FILES,
+    apply_delta,
+    file_digest,
+    invalidate_manifest,
+    load_manifest,
+    plan_delta,
+    save_manifest,
+)
+from ag_transe_cli.metrics import METRICS, recording
+from ag_transe_cli.ntriples import (
+    TripleFormatter,
+    append_file,
+    init_serializer,
+    serialize_part,
+    vocabulary_blocks_iter,
+)
+from ag_transe_cli.terms import RDF, RDFS, URI
+from ag_transe_cli.triples import TripleSet, fits_int64_keys, read_triple_ids
+from ag_transe_cli.uris import (
+    InvalidName,
+    MalformedLine,
+    is_url,
+    line_ranges,
+    read_vocabulary,
+)
+from ag_transe_cli.utils import parse_positive_int
+from ag_transe_cli.vocab import Vocabulary
+
+if TYPE_CHECKING:
+    from franz.openrdf.repository.repository import RepositoryConnection
 
 logging.basicConfig(
     format="%(levelname)s - %(asctime)s: %(message)s",
@@ -33,83 +71,699 @@ logging.basicConfig(
 
 
 def get_entity2id_relation2id(
-    dir: Path, ent_prefix: Optional[str], rel_prefix: Optional[str]
-) -> Tuple[bidict[str, int], bidict[str, int]]:
+    dir: Path, ent_prefix: Optional[str], rel_prefix: Optional[str], workers: int = 1
+) -> Tuple[Vocabulary, Vocabulary]:
     def _read_file(path: Path, nm: Optional[str]):
-        d = {}
-        with path.open("r") as f:
-            f.readline()
-            for line in f:
-                s, i = line.split("\t")
-                if validators.url(urllib.parse.quote(s, safe="~@#$&()*!+=:;,.?/'")):
-                    s = urllib.parse.quote(s, safe="~@#$&()*!+=:;,.?/'")
-                    d[s] = int(i)
-                else:
-                    if not nm:
-                        sys.exit(
-                            f"Content does not contain valid URIs, but namespace are not given: '{path}'"
-                        )
-                    d[URI(namespace=nm, localname=s).getURI()] = int(i)
-        return bidict(d)
+        with METRICS.timed("read_vocabulary", "names") as stage:
+            try:
+                pairs = read_vocabulary(path, nm, workers)
+            except MalformedLine as err:
+                sys.exit(f"{err}; Expected a name and an integer id separated by a tab")
+            except InvalidName as err:
+                # with a namespace, every name is made a URI
+                sys.exit(f"{err}, and no namespace is given")
+            try:
+                d = Vocabulary.from_pairs(pairs)
+            except ValueError as err:
+                sys.exit(f"Illegal vocabulary in '{path}': {err}")
+        stage.count(len(d), path.stat().st_size)
+        return d
 
+    def _load_binary(path: Path):
+        # names were normalized by the export that wrote them
+        with METRICS.timed("read_vocabulary", "names") as stage:
+            try:
+                d = Vocabulary.load(path)
+            except (OSError, ValueError) as err:
+                sys.exit(f"Illegal vocabulary in '{path}': {err}")
+        stage.count(len(d), path.joinpath("names.npy").stat().st_size)
+        return d
+
+    if has_binary_layout(dir):
+        return (
+            _load_binary(binary_path(dir, "entity2id.txt")),
+            _load_binary(binary_path(dir, "relation2id.txt")),
+        )
     return (
         _read_file(dir.joinpath("entity2id.txt"), ent_prefix),
         _read_file(dir.joinpath("relation2id.txt"), rel_prefix),
     )
 
 
-def read_triples_iter(
-    path: Path, entity2id: bidict[str, int], relation2id: bidict[str, int]
-) -> Generator[str, None, None]:
-    with path.open("r") as f:
-        f.readline()
-        for line in f:
-            e1_id, e2_id, rel_id = line.split()
-            yield f"<{entity2id.inverse[int(e1_id)]}> <{relation2id.inverse[int(rel_id)]}> <{entity2id.inverse[int(e2_id)]}> .\n"
+def load_triple_ids(path: Path, n_entities: int, n_relations: int) -> np.ndarray:
+    with METRICS.timed("read_triple_ids", "triples") as stage:
+        try:
+            if path.suffix == ".npy":
+                ids = load_binary_triple_ids(path)
+            else:
+                ids = read_triple_ids(path)
+        except ValueError as err:
+            sys.exit(str(err))
+    stage.count(len(ids), path.stat().st_size)
+    if len(ids) and (
+        ids.min() < 0
+        or ids[:, :2].max() >= n_entities
+        or ids[:, 2].max() >= n_relations
+    ):
+        sys.exit(
+            f"Triple ids in '{path}' are out of the range of 'entity2id.txt' or 'relation2id.txt'"
+        )
+    return ids
+
+
+def drop_duplicates(seen: TripleSet, ids: np.ndarray, source: str) -> np.ndarray:
+    # the first occurrence of every triple over all files is kept
+    with METRICS.timed("dedup", "triples") as stage:
+        keep = seen.add(ids)
+    stage.count(len(ids))
+    n_duplicates = len(ids) - int(keep.sum())
+    if n_duplicates:
+        logging.info("%d duplicate triples dropped from '%s'", n_duplicates, source)
+        ids = ids[keep]
+    return ids
+
+
+def ntriples_units_iter(
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    block_size: int,
+    start: Tuple[str, int] = (VOCAB_FILES[0], 0),
+    dedup: bool = False,
+) -> Generator[Tuple[str, int, int, int, bytes], None, None]:
+    # (file, first row, end row, number of triples, block) of every block from
+    # row `start[1]` of file `start[0]` on; a resumed import always starts at
+    # the end row of a block, so it regenerates the same blocks.  With `dedup`,
+    # rows are the ones left after dropping duplicates, so the files before
+    # `start[0]` are still read to learn which triples were seen.
+    sources = VOCAB_FILES + TRIPLE_FILES
+    first = sources.index(start[0])
+    formatter = None
+    seen = TripleSet(len(entity2id), len(relation2id)) if dedup else None
+    serialize = METRICS.stage("serialize", unit="triples")
+    for k, source in enumerate(sources):
+        if k < first and (seen is None or source in VOCAB_FILES):
+            continue
+        offset = start[1] if k == first else 0
+        if source in VOCAB_FILES:
+            d, type_ = (
+                (entity2id, entity_type)
+                if source == "entity2id.txt"
+                else (relation2id, relation_type)
+            )
+            # two triples per name
+            blocks, per_row = vocabulary_blocks_iter(d, type_, block_size, offset), 2
+        else:
+            if formatter is None:
+                formatter = TripleFormatter(entity2id, relation2id)
+            ids = load_triple_ids(
+                training_file(training_data_dir, source),
+                len(entity2id),
+                len(relation2id),
+            )
+            if seen is not None:
+                ids = drop_duplicates(seen, ids, source)
+            if k < first:
+                continue
+            blocks, per_row = formatter.blocks(ids[offset:], block_size), 1
+        for n, block in METRICS.timed_iter("serialize", blocks, "triples"):
+            serialize.count(n, len(block))
+            yield source, offset, offset + n // per_row, n, block
+            offset += n // per_row
+
+
+def ntriples_blocks_iter(
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    block_size: int,
+    dedup: bool = False,
+) -> Generator[Tuple[int, bytes], None, None]:
+    for _, _, _, n, block in ntriples_units_iter(
+        training_data_dir,
+        entity2id,
+        relation2id,
+        entity_type,
+        relation_type,
+        block_size,
+        dedup=dedup,
+    ):
+        yield n, block
+
+
+def count_all_triples(
+    training_data_dir: Path, entity2id: Vocabulary, relation2id: Vocabulary
+) -> int:
+    # from the header lines of the '*2id.txt' files, for reporting progress
+    n_triples = 2 * (len(entity2id) + len(relation2id))
+    for fname in TRIPLE_FILES:
+        path = training_file(training_data_dir, fname)
+        if path.suffix == ".npy":
+            n_triples += len(np.load(path, mmap_mode="r"))
+            continue
+        with path.open("r") as fp:
+            try:
+                n_triples += int(fp.readline())
+            except ValueError as _:
+                pass
+    return n_triples
+
+
+def triple_file_ranges(path: Path, n_ranges: int) -> List[Tuple[int, int]]:
+    # byte ranges of lines of a '*2id.txt' file, or row ranges of a '*2id.npy'
+    if path.suffix != ".npy":
+        return line_ranges(path, n_ranges)
+    n_rows = len(np.load(path, mmap_mode="r"))
+    step = max(-(-n_rows // n_ranges), 1)
+    return [(start, min(start + step, n_rows)) for start in range(0, n_rows, step)]
+
+
+def write_all_triples_parallel(
+    fp: BinaryIO,
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    workers: int,
+    block_size: int = 100000,
+    dedup: bool = False,
+) -> int:
+    # Ranges of the '*2id' files are serialized to part files by `workers`
+    # processes while the names are written here, then the parts are appended
+    # in order, so the output is the same as the one of a single process.
+    # Parts are kept next to `fp` if it is a file, so they are copied within
+    # one file system.
+    name = getattr(fp, "name", None)
+    serialize = METRICS.stage("serialize", unit="triples")
+    stage = METRICS.stage(
+        "write",
+        count_all_triples(training_data_dir, entity2id, relation2id),
+        "triples",
+        watched=True,
+    )
+    n_triples = 0
+    with TemporaryDirectory(
+        dir=Path(name).parent if isinstance(name, str) else None
+    ) as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        entity_dir = tmp_dir.joinpath("entity2id")
+        relation_dir = tmp_dir.joinpath("relation2id")
+        entity2id.save(entity_dir)
+        relation2id.save(relation_dir)
+        paths = [training_file(training_data_dir, fname) for fname in TRIPLE_FILES]
+        if dedup:
+            # the triples left are saved as '.npy' files, which the
+            # processes read in row ranges
+            seen = TripleSet(len(entity2id), len(relation2id))
+            for k, fname in enumerate(TRIPLE_FILES):
+                ids = drop_duplicates(
+                    seen,
+                    load_triple_ids(paths[k], len(entity2id), len(relation2id)),
+                    fname,
+                )
+                paths[k] = binary_path(tmp_dir, fname)
+                save_triple_ids(paths[k], ids)
+        tasks = [
+            (path, start, end)
+            for path in paths
+            for start, end in triple_file_ranges(path, 4 * workers)
+        ]
+        parts = [tmp_dir.joinpath(f"part-{k}.nt") for k in range(len(tasks))]
+        with METRICS.timed("serialize_parts", "triples") as parts_stage:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_serializer,
+                initargs=(entity_dir, relation_dir),
+            ) as executor:
+                futures = [
+                    executor.submit(serialize_part, path, start, end, part, block_size)
+                    for (path, start, end), part in zip(tasks, parts)
+                ]
+                for d, type_ in ((entity2id, entity_type), (relation2id, relation_type)):
+                    for n, block in METRICS.timed_iter(
+                        "serialize",
+                        vocabulary_blocks_iter(d, type_, block_size),
+                        "triples",
+                    ):
+                        serialize.count(n, len(block))
+                        with stage.timed():
+                            fp.write(block)
+                        stage.count(n, len(block))
+                        n_triples += n
+                for future, part in zip(futures, parts):
+                    try:
+                        n, n_bytes = future.result()
+                    except ValueError as err:
+                        sys.exit(str(err))
+                    parts_stage.count(n, n_bytes)
+                    with stage.timed():
+                        append_file(fp, part)
+                    stage.count(n, n_bytes)
+                    part.unlink()
+                    n_triples += n
+    return n_triples
+
+
+def write_all_triples(
+    fp: BinaryIO,
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    workers: int = 1,
+    dedup: bool = False,
+) -> int:
+    if workers > 1:
+        return write_all_triples_parallel(
+            fp,
+            training_data_dir,
+            entity2id,
+            relation2id,
+            entity_type,
+            relation_type,
+            workers,
+            dedup=dedup,
+        )
+    stage = METRICS.stage(
+        "write",
+        count_all_triples(training_data_dir, entity2id, relation2id),
+        "triples",
+        watched=True,
+    )
+    n_triples = 0
+    for n, block in ntriples_blocks_iter(
+        training_data_dir,
+        entity2id,
+        relation2id,
+        entity_type,
+        relation_type,
+        100000,
+        dedup,
+    ):
+        with stage.timed():
+            fp.write(block)
+        stage.count(n, len(block))
+        n_triples += n
+    return n_triples
 
 
 def load_all_triples(
-    conn: Optional[RepositoryConnection],
-    save_to: Optional[Path],
+    conn: "RepositoryConnection",
     training_data_dir: Path,
-    entity2id: bidict[str, int],
-    relation2id: bidict[str, int],
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
     entity_type: URI,
     relation_type: URI,
+    serialize_workers: int = 1,
+    dedup: bool = False,
 ) -> None:
     with TemporaryDirectory() as tmp_dir:
         nt_file = Path(tmp_dir).joinpath("triples.nt")
-        with nt_file.open("w") as fp:
-            pred = URI("http://example.org/embeddings#hasID")
-            for ent, i in entity2id.items():
-                fp.write(
-                    f"<{ent}> {RDF.TYPE.toNTriples()} {entity_type.toNTriples()} .\n"
-                )
-                fp.write(
-                    f'<{ent}> {pred.toNTriples()} "{i}"^^<http://www.w3.org/2001/XMLSchema#integer> .\n'
-                )
-            for rel, i in relation2id.items():
-                fp.write(
-                    f"<{rel}> {RDF.TYPE.toNTriples()} {relation_type.toNTriples()} .\n"
+        with nt_file.open("wb") as fp:
+            n_triples = write_all_triples(
+                fp,
+                training_data_dir,
+                entity2id,
+                relation2id,
+                entity_type,
+                relation_type,
+                serialize_workers,
+                dedup,
+            )
+        with METRICS.timed("upload", "triples") as stage:
+            conn.addFile(str(nt_file), format="application/n-triples")
+        stage.count(n_triples, nt_file.stat().st_size)
+        with METRICS.timed("commit"):
+            conn.commit()
+
+
+def bulk_load_all_triples(
+    repo: str,
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    bulk_load_dir: Path,
+    server_load_dir: Optional[str],
+    serialize_workers: int = 1,
+    dedup: bool = False,
+) -> int:
+    # the file is written to `bulk_load_dir`, which the server sees as
+    # `server_load_dir`, e.g. through a shared mount, or as the same folder
+    nt_file = bulk_load_dir.joinpath(f".ag-transe-{repo}-{os.getpid()}.nt")
+    server_path = (
+        posixpath.join(server_load_dir, nt_file.name)
+        if server_load_dir
+        else str(nt_file)
+    )
+    try:
+        with nt_file.open("wb") as fp:
+            n_triples = write_all_triples(
+                fp,
+                training_data_dir,
+                entity2id,
+                relation2id,
+                entity_type,
+                relation_type,
+                serialize_workers,
+                dedup,
+            )
+        # the server may run as another user
+        nt_file.chmod(0o644)
+        n_bytes = nt_file.stat().st_size
+        with AG_CONN(repo) as conn:
+            with deferred_indexing(conn):
+                logging.info("Server is loading '%s' into '%s'", server_path, repo)
+                with METRICS.timed("bulk_load", "triples") as stage:
+                    load_server_file(conn, server_path)
+                    conn.commit()
+                stage.count(n_triples, n_bytes)
+                logging.info(
+                    "%d triples (%.1f MiB) loaded in %.1fs, %.0f triples/s",
+                    n_triples,
+                    n_bytes / (1 << 20),
+                    stage.busy,
+                    n_triples / stage.busy if stage.busy else 0.0,
                 )
-                fp.write(
-                    f'<{rel}> {pred.toNTriples()} "{i}"^^<http://www.w3.org/2001/XMLSchema#integer> .\n'
+    finally:
+        if nt_file.exists():
+            nt_file.unlink()
+    return n_triples
+
+
+def stream_all_triples(
+    repo: str,
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    batch_size: int,
+    commit_every: int,
+    workers: int,
+    checkpoint: Optional[Checkpoint] = None,
+    start: Tuple[str, int] = (VOCAB_FILES[0], 0),
+    base_size: int = 0,
+    dedup: bool = False,
+) -> Tuple[int, int]:
+    # batches are dealt out to `workers` uploaders, each of them owns a
+    # connection with its own session and commits its own shard every
+    # `commit_every` batches; the queue bounds how many batches can be
+    # generated ahead of the uploads.  A checkpoint needs the batches
+    # to be committed in order, so it is only kept with a single uploader.
+    batches = queue.Queue(maxsize=2 * workers)
+    failed = threading.Event()
+    sent = [base_size]
+    uploads = METRICS.stage(
+        "upload",
+        None
+        if base_size
+        else count_all_triples(training_data_dir, entity2id, relation2id),
+        "triples",
+        watched=True,
+    )
+    commits = METRICS.stage("commit")
+
+    def _upload_shard(worker_id: int) -> int:
+        n_batches = 0
+        last = None
+
+        def _commit(conn):
+            with commits.timed():
+                if checkpoint is not None and last is not None:
+                    checkpoint.begin(last)
+                    conn.commit()
+                    checkpoint.commit(last)
+                else:
+                    conn.commit()
+
+        try:
+            with AG_CONN(repo) as conn, session(conn):
+                while not failed.is_set():
+                    try:
+                        item = batches.get(timeout=1)
+                    except queue.Empty:
+                        continue
+                    if item is None:
+                        break
+                    (source, first, end, n), batch = item
+                    with uploads.timed():
+                        conn.addData(batch, rdf_format="application/n-triples")
+                    uploads.count(n, len(batch))
+                    if checkpoint is not None:
+                        sent[0] += n
+                        last = Unit(source, first, end, batch_digest(batch), sent[0])
+                    n_batches += 1
+                    if commit_every > 0 and n_batches % commit_every == 0:
+                        _commit(conn)
+                if failed.is_set():
+                    # another uploader failed; the batches of this one since
+                    # its last commit are dropped as well
+                    conn.rollback()
+                    return n_batches
+                _commit(conn)
+        except BaseException:
+            failed.set()
+            logging.error(
+                "Uploader %d failed; batches not yet committed by any uploader are rolled back, but committed ones stay in '%s'",
+                worker_id,
+                repo,
+            )
+            raise
+        logging.debug("Worker %d committed %d batches", worker_id, n_batches)
+        return n_batches
+
+    def _put(item: Optional[Tuple[Tuple[str, int, int, int], bytes]]):
+        while not failed.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    n_triples = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_upload_shard, i) for i in range(workers)]
+        try:
+            for source, first, end, n, batch in ntriples_units_iter(
+                training_data_dir,
+                entity2id,
+                relation2id,
+                entity_type,
+                relation_type,
+                batch_size,
+                start,
+                dedup,
+            ):
+                if failed.is_set():
+                    break
+                _put(((source, first, end, n), batch))
+                n_triples += n
+        except BaseException:
+            failed.set()
+            raise
+        for _ in futures:
+            _put(None)
+        n_batches = sum(future.result() for future in futures)
+
+    with AG_CONN(repo) as conn:
+        size = conn.size()
+    if size != base_size + n_triples:
+        sys.exit(
+            f"Repository '{repo}' has {size} triples after loading, but {base_size + n_triples} triples were sent"
+        )
+    return n_triples, n_batches
+
+
+def checkpoint_header(
+    repo: str,
+    training_data_dir: Path,
+    entity_uri_prefix: Optional[str],
+    relation_uri_prefix: Optional[str],
+    entity_type: URI,
+    relation_type: URI,
+    batch_size: int,
+    dedup: bool = False,
+) -> dict:
+    return {
+        "repo": repo,
+        "files": {
+            fname: file_digest(training_file(training_data_dir, fname))
+            for fname in VOCAB_FILES + TRIPLE_FILES
+        },
+        "entity_uri_prefix": entity_uri_prefix,
+        "relation_uri_prefix": relation_uri_prefix,
+        "entity_type": str(entity_type),
+        "relation_type": str(relation_type),
+        "batch_size": batch_size,
+        # only recorded when given, so that older checkpoints still match
+        **({"dedup": True} if dedup else {}),
+    }
+
+
+def resume_point(
+    checkpoint: Checkpoint,
+    repo: str,
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    batch_size: int,
+    dedup: bool = False,
+) -> Optional[Tuple[Tuple[str, int], int]]:
+    # (file and row to continue from, size of the repository), or None when
+    # the import has to start from scratch
+    state = Checkpoint.load(checkpoint.path)
+    if state is None:
+        logging.info("No checkpoint found at '%s'", checkpoint.path)
+        return None
+    if state["header"] != checkpoint.header:
+        sys.exit(
+            f"Checkpoint '{checkpoint.path}' was written for other training data or options, run without 'resume' to start over"
+        )
+    if not AG_CONN.exists(repo):
+        sys.exit(f"Repository '{repo}' to be resumed does not exist")
+    with AG_CONN(repo) as conn:
+        size = conn.size()
+    # the last commit may have succeeded without being recorded
+    for unit in (state["committed"], state["pending"]):
+        if unit is not None and unit.size == size:
+            break
+    else:
+        if size == 0:
+            return None
+        sys.exit(
+            f"Repository '{repo}' has {size} triples, which matches no commit recorded in '{checkpoint.path}'"
+        )
+    _, _, _, _, batch = next(
+        ntriples_units_iter(
+            training_data_dir,
+            entity2id,
+            relation2id,
+            entity_type,
+            relation_type,
+            batch_size,
+            (unit.source, unit.start),
+            dedup,
+        )
+    )
+    if batch_digest(batch) != unit.digest:
+        sys.exit(
+            f"Rows {unit.start} to {unit.end} of '{unit.source}' differ from the last committed batch in '{checkpoint.path}'"
+        )
+    checkpoint.committed = unit
+    return (unit.source, unit.end), unit.size
+
+
+def import_delta(
+    repo: str,
+    manifest_dir: Path,
+    training_data_dir: Path,
+    entity2id: Vocabulary,
+    relation2id: Vocabulary,
+    entity_type: URI,
+    relation_type: URI,
+    triple_ids: Dict[str, np.ndarray],
+    batch_size: int,
+) -> bool:
+    # False means that all triples have to be loaded again
+    manifest = load_manifest(manifest_dir)
+    if manifest is None:
+        logging.info("No manifest found in '%s'", manifest_dir)
+        return False
+    if (manifest["entity_type"], manifest["relation_type"]) != (
+        str(entity_type),
+        str(relation_type),
+    ):
+        logging.info("Types of entities or relations have changed")
+        return False
+    if not AG_CONN.exists(repo):
+        logging.info("Repo '%s' does not exist", repo)
+        return False
+
+    with AG_CONN(repo) as conn:
+        size = conn.size()
+        if size != manifest["size"]:
+            logging.info(
+                "Repo '%s' has %d triples, but %d triples were recorded in the manifest",
+                repo,
+                size,
+                manifest["size"],
+            )
+            return False
+        digests = {
+            fname: file_digest(training_file(training_data_dir, fname))
+            for fname in VOCAB_FILES + TRIPLE_FILES
+        }
+        if digests == manifest["files"]:
+            logging.info("Repo '%s' is already up to date", repo)
+            return True
+        delta = plan_delta(
+            manifest_dir,
+            manifest,
+            entity2id,
+            relation2id,
+            triple_ids,
+            conn.getDuplicateSuppressionPolicy() not in (None, "false"),
+        )
+        if delta is None:
+            return False
+        logging.info(
+            "Removing %d triples from and adding %d triples and %d new names to '%s'",
+            delta.n_removed,
+            len(delta.added),
+            len(entity2id) - delta.n_entities + len(relation2id) - delta.n_relations,
+            repo,
+        )
+        # removals and additions are committed together, once the size of
+        # the repository in the session is the expected one
+        with session(conn):
+            expected = size + apply_delta(
+                conn,
+                delta,
+                entity2id,
+                relation2id,
+                entity_type,
+                relation_type,
+                batch_size,
+            )
+            size = conn.size()
+            if size != expected:
+                logging.warning(
+                    "Repo '%s' would have %d triples after the delta import, but %d triples were expected; rolling it back",
+                    repo,
+                    size,
+                    expected,
                 )
-            for fname in ("train2id.txt", "test2id.txt", "valid2id.txt"):
-                for triple in read_triples_iter(
-                    training_data_dir.joinpath(fname), entity2id, relation2id
-                ):
-                    fp.write(triple)
-        if conn:
-            conn.addFile(str(nt_file), format="application/n-triples")
+                conn.rollback()
+                return False
+            # the repository no longer matches the manifest until it is saved
+            invalidate_manifest(manifest_dir)
             conn.commit()
-        else:
-            copyfile(nt_file, save_to)
+    save_manifest(
+        manifest_dir,
+        training_data_dir,
+        entity2id,
+        relation2id,
+        triple_ids,
+        entity_type,
+        relation_type,
+        size,
+    )
+    return True
 
 
 @plac.annotations(
     training_data_dir=(
-        "Path to training data where it must contain 'entity2id.txt', 'relation2id.txt', 'train2id.txt', 'valid2id.txt', 'test2id.txt'",
+        "Path to training data where it must contain 'entity2id.txt', 'relation2id.txt', 'train2id.txt', 'valid2id.txt', 'test2id.txt', or the binary layout written by export with 'output_format', which is preferred if both are found",
         "option",
     ),
     repo=(
@@ -125,9 +779,17 @@ def load_all_triples(
         "option",
     ),
     compress=(
-        "If given, the saved ntriples serialization will be compressed; Only meaningful when 'save_ntriples_to' is valid",
+        "If given, the saved ntriples serialization will be compressed while it is being written; Only meaningful when 'save_ntriples_to' is valid",
         "flag",
     ),
+    codec=(
+        "Compression codec, one of 'gzip', 'bz2' and 'xz'; default to be 'bz2'; Only meaningful when 'compress' is given",
+        "option",
+    ),
+    compress_workers=(
+        "Number of processes compressing independent blocks into a multi-stream archive; default to be 1; Only meaningful when 'compress' is given",
+        "option",
+    ),
     entity_uri_prefix=(
         "Namespace for entities; Only applied when entities from 'entity2id.txt' are not URIs",
         "option",
@@ -144,6 +806,74 @@ def load_all_triples(
         "Type of relations, default to rdf:Property if not given; Must be a valid uri",
         "option",
     ),
+    vocab_workers=(
+        "Number of processes normalizing the names from 'entity2id.txt' and 'relation2id.txt'; default to be 1",
+        "option",
+    ),
+    serialize_workers=(
+        "Number of processes serializing parts of 'train2id.txt', 'valid2id.txt', 'test2id.txt' into NTriples, which are then joined by kernel-side copies; default to be 1; Not applied when 'stream' is given",
+        "option",
+    ),
+    stream=(
+        "If given, triples are sent to 'repo' in batches while they are being generated, instead of through a temporary NTriples file; Only meaningful when 'repo' is valid",
+        "flag",
+    ),
+    batch_size=(
+        "Number of triples in each batch sent to 'repo' when 'stream' is given; default to be 100000",
+        "option",
+    ),
+    commit_every=(
+        "Commit after this many batches when 'stream' is given, 0 means committing only at the end; Batches are sent in a session, so they are only visible in 'repo' once committed; default to be 10",
+        "option",
+    ),
+    workers=(
+        "Number of connections loading batches into 'repo' at the same time; 'stream' is implied when it is greater than 1; default to be 1",
+        "option",
+    ),
+    delta=(
+        "If given, only the triples that changed since the last import with 'delta' are removed from or added to 'repo', as recorded in a manifest; Falls back to loading all triples when the changes can't be applied incrementally",
+        "flag",
+    ),
+    manifest_dir=(
+        "Folder of the manifest used by 'delta'; default to be '.ag-transe-manifest/<repo>' in 'training_data_dir'",
+        "option",
+    ),
+    resume=(
+        "If given, an interrupted import continues after the last batch committed to 'repo', as recorded in 'checkpoint_file', instead of renewing 'repo'; 'stream' is implied and 'workers' must be 1",
+        "flag",
+    ),
+    checkpoint_file=(
+        "File recording the last committed batch when streaming over one connection; default to be '.ag-transe-checkpoint/<repo>.json' in 'training_data_dir'",
+        "option",
+    ),
+    bulk_load=(
+        "If given, the NTriples file is written to 'bulk_load_dir' and loaded by the server itself, without duplicate suppression and with one index, and the other indices are rebuilt at the end; Only meaningful when 'repo' is valid, and conflicts with 'stream', 'resume' and 'workers'",
+        "flag",
+    ),
+    bulk_load_dir=(
+        "Folder the server can read, where the NTriples file for 'bulk_load' is written; default to be the temporary folder, which only works when the server runs on this machine",
+        "option",
+    ),
+    server_load_dir=(
+        "Path of 'bulk_load_dir' as seen by the server, e.g. when it is a shared mount; default to be 'bulk_load_dir'",
+        "option",
+    ),
+    dedup=(
+        "If given, triples that appear more than once in or across 'train2id.txt', 'valid2id.txt', 'test2id.txt' are only sent or written once, the first time they appear",
+        "flag",
+    ),
+    metrics=(
+        "File to write wall and CPU time, rows, bytes and throughput of every stage, peak memory and latency of server calls to, as JSON",
+        "option",
+    ),
+    progress=(
+        "If given, the number of triples written or uploaded so far is logged every few seconds, with their rate and ETA",
+        "flag",
+    ),
+    profile=(
+        "File to dump cProfile statistics of the main thread to; They can be read with 'pstats' or 'snakeviz'",
+        "option",
+    ),
 )
 def import_data(
     training_data_dir: str,
@@ -151,115 +881,321 @@ def import_data(
     ag_env: str,
     save_ntriples_to: str,
     compress: bool,
+    codec: Optional[str],
+    compress_workers: Optional[str],
     entity_uri_prefix: str,
     relation_uri_prefix: str,
     entity_type: Optional[str],
     relation_type: Optional[str],
+    vocab_workers: Optional[str],
+    serialize_workers: Optional[str],
+    stream: bool,
+    batch_size: Optional[str],
+    commit_every: Optional[str],
+    workers: Optional[str],
+    delta: bool,
+    manifest_dir: Optional[str],
+    resume: bool,
+    checkpoint_file: Optional[str],
+    bulk_load: bool,
+    bulk_load_dir: Optional[str],
+    server_load_dir: Optional[str],
+    dedup: bool,
+    metrics: Optional[str],
+    progress: bool,
+    profile: Optional[str],
 ):
-    training_data_dir = Path(training_data_dir)
-    if not training_data_dir.exists():
-        sys.exit(f"Training Data folder does not exist: {training_data_dir}")
-    if not training_data_dir.is_dir():
-        sys.exit(f"Training Data folder is not a folder: {training_data_dir}")
-    else:
-        filenames = [f.name for f in training_data_dir.glob("*.txt")]
-        for file in (
-            "entity2id.txt",
-            "relation2id.txt",
-            "train2id.txt",
-            "valid2id.txt",
-            "test2id.txt",
-        ):
-            if file not in filenames:
-                sys.exit(
-                    f"Cannot find '{file}' in Training Data folder: {training_data_dir}"
-                )
+    with recording(
+        metrics, progress, profile, lambda: {"server_calls": latencies()}
+    ):
+        training_data_dir = Path(training_data_dir)
+        if not training_data_dir.exists():
+            sys.exit(f"Training Data folder does not exist: {training_data_dir}")
+        if not training_data_dir.is_dir():
+            sys.exit(f"Training Data folder is not a folder: {training_data_dir}")
+        elif not has_binary_layout(training_data_dir):
+            filenames = [f.name for f in training_data_dir.glob("*.txt")]
+            for file in (
+                "entity2id.txt",
+                "relation2id.txt",
+                "train2id.txt",
+                "valid2id.txt",
+                "test2id.txt",
+            ):
+                if file not in filenames:
+                    sys.exit(
+                        f"Cannot find '{file}' in Training Data folder: {training_data_dir}"
+                    )
 
-    if entity_uri_prefix and not validators.url(entity_uri_prefix):
-        sys.exit(f"Illegal prefix for entity URIs: '{entity_uri_prefix}'")
-    if relation_uri_prefix and not validators.url(relation_uri_prefix):
-        sys.exit(f"Illegal prefix for relation URIs: '{relation_uri_prefix}'")
+        if entity_uri_prefix and not is_url(entity_uri_prefix):
+            sys.exit(f"Illegal prefix for entity URIs: '{entity_uri_prefix}'")
+        if relation_uri_prefix and not is_url(relation_uri_prefix):
+            sys.exit(f"Illegal prefix for relation URIs: '{relation_uri_prefix}'")
 
-    if entity_uri_prefix and relation_uri_prefix:
-        ENT_PREFIX = entity_uri_prefix
-        REL_PREFIX = relation_uri_prefix
-        entity2id, relation2id = get_entity2id_relation2id(
-            training_data_dir, ENT_PREFIX, REL_PREFIX
-        )
-    else:
-        entity2id, relation2id = get_entity2id_relation2id(
-            training_data_dir, None, None
-        )
+        vocab_workers = parse_positive_int("vocab_workers", vocab_workers, 1)
+        if entity_uri_prefix and relation_uri_prefix:
+            ENT_PREFIX = entity_uri_prefix
+            REL_PREFIX = relation_uri_prefix
+            entity2id, relation2id = get_entity2id_relation2id(
+                training_data_dir, ENT_PREFIX, REL_PREFIX, vocab_workers
+            )
+        else:
+            entity2id, relation2id = get_entity2id_relation2id(
+                training_data_dir, None, None, vocab_workers
+            )
+        # duplicates are found by packing every triple into one int64 key
+        if dedup and not fits_int64_keys(len(entity2id), len(relation2id)):
+            sys.exit(
+                f"'dedup' can't be applied to {len(entity2id)} entities and {len(relation2id)} relations, as their triples don't fit in int64 keys"
+            )
 
-    if not entity_type:
-        entity_type = RDFS.CLASS
-    elif validators.url(entity_type):
-        entity_type = URI(entity_type)
-    else:
-        sys.exit(f"'entity_type' is not a valid uri: '{entity_type}'")
+        if not entity_type:
+            entity_type = RDFS.CLASS
+        elif is_url(entity_type):
+            entity_type = URI(entity_type)
+        else:
+            sys.exit(f"'entity_type' is not a valid uri: '{entity_type}'")
 
-    if not relation_type:
-        relation_type = RDF.PROPERTY
-    elif validators.url(relation_type):
-        relation_type = URI(relation_type)
-    else:
-        sys.exit(f"'relation_type' is not a valid uri: '{relation_type}'")
+        if not relation_type:
+            relation_type = RDF.PROPERTY
+        elif is_url(relation_type):
+            relation_type = URI(relation_type)
+        else:
+            sys.exit(f"'relation_type' is not a valid uri: '{relation_type}'")
 
-    if repo and not save_ntriples_to:
-        if ag_env:
-            ag_env = Path(ag_env)
-            if not ag_env.exists():
-                sys.exit(f"ag_env file doesn't exist: '{ag_env.absolute()}''")
+        if not codec:
+            codec = "bz2"
+        elif codec not in CODECS:
+            sys.exit(f"codec must be one of {', '.join(CODECS)}: '{codec}'")
+        compress_workers = parse_positive_int("compress_workers", compress_workers, 1)
+        serialize_workers = parse_positive_int("serialize_workers", serialize_workers, 1)
+
+        batch_size = parse_positive_int("batch_size", batch_size, 100000)
+        workers = parse_positive_int("workers", workers, 1)
+        if commit_every is None:
+            commit_every = 10
+        else:
             try:
-                load_dotenv(ag_env, verbose=True)
+                commit_every = int(commit_every)
             except Exception as _:
-                logging.warning(
-                    f"Cannot load environment variables from ag_env file: '{ag_env.absolute()}'"
+                sys.exit(f"commit_every must be an integer: {commit_every}")
+            if commit_every < 0:
+                sys.exit(f"commit_every must not be negative: {commit_every}")
+        if resume and workers > 1:
+            sys.exit(f"workers must be 1 when 'resume' is given: {workers}")
+        if bulk_load and (stream or resume or workers > 1):
+            sys.exit("'bulk_load' conflicts with 'stream', 'resume' and 'workers'")
+        if bulk_load:
+            bulk_load_dir = Path(bulk_load_dir or gettempdir()).absolute()
+            if not bulk_load_dir.is_dir():
+                sys.exit(f"bulk_load_dir is not a folder: '{bulk_load_dir}'")
+
+        if repo and not save_ntriples_to:
+            if ag_env:
+                from dotenv import load_dotenv
+
+                ag_env = Path(ag_env)
+                if not ag_env.exists():
+                    sys.exit(f"ag_env file doesn't exist: '{ag_env.absolute()}''")
+                try:
+                    load_dotenv(ag_env, verbose=True)
+                except Exception as _:
+                    logging.warning(
+                        f"Cannot load environment variables from ag_env file: '{ag_env.absolute()}'"
+                    )
+
+            if delta:
+                manifest_dir = (
+                    Path(manifest_dir)
+                    if manifest_dir
+                    else training_data_dir.joinpath(".ag-transe-manifest", repo)
                 )
+                triple_ids = {
+                    fname: load_triple_ids(
+                        training_file(training_data_dir, fname),
+                        len(entity2id),
+                        len(relation2id),
+                    )
+                    for fname in TRIPLE_FILES
+                }
+                if dedup:
+                    seen = TripleSet(len(entity2id), len(relation2id))
+                    triple_ids = {
+                        fname: drop_duplicates(seen, ids, fname)
+                        for fname, ids in triple_ids.items()
+                    }
+                if import_delta(
+                    repo,
+                    manifest_dir,
+                    training_data_dir,
+                    entity2id,
+                    relation2id,
+                    entity_type,
+                    relation_type,
+                    triple_ids,
+                    batch_size,
+                ):
+                    return
+                logging.info("Loading all triples to '%s' instead", repo)
+                invalidate_manifest(manifest_dir)
 
-        AG_CONN.renew_or_create(repo)
+            checkpoint, point = None, None
+            if (stream or resume) and workers == 1:
+                checkpoint = Checkpoint(
+                    Path(checkpoint_file)
+                    if checkpoint_file
+                    else training_data_dir.joinpath(
+                        ".ag-transe-checkpoint", f"{repo}.json"
+                    ),
+                    checkpoint_header(
+                        repo,
+                        training_data_dir,
+                        entity_uri_prefix,
+                        relation_uri_prefix,
+                        entity_type,
+                        relation_type,
+                        batch_size,
+                        dedup,
+                    ),
+                )
+            if resume:
+                point = resume_point(
+                    checkpoint,
+                    repo,
+                    training_data_dir,
+                    entity2id,
+                    relation2id,
+                    entity_type,
+                    relation_type,
+                    batch_size,
+                    dedup,
+                )
+            if point is None:
+                AG_CONN.renew_or_create(repo)
+            else:
+                logging.info(
+                    "Resuming from row %d of '%s' with %d triples already in '%s'",
+                    point[0][1],
+                    point[0][0],
+                    point[1],
+                    repo,
+                )
 
-        with AG_CONN(repo) as conn:
-            logging.info("Adding all triples to '%s'", repo)
-            load_all_triples(
-                conn,
-                None,
-                training_data_dir,
-                entity2id,
-                relation2id,
-                entity_type,
-                relation_type,
-            )
-            logging.info("All triples successfully loaded to '%s'", repo)
-    elif save_ntriples_to and not repo:
-        save_ntriples_to = Path(save_ntriples_to).absolute()
-        if save_ntriples_to.exists() and not save_ntriples_to.is_file():
-            sys.exit(
-                f"Path for saving triples (NTriples format) is not a file: '{save_ntriples_to}'"
-            )
-        logging.info("Writing all triples to '%s'", save_ntriples_to)
-        load_all_triples(
-            None,
-            save_ntriples_to,
-            training_data_dir,
-            entity2id,
-            relation2id,
-            entity_type,
-            relation_type,
-        )
-        if compress:
-            with bz2.open(f"{save_ntriples_to}.bz2", "w") as out:
-                with save_ntriples_to.open("rb") as fp:
-                    content = fp.read()
-                out.write(content)
-            os.remove(save_ntriples_to)
-            logging.info(
-                "All triples have been successfully written and archived to '%s.bz2'",
-                save_ntriples_to,
-            )
+            if bulk_load:
+                logging.info("Bulk loading all triples to '%s'", repo)
+                n_triples = bulk_load_all_triples(
+                    repo,
+                    training_data_dir,
+                    entity2id,
+                    relation2id,
+                    entity_type,
+                    relation_type,
+                    bulk_load_dir,
+                    server_load_dir,
+                    serialize_workers,
+                    dedup,
+                )
+                logging.info(
+                    "All %d triples successfully bulk loaded to '%s'", n_triples, repo
+                )
+            elif stream or resume or workers > 1:
+                logging.info(
+                    "Streaming all triples to '%s' in batches of %d over %d connection(s)",
+                    repo,
+                    batch_size,
+                    workers,
+                )
+                n_triples, n_batches = stream_all_triples(
+                    repo,
+                    training_data_dir,
+                    entity2id,
+                    relation2id,
+                    entity_type,
+                    relation_type,
+                    batch_size,
+                    commit_every,
+                    workers,
+                    checkpoint,
+                    *(point or ()),
+                    dedup=dedup,
+                )
+                if checkpoint is not None:
+                    checkpoint.clear()
+                logging.info(
+                    "All %d triples successfully loaded to '%s' in %d batches",
+                    n_triples,
+                    repo,
+                    n_batches,
+                )
+            else:
+                with AG_CONN(repo) as conn:
+                    logging.info("Adding all triples to '%s'", repo)
+                    load_all_triples(
+                        conn,
+                        training_data_dir,
+                        entity2id,
+                        relation2id,
+                        entity_type,
+                        relation_type,
+                        serialize_workers,
+                        dedup,
+                    )
+                    logging.info("All triples successfully loaded to '%s'", repo)
+
+            if delta:
+                with AG_CONN(repo) as conn:
+                    size = conn.size()
+                save_manifest(
+                    manifest_dir,
+                    training_data_dir,
+                    entity2id,
+                    relation2id,
+                    triple_ids,
+                    entity_type,
+                    relation_type,
+                    size,
+                )
+                logging.info("Manifest of '%s' saved to '%s'", repo, manifest_dir)
+        elif save_ntriples_to and not repo:
+            save_ntriples_to = Path(save_ntriples_to).absolute()
+            if save_ntriples_to.exists() and not save_ntriples_to.is_file():
+                sys.exit(
+                    f"Path for saving triples (NTriples format) is not a file: '{save_ntriples_to}'"
+                )
+            if compress:
+                archive = Path(f"{save_ntriples_to}{CODECS[codec]}")
+                logging.info("Writing all triples to '%s'", archive)
+                with open_compressed(archive, codec, compress_workers) as fp:
+                    write_all_triples(
+                        fp,
+                        training_data_dir,
+                        entity2id,
+                        relation2id,
+                        entity_type,
+                        relation_type,
+                        serialize_workers,
+                        dedup,
+                    )
+                logging.info(
+                    "All triples have been successfully written and archived to '%s'",
+                    archive,
+                )
+            else:
+                logging.info("Writing all triples to '%s'", save_ntriples_to)
+                with save_ntriples_to.open("wb") as fp:
+                    write_all_triples(
+                        fp,
+                        training_data_dir,
+                        entity2id,
+                        relation2id,
+                        entity_type,
+                        relation_type,
+                        serialize_workers,
+                        dedup,
+                    )
+                logging.info(
+                    "All triples have been successfully written to '%s'",
+                    save_ntriples_to,
+                )
         else:
-            logging.info(
-                "All triples have been successfully written to '%s'", save_ntriples_to
-            )
-    else:
-        sys.exit("One and only one of 'repo' and 'save_ntriples_to' must be given")
+            sys.exit("One and only one of 'repo' and 'save_ntriples_to' must be given")
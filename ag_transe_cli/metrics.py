@@ -0,0 +1,241 @@
+"""
+File: metrics.py
+Created Date: Saturday, 17th October 2026 9:14:02 am
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import cProfile
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Generator, Iterable, Optional, TypeVar
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+T = TypeVar("T")
+
+# Stages are named pieces of a run, e.g. parsing, serialization, upload or
+# file writing.  A stage is timed by one or more `timed` blocks, which may run
+# on several threads at once and may be nested inside other stages; rows and
+# bytes are counted separately, as they are known.
+
+
+class Stage:
+    def __init__(self, name: str, total: Optional[int] = None, unit: str = "rows"):
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.rows = 0
+        self.bytes = 0
+        self.calls = 0
+        self.busy = 0.0
+        self.cpu = 0.0
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+        self._lock = threading.Lock()
+        self._on_count: Optional[Callable[["Stage"], None]] = None
+
+    @contextmanager
+    def timed(self) -> Generator["Stage", None, None]:
+        # thread CPU time, so that blocks running on other threads don't count
+        start, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield self
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.calls += 1
+                self.busy += end - start
+                self.cpu += time.thread_time() - cpu
+                if self.first is None or start < self.first:
+                    self.first = start
+                self.last = end if self.last is None else max(self.last, end)
+
+    @contextmanager
+    def paused(self) -> Generator[None, None, None]:
+        # time spent in this block, e.g. handing results to the next stage or
+        # waiting for it, is taken off the enclosing `timed` block on this thread
+        start, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.busy -= end - start
+                self.cpu -= time.thread_time() - cpu
+
+    def count(self, rows: int = 0, nbytes: int = 0) -> None:
+        with self._lock:
+            self.rows += rows
+            self.bytes += nbytes
+        if self._on_count is not None:
+            self._on_count(self)
+
+    @property
+    def wall(self) -> float:
+        if self.first is None:
+            return 0.0
+        return self.last - self.first
+
+    def report(self) -> dict:
+        wall = self.wall
+        return {
+            "wall_seconds": wall,
+            "busy_seconds": self.busy,
+            "cpu_seconds": self.cpu,
+            "calls": self.calls,
+            "unit": self.unit,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "rows_per_second": self.rows / wall if wall else None,
+            "bytes_per_second": self.bytes / wall if wall else None,
+        }
+
+
+class Progress:
+    # logs the rows of a stage with their rate and, if the total is known,
+    # the ETA, at most once every `interval` seconds
+    def __init__(self, interval: float = 5.0):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._started: Dict[str, float] = {}
+        self._logged: Dict[str, float] = {}
+
+    def __call__(self, stage: Stage) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            start = self._started.setdefault(stage.name, now)
+            if now - self._logged.get(stage.name, start) < self._interval:
+                return
+            self._logged[stage.name] = now
+        rate = stage.rows / (now - start) if now > start else 0.0
+        if stage.total:
+            eta = (stage.total - stage.rows) / rate if rate else float("inf")
+            logging.info(
+                "%s: %d of %d %s (%.1f%%), %.0f %s/s, ETA %s",
+                stage.name,
+                stage.rows,
+                stage.total,
+                stage.unit,
+                100.0 * stage.rows / stage.total,
+                rate,
+                stage.unit,
+                format_seconds(eta),
+            )
+        else:
+            logging.info(
+                "%s: %d %s, %.0f %s/s", stage.name, stage.rows, stage.unit, rate, stage.unit
+            )
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "unknown"
+    seconds = max(int(seconds), 0)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Stage] = {}
+        self._progress: Optional[Progress] = None
+        self._start = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def reset(self, progress: bool = False) -> None:
+        with self._lock:
+            self._stages = {}
+            self._progress = Progress() if progress else None
+            self._start = time.perf_counter()
+            self._cpu = time.process_time()
+
+    def stage(
+        self,
+        name: str,
+        total: Optional[int] = None,
+        unit: str = "rows",
+        watched: bool = False,
+    ) -> Stage:
+        # progress is only logged for watched stages
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = Stage(name, total, unit)
+            elif total is not None:
+                stage.total = total
+            if watched:
+                stage._on_count = self._progress
+        return stage
+
+    def timed(self, name: str, unit: str = "rows"):
+        return self.stage(name, unit=unit).timed()
+
+    def timed_iter(
+        self, name: str, iterable: Iterable[T], unit: str = "rows"
+    ) -> Generator[T, None, None]:
+        # times the work done by `iterable` itself, not by its consumer
+        stage = self.stage(name, unit=unit)
+        iterator = iter(iterable)
+        while True:
+            with stage.timed():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def report(self, **extra) -> dict:
+        with self._lock:
+            stages = list(self._stages.values())
+        report = {
+            "wall_seconds": time.perf_counter() - self._start,
+            "cpu_seconds": time.process_time() - self._cpu,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {stage.name: stage.report() for stage in stages},
+        }
+        report.update(extra)
+        return report
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def recording(
+    metrics_file: Optional[str],
+    progress: bool,
+    profile_file: Optional[str],
+    extra: Callable[[], dict] = dict,
+) -> Generator[Metrics, None, None]:
+    # the report and the profile are written even if the run fails
+    METRICS.reset(progress)
+    profiler = cProfile.Profile() if profile_file else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield METRICS
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+            logging.info("Profile has been written to '%s'", profile_file)
+        if metrics_file:
+            Path(metrics_file).write_text(json.dumps(METRICS.report(**extra()), indent=2))
+            logging.info("Metrics have been written to '%s'", metrics_file)
@@ -0,0 +1,145 @@
+"""
+File: ntriples.py
+Created Date: Friday, 16th October 2026 7:02:26 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import io
+import os
+import shutil
+from itertools import islice
+from pathlib import Path
+from typing import BinaryIO, Generator, List, Optional, Tuple
+
+import numpy as np
+
+from ag_transe_cli.binary import load_triple_ids
+from ag_transe_cli.terms import RDF, URI
+from ag_transe_cli.triples import read_triple_id_range
+from ag_transe_cli.vocab import Vocabulary
+
+HAS_ID = URI("http://example.org/embeddings#hasID")
+
+
+def uri_table(d: Vocabulary, suffix: str) -> np.ndarray:
+    # ids are dense, so id -> NTriples term becomes plain array indexing
+    table = np.empty(len(d), dtype=object)
+    table[:] = [f"<{name}>{suffix}".encode("utf-8") for name in d.names()]
+    return table
+
+
+def vocabulary_blocks_iter(
+    d: Vocabulary, type_: URI, block_size: int, start: int = 0
+) -> Generator[Tuple[int, bytes], None, None]:
+    # 'rdf:type' and 'hasID' triples of the names with ids from `start` on
+    type_suffix = f"> {RDF.TYPE.toNTriples()} {type_.toNTriples()} .\n"
+    id_prefix = f"> {HAS_ID.toNTriples()} "
+    items = islice(d.items(), start, None)
+    step = max(block_size // 2, 1)
+    while True:
+        chunk = list(islice(items, step))
+        if not chunk:
+            return
+        block = "".join(
+            f'<{name}{type_suffix}<{name}{id_prefix}"{i}"^^<http://www.w3.org/2001/XMLSchema#integer> .\n'
+            for name, i in chunk
+        )
+        yield 2 * len(chunk), block.encode("utf-8")
+
+
+class TripleFormatter:
+    def __init__(self, entity2id: Vocabulary, relation2id: Vocabulary):
+        self.heads = uri_table(entity2id, " ")
+        self.tails = uri_table(entity2id, " .\n")
+        self.relations = uri_table(relation2id, " ")
+
+    def quads(self, ids: np.ndarray) -> List[List[Optional[str]]]:
+        # NTriples terms of each triple in the default graph, for removeQuads
+        return [
+            [
+                self.heads[h][:-1].decode("utf-8"),
+                self.relations[r][:-1].decode("utf-8"),
+                self.tails[t][:-3].decode("utf-8"),
+                None,
+            ]
+            for h, t, r in ids.tolist()
+        ]
+
+    def blocks(
+        self, ids: np.ndarray, block_size: int
+    ) -> Generator[Tuple[int, bytes], None, None]:
+        for start in range(0, len(ids), block_size):
+            block = ids[start : start + block_size]
+            parts = np.empty(3 * len(block), dtype=object)
+            parts[0::3] = self.heads[block[:, 0]]
+            parts[1::3] = self.relations[block[:, 2]]
+            parts[2::3] = self.tails[block[:, 1]]
+            yield len(block), b"".join(parts)
+
+
+# State of a process serializing parts of the triple files, set up once per
+# process from vocabularies saved to disk, so that only paths are pickled.
+_formatter: Optional[TripleFormatter] = None
+
+
+def init_serializer(entity_dir: Path, relation_dir: Path) -> None:
+    global _formatter
+    _formatter = TripleFormatter(
+        Vocabulary.load(entity_dir), Vocabulary.load(relation_dir)
+    )
+
+
+def serialize_part(
+    path: Path, start: int, end: int, part: Path, block_size: int
+) -> Tuple[int, int]:
+    # NTriples of the lines in bytes `start` to `end` of a '*2id.txt' file, or
+    # of the rows `start` to `end` of a '*2id.npy' file, written to `part`;
+    # returns the numbers of triples and bytes
+    if path.suffix == ".npy":
+        ids = load_triple_ids(path)[start:end]
+    else:
+        ids = read_triple_id_range(path, start, end)
+    n_entities, n_relations = len(_formatter.heads), len(_formatter.relations)
+    if len(ids) and (
+        ids.min() < 0
+        or ids[:, :2].max() >= n_entities
+        or ids[:, 2].max() >= n_relations
+    ):
+        raise ValueError(
+            f"Triple ids in '{path}' are out of the range of 'entity2id.txt' or 'relation2id.txt'"
+        )
+    n_bytes = 0
+    with part.open("wb") as fp:
+        for _, block in _formatter.blocks(ids, block_size):
+            n_bytes += fp.write(block)
+    return len(ids), n_bytes
+
+
+def append_file(fp: BinaryIO, path: Path) -> None:
+    # copies `path` to the end of `fp` inside the kernel when both are plain
+    # files, and through Python otherwise, e.g. into a compressed stream, whose
+    # fileno() is the one of the archive
+    with path.open("rb") as part:
+        if not isinstance(fp, (io.BufferedWriter, io.FileIO)):
+            shutil.copyfileobj(part, fp, 1 << 20)
+            return
+        fp.flush()
+        out = fp.fileno()
+        size, copied = os.fstat(part.fileno()).st_size, 0
+        try:
+            while copied < size:
+                if hasattr(os, "copy_file_range"):
+                    n = os.copy_file_range(part.fileno(), out, size - copied)
+                else:
+                    n = os.sendfile(out, part.fileno(), copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            pass
+        # the buffered writer has to learn about the bytes written to its file
+        fp.seek(0, os.SEEK_END)
+        if copied < size:
+            part.seek(copied)
+            shutil.copyfileobj(part, fp, 1 << 20)
@@ -0,0 +1,102 @@
+"""
+File: openke.py
+Created Date: Saturday, 17th October 2026 3:21:48 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ag_transe_cli.triples import write_triple_ids
+
+# Auxiliary files of an OpenKE benchmark, as written by its 'n-n.py' script
+# from 'train2id.txt', 'valid2id.txt' and 'test2id.txt': 'type_constrain.txt'
+# has the heads and the tails seen with every relation, and '1-1.txt',
+# '1-n.txt', 'n-1.txt', 'n-n.txt' and 'test2id_all.txt' sort the test triples
+# by the category of their relation.  Here they are computed with group-bys
+# over the id arrays instead of dictionaries filled line by line.
+
+CATEGORIES = ("1-1.txt", "1-n.txt", "n-1.txt", "n-n.txt")
+# a relation is '-n' on a side when it has this many ids there on average
+MANY = 1.5
+
+
+def _unique_pairs(relations: np.ndarray, others: np.ndarray, n_others: int) -> np.ndarray:
+    # distinct (relation, other) pairs, ordered by relation and then other
+    keys = np.unique(relations.astype(np.int64) * n_others + others)
+    return np.stack(np.divmod(keys, n_others), axis=1)
+
+
+def type_constraints(
+    ids: np.ndarray, n_entities: int
+) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    # (relation, distinct heads, distinct tails) of every relation in `ids`
+    heads = _unique_pairs(ids[:, 2], ids[:, 0], n_entities)
+    tails = _unique_pairs(ids[:, 2], ids[:, 1], n_entities)
+    relations = np.unique(ids[:, 2])
+
+    def _groups(pairs: np.ndarray) -> List[np.ndarray]:
+        starts = np.searchsorted(pairs[:, 0], relations)
+        ends = np.searchsorted(pairs[:, 0], relations, side="right")
+        return [pairs[start:end, 1] for start, end in zip(starts, ends)]
+
+    return [
+        (int(r), h, t) for r, h, t in zip(relations, _groups(heads), _groups(tails))
+    ]
+
+
+def relation_categories(ids: np.ndarray, n_entities: int, n_relations: int) -> np.ndarray:
+    # 0 for 1-1, 1 for 1-n, 2 for n-1 and 3 for n-n, per relation id: the
+    # average number of tails per (head, relation) and of heads per
+    # (relation, tail), over all triples, duplicates included
+    n_triples = np.bincount(ids[:, 2], minlength=n_relations)
+    n_heads = np.bincount(
+        _unique_pairs(ids[:, 2], ids[:, 0], n_entities)[:, 0], minlength=n_relations
+    )
+    n_tails = np.bincount(
+        _unique_pairs(ids[:, 2], ids[:, 1], n_entities)[:, 0], minlength=n_relations
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tails_per_head = n_triples / n_heads
+        heads_per_tail = n_triples / n_tails
+    return (tails_per_head >= MANY).astype(np.int8) + 2 * (heads_per_tail >= MANY)
+
+
+def write_type_constrain(path: Path, ids: np.ndarray, n_entities: int) -> int:
+    constraints = type_constraints(ids, n_entities)
+    with path.open("w") as fp:
+        fp.write(f"{len(constraints)}\n")
+        for r, heads, tails in constraints:
+            for side in (heads, tails):
+                fp.write(
+                    "\t".join(map(str, [r, len(side)] + side.tolist())) + "\n"
+                )
+    return len(constraints)
+
+
+def write_test_categories(
+    output_dir: Path,
+    all_ids: np.ndarray,
+    test_ids: np.ndarray,
+    n_entities: int,
+    n_relations: int,
+) -> Dict[str, int]:
+    # number of test triples written to every category file
+    labels = relation_categories(all_ids, n_entities, n_relations)[test_ids[:, 2]]
+    counts = {}
+    for k, fname in enumerate(CATEGORIES):
+        part = test_ids[labels == k]
+        write_triple_ids(output_dir.joinpath(fname), part)
+        counts[fname] = len(part)
+    with output_dir.joinpath("test2id_all.txt").open("w") as fp:
+        fp.write(f"{len(test_ids)}\n")
+        labelled = np.column_stack([labels, test_ids])
+        for start in range(0, len(labelled), 100000):
+            block = labelled[start : start + 100000]
+            fp.write(
+                ("%d\t%d\t%d\t%d\n" * len(block)) % tuple(block.ravel().tolist())
+            )
+    return counts
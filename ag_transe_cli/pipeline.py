@@ -0,0 +1,94 @@
+"""
+File: pipeline.py
+Created Date: Saturday, 17th October 2026 4:46:09 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import queue
+import threading
+from typing import Any, Callable, Generator, List, Optional
+
+# Stages of a pipeline run on their own threads and hand batches to the next
+# stage through bounded pipes.  A full pipe blocks the stage putting into it,
+# so a slow stage holds back the ones before it instead of letting batches
+# pile up in memory.  Once any stage fails, every put and get gives up, so
+# that the other stages stop instead of waiting forever.
+
+_DONE = object()
+
+
+class PipelineFailed(Exception):
+    pass
+
+
+class Pipe:
+    def __init__(self, maxsize: int, failed: threading.Event, n_producers: int = 1):
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+        self._failed = failed
+        self._open = n_producers
+        self._lock = threading.Lock()
+
+    def put(self, item: Any) -> None:
+        while True:
+            if self._failed.is_set():
+                raise PipelineFailed()
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        # called once by every producer; the last one ends the pipe
+        with self._lock:
+            self._open -= 1
+            last = self._open == 0
+        if last:
+            self.put(_DONE)
+
+    def __iter__(self) -> Generator[Any, None, None]:
+        while True:
+            if self._failed.is_set():
+                raise PipelineFailed()
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+
+class Pipeline:
+    def __init__(self):
+        self.failed = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+
+    def pipe(self, maxsize: int, n_producers: int = 1) -> Pipe:
+        return Pipe(maxsize, self.failed, n_producers)
+
+    def stage(self, name: str, fn: Callable[[], None]) -> None:
+        def _run():
+            try:
+                fn()
+            except PipelineFailed:
+                pass
+            except BaseException as error:
+                # the first error is the one re-raised by `join`
+                with self._lock:
+                    if self._error is None:
+                        self._error = error
+                self.failed.set()
+
+        thread = threading.Thread(target=_run, name=name, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,93 @@
+"""
+File: snapshot.py
+Created Date: Friday, 16th October 2026 9:02:47 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+
+from ag_transe_cli.terms import URI
+from ag_transe_cli.vocab import Vocabulary
+from ag_transe_cli.vocab_cache import Checksum
+
+# What an incremental export saw last time: both vocabularies with the ids
+# they were exported with, all triple ids, and the size of the repository and
+# the checksum of the statements of every relation as markers of changes.
+
+META = "snapshot.json"
+
+
+class Snapshot(NamedTuple):
+    size: int
+    checksums: Dict[str, Checksum]
+    entity2id: Vocabulary
+    relation2id: Vocabulary
+    triple_ids: np.ndarray
+
+
+def _marker(repo: str, entity_type: URI, relation_type: URI) -> dict:
+    return {
+        "repo": repo,
+        "entity_type": str(entity_type),
+        "relation_type": str(relation_type),
+    }
+
+
+def load_snapshot(
+    snapshot_dir: Path, repo: str, entity_type: URI, relation_type: URI
+) -> Optional[Snapshot]:
+    try:
+        meta = json.loads(snapshot_dir.joinpath(META).read_text())
+    except (OSError, ValueError):
+        return None
+    if meta.get("marker") != _marker(repo, entity_type, relation_type):
+        return None
+    # snapshots of earlier versions only have counts of statements
+    if "checksums" not in meta:
+        return None
+    # read into memory, as the same files are written over afterwards
+    return Snapshot(
+        meta["size"],
+        {rel: Checksum(*checksum) for rel, checksum in meta["checksums"].items()},
+        Vocabulary.load(snapshot_dir.joinpath("entity2id"), mmap_mode=None),
+        Vocabulary.load(snapshot_dir.joinpath("relation2id"), mmap_mode=None),
+        np.load(snapshot_dir.joinpath("triples.npy")),
+    )
+
+
+def save_snapshot(
+    snapshot_dir: Path,
+    snapshot: Snapshot,
+    repo: str,
+    entity_type: URI,
+    relation_type: URI,
+) -> None:
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    # arrays without their metadata are never picked up
+    try:
+        snapshot_dir.joinpath(META).unlink()
+    except FileNotFoundError:
+        pass
+    snapshot.entity2id.save(snapshot_dir.joinpath("entity2id"))
+    snapshot.relation2id.save(snapshot_dir.joinpath("relation2id"))
+    np.save(snapshot_dir.joinpath("triples.npy"), snapshot.triple_ids)
+    tmp = snapshot_dir.joinpath(f"{META}.tmp")
+    tmp.write_text(
+        json.dumps(
+            {
+                "marker": _marker(repo, entity_type, relation_type),
+                "size": snapshot.size,
+                "checksums": {
+                    rel: list(checksum) for rel, checksum in snapshot.checksums.items()
+                },
+            },
+            indent=2,
+        )
+    )
+    os.replace(tmp, snapshot_dir.joinpath(META))
@@ -0,0 +1,48 @@
+"""
+File: terms.py
+Created Date: Saturday, 17th October 2026 11:02:47 am
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+# The part of franz's URI and vocabularies that is needed to serialize
+# triples, so that writing them to disk never loads franz.  Names are
+# normalized before they get here, so they are written between angle brackets
+# as they are, like franz does.
+
+
+class URI:
+    __slots__ = ("_uri",)
+
+    def __init__(self, uri: str):
+        self._uri = uri
+
+    def getURI(self) -> str:
+        return self._uri
+
+    def toNTriples(self) -> str:
+        return f"<{self._uri}>"
+
+    def __str__(self) -> str:
+        return self.toNTriples()
+
+    def __repr__(self) -> str:
+        return f"URI({self._uri!r})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, URI) and self._uri == other._uri
+
+    def __hash__(self) -> int:
+        return hash(self._uri)
+
+
+class RDF:
+    NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+    TYPE = URI(NS + "type")
+    PROPERTY = URI(NS + "Property")
+
+
+class RDFS:
+    NS = "http://www.w3.org/2000/01/rdf-schema#"
+    CLASS = URI(NS + "Class")
+
@@ -0,0 +1,180 @@
+"""
+File: triples.py
+Created Date: Friday, 16th October 2026 11:03:18 am
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import mmap
+import threading
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+
+def read_triple_ids(path: Path) -> np.ndarray:
+    # OpenKE '*2id.txt' files: a header line with the number of triples, then
+    # one 'head tail relation' line per triple
+    content = path.read_bytes()
+    header_end = content.find(b"\n")
+    if header_end < 0:
+        return np.empty((0, 3), dtype=np.int32)
+    ids = np.fromstring(content[header_end + 1 :], dtype=np.int64, sep=" ")
+    if ids.size % 3 != 0:
+        raise ValueError(f"Malformed triple ids in '{path}'")
+    return ids.astype(np.int32).reshape(-1, 3)
+
+
+def read_triple_id_range(path: Path, start: int, end: int) -> np.ndarray:
+    # the lines in bytes `start` to `end` of a '*2id.txt' file, which must
+    # begin and end at line boundaries, read through a memory map
+    with path.open("rb") as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[start:end]
+    ids = np.fromstring(data, dtype=np.int64, sep=" ")
+    if ids.size % 3 != 0:
+        raise ValueError(f"Malformed triple ids in '{path}'")
+    return ids.astype(np.int32).reshape(-1, 3)
+
+
+def _format_block(block: np.ndarray) -> str:
+    # one %-format call per block instead of one per line
+    return ("%d\t%d\t%d\n" * len(block)) % tuple(block.ravel().tolist())
+
+
+def write_triple_ids(path: Path, ids: np.ndarray, block_size: int = 100000) -> None:
+    with path.open("w") as fp:
+        fp.write(f"{len(ids)}\n")
+        for start in range(0, len(ids), block_size):
+            fp.write(_format_block(ids[start : start + block_size]))
+
+
+HEADER_WIDTH = 20
+
+
+class TripleWriter:
+    # a '*2id.txt' file written while its triples arrive; the header is
+    # padded with spaces and patched with the number of triples on close
+    def __init__(self, path: Path):
+        self._fp = path.open("w")
+        self._fp.write(" " * HEADER_WIDTH + "\n")
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write(self, ids: np.ndarray) -> None:
+        if len(ids):
+            self._fp.write(_format_block(ids))
+            self._size += len(ids)
+
+    def close(self) -> None:
+        self._fp.seek(0)
+        self._fp.write(str(self._size).ljust(HEADER_WIDTH))
+        self._fp.close()
+
+
+def mix64(x: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer over uint64
+    x = x ^ (x >> np.uint64(30))
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def hash_triple_ids(ids: np.ndarray, seed: int = 0) -> np.ndarray:
+    # uint64 hash of every 'head tail relation' row, independent of any
+    # vocabulary size
+    ids = ids.astype(np.uint64)
+    x = mix64((ids[:, 0] << np.uint64(32)) | ids[:, 1]) ^ ids[:, 2]
+    return mix64(x ^ mix64(np.full(1, seed % (1 << 64), dtype=np.uint64)))
+
+
+def hash_fractions(ids: np.ndarray, seed: int) -> np.ndarray:
+    # uniform floats in [0, 1) from the top 53 bits of the seeded hash
+    return (hash_triple_ids(ids, seed) >> np.uint64(11)) * (1.0 / (1 << 53))
+
+
+def fits_int64_keys(n_entities: int, n_relations: int) -> bool:
+    # whether every triple of the vocabularies packs into one int64 key
+    return n_entities * n_entities * n_relations < 1 << 63
+
+
+def pack_triple_ids(ids: np.ndarray, n_entities: int, n_relations: int) -> np.ndarray:
+    # one int64 key per triple, ordered by head, tail and then relation
+    ids = ids.astype(np.int64)
+    return (ids[:, 0] * n_entities + ids[:, 1]) * n_relations + ids[:, 2]
+
+
+def unpack_triple_ids(keys: np.ndarray, n_entities: int, n_relations: int) -> np.ndarray:
+    ids = np.empty((len(keys), 3), dtype=np.int32)
+    keys, ids[:, 2] = np.divmod(keys, n_relations)
+    ids[:, 0], ids[:, 1] = np.divmod(keys, n_entities)
+    return ids
+
+
+class TripleSet:
+    # Packed int64 keys of the triples seen so far, as sorted runs whose sizes
+    # shrink from the oldest to the newest, merged like a binary counter:
+    # adding n triples costs O(n log n) in all, a lookup is one binary search
+    # per run, and memory is 8 bytes per distinct triple.
+    def __init__(self, n_entities: int, n_relations: int):
+        if not fits_int64_keys(n_entities, n_relations):
+            raise ValueError(
+                f"{n_entities} entities and {n_relations} relations don't fit in int64 keys"
+            )
+        self._n_entities = n_entities
+        self._n_relations = n_relations
+        self._runs: List[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self._runs)
+
+    def add(self, ids: np.ndarray) -> np.ndarray:
+        # mask of the rows of `ids` seen neither before nor earlier in `ids`
+        keys = pack_triple_ids(ids, self._n_entities, self._n_relations)
+        keys, first = np.unique(keys, return_index=True)
+        with self._lock:
+            new = np.ones(len(keys), dtype=bool)
+            for run in self._runs:
+                found = np.minimum(np.searchsorted(run, keys), len(run) - 1)
+                new &= run[found] != keys
+            self._push(keys[new])
+        mask = np.zeros(len(ids), dtype=bool)
+        mask[first[new]] = True
+        return mask
+
+    def _push(self, run: np.ndarray) -> None:
+        if not len(run):
+            return
+        while self._runs and len(self._runs[-1]) <= len(run):
+            # concatenated sorted runs are merged in linear time by timsort
+            run = np.sort(np.concatenate([self._runs.pop(), run]), kind="stable")
+        self._runs.append(run)
+
+
+class TripleBuffer:
+    # growable int32 (n, 3) array of 'head tail relation' ids
+    def __init__(self, capacity: int = 1 << 16):
+        self._ids = np.empty((capacity, 3), dtype=np.int32)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def extend(self, ids: np.ndarray) -> None:
+        end = self._size + len(ids)
+        if end > len(self._ids):
+            grown = np.empty((max(end, 2 * len(self._ids)), 3), dtype=np.int32)
+            grown[: self._size] = self._ids[: self._size]
+            self._ids = grown
+        self._ids[self._size : end] = ids
+        self._size = end
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[: self._size]
@@ -0,0 +1,173 @@
+"""
+File: uris.py
+Created Date: Friday, 16th October 2026 1:26:40 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import re
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+SAFE = "~@#$&()*!+=:;,.?/'"
+
+# characters that urllib.parse.quote never escapes, plus SAFE
+_NO_QUOTING = re.compile(r"[A-Za-z0-9_.\-~@#$&()*!+=:;,?/']*")
+
+# validators.url only accepts these schemes, so anything else is rejected
+# without calling it
+_SCHEME = re.compile(r"(?:https?|ftp)://", re.IGNORECASE)
+_AUTHORITY_END = re.compile(r"[/?#]")
+
+# the part of validators.url's pattern that follows the authority
+_PATH_QUERY_FRAGMENT = re.compile(
+    r"(?:/[-a-z\u00a1-\uffff\U00010000-\U0010ffff0-9._~%!$&'()*+,;=:@/]*)?"
+    r"(?:\?\S*)?"
+    r"(?:#\S*)?",
+    re.UNICODE | re.IGNORECASE,
+)
+
+
+class MalformedLine(ValueError):
+    # a line that is not a name and an integer id separated by a tab
+    def __init__(self, path: Path, number: int, line: str):
+        super().__init__(f"Malformed line {number} in '{path}': {line[:200]!r}")
+        self.path, self.number, self.line = path, number, line
+
+
+class InvalidName(ValueError):
+    # a name that is not a URI, and no prefix was given to make it one
+    def __init__(self, path: Path, number: int, name: str):
+        super().__init__(
+            f"Name on line {number} in '{path}' is not a valid URI: {name!r}"
+        )
+        self.path, self.number, self.name = path, number, name
+
+
+def quote(name: str) -> str:
+    if _NO_QUOTING.fullmatch(name):
+        return name
+    return urllib.parse.quote(name, safe=SAFE)
+
+
+@lru_cache(maxsize=65536)
+def _is_url_authority(authority: str) -> bool:
+    # imported on first use, as it takes a while to load
+    import validators
+
+    return bool(validators.url(authority + "/"))
+
+
+def is_url(name: str) -> bool:
+    # same answer as validators.url, but the expensive check only runs once
+    # per distinct 'scheme://authority', which vocabularies share heavily
+    scheme = _SCHEME.match(name)
+    if not scheme:
+        return False
+    end = _AUTHORITY_END.search(name, scheme.end())
+    end = end.start() if end else len(name)
+    return bool(
+        _PATH_QUERY_FRAGMENT.fullmatch(name, end)
+    ) and _is_url_authority(name[:end])
+
+
+def normalize_name(name: str, prefix: Optional[str]) -> Optional[str]:
+    quoted = quote(name)
+    if is_url(quoted):
+        return quoted
+    if prefix:
+        # same as URI(namespace=prefix, localname=name).getURI()
+        return prefix + name
+    return None
+
+
+def normalize_range(
+    path: Path, start: int, end: int, prefix: Optional[str]
+) -> Tuple[str, List[int], Optional[Tuple[int, bool]]]:
+    # names are returned joined by newlines, which pickles far cheaper than a
+    # list of tuples when the result is sent back from a worker process; on
+    # the first bad line, its index in the range is returned instead, with
+    # whether it is malformed rather than a name that can't be normalized
+    with path.open("rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).decode("utf-8").split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    uris, ids = [], []
+    for k, line in enumerate(lines):
+        try:
+            name, i = line.split("\t")
+            i = int(i)
+        except ValueError:
+            return "", [], (k, True)
+        uri = normalize_name(name, prefix)
+        if uri is None:
+            return "", [], (k, False)
+        uris.append(uri)
+        ids.append(i)
+    return "\n".join(uris), ids, None
+
+
+def _line_at(path: Path, start: int, k: int) -> Tuple[int, str]:
+    # number and content of the k-th line after the byte offset `start`
+    offset = 0
+    with path.open("rb") as f:
+        for number, line in enumerate(f, 1):
+            if offset >= start:
+                if not k:
+                    return number, line.decode("utf-8").rstrip("\n")
+                k -= 1
+            offset += len(line)
+    raise IndexError(k)
+
+
+def line_ranges(path: Path, n_ranges: int) -> List[Tuple[int, int]]:
+    # split everything after the header line into ranges ending at newlines
+    size = path.stat().st_size
+    with path.open("rb") as f:
+        f.readline()
+        start = f.tell()
+        ranges = []
+        for k in range(1, n_ranges + 1):
+            if start >= size:
+                break
+            f.seek(max(start, start + (size - start) * k // n_ranges - 1))
+            f.readline()
+            end = min(f.tell(), size) if k < n_ranges else size
+            if end > start:
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+
+def read_vocabulary(
+    path: Path, prefix: Optional[str], workers: int = 1
+) -> List[Tuple[str, int]]:
+    ranges = line_ranges(path, 4 * workers if workers > 1 else 1)
+    if len(ranges) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    normalize_range,
+                    [path] * len(ranges),
+                    [start for start, _ in ranges],
+                    [end for _, end in ranges],
+                    [prefix] * len(ranges),
+                )
+            )
+    else:
+        results = [normalize_range(path, start, end, prefix) for start, end in ranges]
+    pairs = []
+    for (start, _), (uris, ids, bad) in zip(ranges, results):
+        if bad is not None:
+            k, malformed = bad
+            number, line = _line_at(path, start, k)
+            if malformed:
+                raise MalformedLine(path, number, line)
+            raise InvalidName(path, number, line.split("\t")[0])
+        if ids:
+            pairs.extend(zip(uris.split("\n"), ids))
+    return pairs
@@ -0,0 +1,21 @@
+"""
+File: utils.py
+Created Date: Friday, 16th October 2026 4:40:07 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import sys
+from typing import Optional
+
+
+def parse_positive_int(name: str, value: Optional[str], default: int) -> int:
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except Exception as _:
+        sys.exit(f"{name} must be an integer: {value}")
+    if value <= 0:
+        sys.exit(f"{name} must be a positive integer: {value}")
+    return value
@@ -0,0 +1,162 @@
+"""
+File: vocab.py
+Created Date: Friday, 16th October 2026 3:18:55 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import zlib
+from pathlib import Path
+from typing import Generator, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _hash(key: bytes) -> int:
+    # crc32 is stable across processes, so the index can be saved to disk
+    return zlib.crc32(key)
+
+
+class Vocabulary:
+    # All names are stored in one contiguous utf-8 buffer, name i being
+    # buffer[offsets[i]:offsets[i + 1]]. Name -> id goes through the hashes of
+    # all names sorted together with their ids, so a lookup is a binary search
+    # plus a comparison of the candidates.
+    def __init__(
+        self,
+        buffer: np.ndarray,
+        offsets: np.ndarray,
+        hashes: np.ndarray,
+        order: np.ndarray,
+    ):
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._offsets = offsets
+        self._hashes = hashes
+        self._order = order
+
+    @classmethod
+    def from_names(cls, names: Sequence[str]) -> "Vocabulary":
+        keys = [name.encode("utf-8") for name in names]
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(
+            np.fromiter(map(len, keys), dtype=np.int64, count=len(keys)),
+            out=offsets[1:],
+        )
+        buffer = np.frombuffer(b"".join(keys), dtype=np.uint8)
+        hashes = np.fromiter(map(_hash, keys), dtype=np.uint32, count=len(keys))
+        order = np.argsort(hashes, kind="stable").astype(np.int32)
+        hashes = hashes[order]
+        vocab = cls(buffer, offsets, hashes, order)
+        for i in np.nonzero(hashes[1:] == hashes[:-1])[0]:
+            j = i + 1
+            while j < len(hashes) and hashes[j] == hashes[i]:
+                if vocab.key(order[i]) == vocab.key(order[j]):
+                    raise ValueError(f"Duplicate name: '{vocab.name(order[i])}'")
+                j += 1
+        return vocab
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[str, int]]) -> "Vocabulary":
+        pairs = list(pairs)
+        ids = np.fromiter((i for _, i in pairs), dtype=np.int64, count=len(pairs))
+        order = np.argsort(ids, kind="stable")
+        if not np.array_equal(ids[order], np.arange(len(pairs))):
+            raise ValueError(f"Ids must be unique and in the range of 0 to {len(pairs) - 1}")
+        return cls.from_names([pairs[i][0] for i in order])
+
+    @classmethod
+    def load(cls, path: Path, mmap_mode: Optional[str] = "r") -> "Vocabulary":
+        return cls(
+            *(
+                np.load(path.joinpath(f"{part}.npy"), mmap_mode=mmap_mode)
+                for part in ("names", "offsets", "hashes", "order")
+            )
+        )
+
+    def save(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        for part, array in (
+            ("names", self._buffer),
+            ("offsets", self._offsets),
+            ("hashes", self._hashes),
+            ("order", self._order),
+        ):
+            np.save(path.joinpath(f"{part}.npy"), array)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def __getitem__(self, name: str) -> int:
+        i = self.get(name)
+        if i is None:
+            raise KeyError(name)
+        return i
+
+    def extends(self, other: "Vocabulary") -> bool:
+        # whether every name of `other` keeps its id here
+        n = len(other)
+        return (
+            len(self) >= n
+            and np.array_equal(self._offsets[: n + 1], other._offsets)
+            and np.array_equal(
+                self._buffer[: self._offsets[n]], other._buffer[: other._offsets[n]]
+            )
+        )
+
+    def merged(self, other: "Vocabulary") -> "Vocabulary":
+        # names of `other` that are not here get the next ids, in their order
+        names = list(other.names())
+        missing = [name for name, i in zip(names, self.lookup(names)) if i < 0]
+        if not missing:
+            return self
+        return Vocabulary.from_names(list(self.names()) + missing)
+
+    def key(self, i: int) -> bytes:
+        return self._view[self._offsets[i] : self._offsets[i + 1]].tobytes()
+
+    def name(self, i: int) -> str:
+        return self.key(i).decode("utf-8")
+
+    def get(self, name: str, default: Optional[int] = None) -> Optional[int]:
+        key = name.encode("utf-8")
+        h = _hash(key)
+        j = int(np.searchsorted(self._hashes, h))
+        while j < len(self._hashes) and self._hashes[j] == h:
+            if self.key(self._order[j]) == key:
+                return int(self._order[j])
+            j += 1
+        return default
+
+    def lookup(self, names: List[str]) -> np.ndarray:
+        # ids of `names` with -1 for the missing ones
+        keys = [name.encode("utf-8") for name in names]
+        hashes = np.fromiter(map(_hash, keys), dtype=np.uint32, count=len(keys))
+        positions = np.searchsorted(self._hashes, hashes)
+        candidates = np.minimum(positions, max(len(self._hashes) - 1, 0))
+        ids = np.full(len(keys), -1, dtype=np.int64)
+        if not len(self._hashes):
+            return ids
+        for k in np.nonzero(self._hashes[candidates] == hashes)[0]:
+            j = positions[k]
+            while j < len(self._hashes) and self._hashes[j] == hashes[k]:
+                if self.key(self._order[j]) == keys[k]:
+                    ids[k] = self._order[j]
+                    break
+                j += 1
+        return ids
+
+    def names(self, chunk_size: int = 65536) -> Generator[str, None, None]:
+        # in id order
+        for start in range(0, len(self), chunk_size):
+            offsets = self._offsets[start : start + chunk_size + 1].tolist()
+            data = self._view[offsets[0] : offsets[-1]].tobytes()
+            base = offsets[0]
+            for begin, end in zip(offsets, offsets[1:]):
+                yield data[begin - base : end - base].decode("utf-8")
+
+    def items(self) -> Generator[Tuple[str, int], None, None]:
+        return ((name, i) for i, name in enumerate(self.names()))
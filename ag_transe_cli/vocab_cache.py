@@ -0,0 +1,101 @@
+"""
+File: vocab_cache.py
+Created Date: Saturday, 17th October 2026 10:05:12 am
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from ag_transe_cli.connection import load_ag_env
+from ag_transe_cli.terms import URI
+from ag_transe_cli.vocab import Vocabulary
+
+# Vocabularies fetched from a repository, kept on local disk so that later
+# exports open them memory-mapped instead of scanning all typed names again.
+# A cached vocabulary is only used while the number of names of its type and
+# the sum of the hashes of their ids and URIs, which the server computes
+# without sending any name, are the same as when it was saved.
+
+META = "vocabulary.json"
+
+
+class Checksum(NamedTuple):
+    count: int
+    digest: int
+
+
+def default_cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+    return Path(base).joinpath("ag-transe-cli", "vocabularies")
+
+
+def _marker(repo: str, type_: URI) -> dict:
+    env = load_ag_env()
+    return {
+        "host": env["host"],
+        "port": env["port"],
+        "catalog": os.environ.get("AGRAPH_CATALOG", ""),
+        "repo": repo,
+        "type": str(type_),
+    }
+
+
+def cache_path(cache_dir: Path, repo: str, type_: URI) -> Path:
+    # one folder per server, catalog, repository and type
+    marker = _marker(repo, type_)
+    digest = hashlib.sha1(json.dumps(marker, sort_keys=True).encode("utf-8"))
+    name = re.sub(r"[^\w.-]", "_", repo)
+    return cache_dir.joinpath(f"{name}-{digest.hexdigest()[:16]}")
+
+
+def load_cached_vocabulary(
+    cache_dir: Path, repo: str, type_: URI, checksum: Checksum
+) -> Optional[Vocabulary]:
+    path = cache_path(cache_dir, repo, type_)
+    try:
+        meta = json.loads(path.joinpath(META).read_text())
+        if meta.get("marker") != _marker(repo, type_):
+            return None
+        if Checksum(*meta["checksum"]) != checksum:
+            return None
+        return Vocabulary.load(path.joinpath(meta["folder"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_cached_vocabulary(
+    cache_dir: Path,
+    repo: str,
+    type_: URI,
+    checksum: Checksum,
+    vocabulary: Vocabulary,
+) -> None:
+    # Arrays go to a new folder and the metadata is then replaced, so other
+    # exports never see a half written vocabulary, and the ones that have
+    # mapped the previous folder keep reading it after it is removed.
+    path = cache_path(cache_dir, repo, type_)
+    folder = secrets.token_hex(8)
+    vocabulary.save(path.joinpath(folder))
+    tmp = path.joinpath(f"{META}.{folder}.tmp")
+    tmp.write_text(
+        json.dumps(
+            {
+                "marker": _marker(repo, type_),
+                "checksum": list(checksum),
+                "folder": folder,
+            },
+            indent=2,
+        )
+    )
+    os.replace(tmp, path.joinpath(META))
+    for stale in path.iterdir():
+        if stale.is_dir() and stale.name != folder:
+            shutil.rmtree(stale, ignore_errors=True)
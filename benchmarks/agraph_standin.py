@@ -0,0 +1,527 @@
+"""
+File: agraph_standin.py
+Created Date: Friday, 16th October 2026 10:12:31 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import plac
+
+# A small in-memory stand-in for the AllegroGraph HTTP endpoints that
+# ag-transe-cli talks to: repositories, size, statements (added from a body or
+# from a server-side file), deleting statements, sessions without autocommit
+# with their commits and rollbacks, indices, duplicate suppression, and
+# SPARQL SELECT queries made of basic graph patterns, with DISTINCT, COUNT(*)
+# and the checksums of 'export', optionally with GROUP BY.  Every request is
+# recorded with its parameters, except queries; GET /_calls returns the
+# records.  It is meant for measuring the client on a machine without a real
+# server, not for measuring AllegroGraph.
+
+_STATEMENT = re.compile(r"(<[^>]*>|_:\S+)\s+(<[^>]*>)\s+(.+?)\s*\.\s*$")
+_TOKEN = re.compile(r'<[^>]*>|\?\w+|"(?:[^"\\]|\\.)*"(?:\^\^<[^>]*>|@[\w-]+)?|[;.,{}()*]|\w+')
+_SELECT = re.compile(
+    r"SELECT\s+(DISTINCT\s+)?(.*?)\s*WHERE\s*\{(.*)\}\s*(?:GROUP\s+BY\s+(\?\w+))?\s*$",
+    re.S | re.I,
+)
+# COUNT(*), or a checksum of 'export': the sum of the first 10 decimal digits
+# of MD5(CONCAT(STR(?a), " ", STR(?b))) over all rows
+_AGGREGATE = re.compile(
+    r"\(\s*(?:COUNT\s*\(\s*\*\s*\)|SUM\s*\(.*?MD5\s*\(\s*CONCAT\s*\(\s*STR\s*\(\s*(\?\w+)\s*\)"
+    r"\s*,\s*\" \"\s*,\s*STR\s*\(\s*(\?\w+)\s*\)\s*\)\s*\).*?\))\s+AS\s+(\?\w+)\s*\)",
+    re.S | re.I,
+)
+XSD_INTEGER = "<http://www.w3.org/2001/XMLSchema#integer>"
+RDF_TYPE = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+INDICES = ["spogi", "posgi", "ospgi", "gspoi", "gposi", "gospi", "i"]
+
+
+class Store:
+    # triples of interned N-Triples terms, indexed by predicate on demand
+    def __init__(self):
+        self.terms: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.triples: List[Tuple[int, int, int]] = []
+        self.indices: List[str] = list(INDICES)
+        self.suppress_duplicates = "false"
+        self._index = None
+
+    def intern(self, term: str) -> int:
+        i = self.terms.get(term)
+        if i is None:
+            i = self.terms[term] = len(self.names)
+            self.names.append(term)
+        return i
+
+    def copy(self) -> "Store":
+        # own triples, shared interned terms and settings
+        store = Store()
+        store.terms, store.names = self.terms, self.names
+        store.triples = list(self.triples)
+        store.indices, store.suppress_duplicates = self.indices, self.suppress_duplicates
+        return store
+
+    def parse(self, data: str) -> List[Tuple[int, int, int]]:
+        triples = []
+        for line in data.split("\n"):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            m = _STATEMENT.match(line)
+            if m is None:
+                raise ValueError(f"Malformed statement: {line[:200]}")
+            triples.append(tuple(self.intern(term) for term in m.groups()))
+        return triples
+
+    def extend(self, triples: List[Tuple[int, int, int]]) -> int:
+        self.triples.extend(triples)
+        self._index = None
+        return len(triples)
+
+    def add(self, data: str) -> int:
+        return self.extend(self.parse(data))
+
+    def delete(self, quads: List[List[Optional[str]]]) -> int:
+        gone = set()
+        for s, p, o, *_ in quads:
+            if s in self.terms and p in self.terms and o in self.terms:
+                gone.add((self.terms[s], self.terms[p], self.terms[o]))
+        before = len(self.triples)
+        self.triples = [t for t in self.triples if t not in gone]
+        self._index = None
+        return before - len(self.triples)
+
+    def delete_duplicates(self) -> int:
+        # there are no graphs, so 'spo' and 'spog' are the same here
+        before = len(self.triples)
+        self.triples = list(dict.fromkeys(self.triples))
+        self._index = None
+        return before - len(self.triples)
+
+    def index(self):
+        if self._index is None:
+            index = {}
+            for s, p, o in self.triples:
+                entry = index.get(p)
+                if entry is None:
+                    entry = index[p] = (defaultdict(list), defaultdict(list), set(), [])
+                entry[0][s].append(o)
+                entry[1][o].append(s)
+                entry[2].add((s, o))
+                entry[3].append((s, o))
+            self._index = index
+        return self._index
+
+    def select(self, query: str) -> Tuple[List[str], List[List[str]]]:
+        m = _SELECT.match(query.strip())
+        if m is None:
+            raise ValueError(f"Unsupported query: {query[:200]}")
+        distinct, projection, body, group_by = m.groups()
+        aggregates = _AGGREGATE.findall(projection)
+        names = re.findall(r"\?\w+", _AGGREGATE.sub("", projection))
+        bindings = self._match(self._patterns(body))
+        rows = [[self.names[b[v]] for v in names] for b in bindings]
+        if aggregates:
+            # COUNT(*) when there are no variables, the checksum otherwise
+            totals: Dict[Tuple[str, ...], List[int]] = {}
+            for row, b in zip(rows, bindings):
+                group = totals.setdefault(tuple(row), [0] * len(aggregates))
+                for k, (id_var, ent_var, _) in enumerate(aggregates):
+                    group[k] += (
+                        _digest(
+                            _plain(self.names[b[id_var]]), _plain(self.names[b[ent_var]])
+                        )
+                        if id_var
+                        else 1
+                    )
+            if not names and not totals:
+                totals[()] = [0] * len(aggregates)
+            names = names + [alias for _, _, alias in aggregates]
+            rows = [
+                list(k) + [f'"{n}"^^{XSD_INTEGER}' for n in group]
+                for k, group in totals.items()
+            ]
+        elif distinct:
+            rows = [list(row) for row in dict.fromkeys(map(tuple, rows))]
+        return [name[1:] for name in names], rows
+
+    def _patterns(self, body: str) -> List[Tuple[str, str, str]]:
+        tokens = _TOKEN.findall(body)
+        patterns, current = [], []
+        for token in tokens:
+            if token == ".":
+                current = []
+            elif token == ";":
+                current = current[:1]
+            elif token == ",":
+                current = current[:2]
+            else:
+                current.append(RDF_TYPE if token == "a" and len(current) == 1 else token)
+                if len(current) == 3:
+                    patterns.append(tuple(current))
+        return patterns
+
+    def _match(self, patterns):
+        index = self.index()
+
+        def _resolve(term, binding):
+            if term.startswith("?"):
+                return binding.get(term)
+            return self.terms.get(term, -1)
+
+        def _cost(pattern, bound):
+            # patterns joined to the bindings so far come first, so that no
+            # cartesian product is made while a join is possible, then the
+            # ones with fewest unbound terms
+            variables = {t for t in pattern if t.startswith("?")}
+            disjoint = bool(bound) and bool(variables) and not variables & bound
+            s, p, o = (t if t in variables and t not in bound else None for t in pattern)
+            return disjoint, (s is not None) + (o is not None) + 2 * (p is not None)
+
+        bindings, bound, remaining = [{}], set(), list(patterns)
+        while remaining:
+            pattern = min(remaining, key=lambda pattern: _cost(pattern, bound))
+            remaining.remove(pattern)
+            results = []
+            for binding in bindings:
+                s, p, o = (_resolve(t, binding) for t in pattern)
+                entries = index.items() if p is None else [(p, index.get(p))]
+                for pid, entry in entries:
+                    if entry is None:
+                        continue
+                    by_s, by_o, pairs, all_pairs = entry
+                    if s is not None and o is not None:
+                        found = [(s, o)] if (s, o) in pairs else []
+                    elif s is not None:
+                        found = [(s, x) for x in by_s.get(s, ())]
+                    elif o is not None:
+                        found = [(x, o) for x in by_o.get(o, ())]
+                    else:
+                        found = all_pairs
+                    for fs, fo in found:
+                        extended = dict(binding)
+                        for term, value in ((pattern[0], fs), (pattern[1], pid), (pattern[2], fo)):
+                            if term.startswith("?"):
+                                if extended.setdefault(term, value) != value:
+                                    break
+                        else:
+                            results.append(extended)
+            bindings = results
+            bound.update(t for t in pattern if t.startswith("?"))
+        return bindings
+
+
+def _digest(i: str, name: str) -> int:
+    digits = re.sub("[a-f]", "", hashlib.md5(f"{i} {name}".encode("utf-8")).hexdigest())
+    return int("0" + digits[:10])
+
+
+class Session:
+    # A session without autocommit: writes are logged and only applied to the
+    # repository at a commit, while a rollback drops them.  Reads see the
+    # writes of the session on a copy of the repository, which is only made
+    # when something else than the size is read or statements are deleted.
+    def __init__(self, token: str, store: Store):
+        self.token = token
+        self.store = store
+        self.log: List[Tuple[str, Any]] = []
+        self._view: Optional[Store] = None
+
+    def view(self) -> Store:
+        if self._view is None:
+            self._view = self.store.copy()
+            for method, arg in self.log:
+                _apply(self._view, method, arg)
+        return self._view
+
+    def size(self) -> int:
+        if self._view is None:
+            # only additions have been logged
+            return len(self.store.triples) + sum(len(arg) for _, arg in self.log)
+        return len(self._view.triples)
+
+    def write(self, method: str, arg: Any = None) -> int:
+        if method == "extend" and self._view is None:
+            n = len(arg)
+        else:
+            n = _apply(self.view(), method, arg)
+        self.log.append((method, arg))
+        return n
+
+    def commit(self):
+        for method, arg in self.log:
+            _apply(self.store, method, arg)
+        self.rollback()
+
+    def rollback(self):
+        self.log, self._view = [], None
+
+
+def _apply(store: Store, method: str, arg: Any) -> int:
+    return getattr(store, method)() if arg is None else getattr(store, method)(arg)
+
+
+def _plain(term: str) -> str:
+    # CSV results hold URIs without brackets and literals without quotes
+    if term.startswith("<"):
+        return term[1:-1]
+    if term.startswith('"'):
+        return json.loads(term[: term.rfind('"') + 1])
+    return term
+
+
+class StandIn:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.repositories: Dict[str, Store] = {}
+        self.sessions: Dict[str, Session] = {}
+        self.calls: List[dict] = []
+
+    def record(self, call: dict):
+        with self.lock:
+            self.calls.append(call)
+
+
+def make_handler(state: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _body(self) -> bytes:
+            # pycurl uploads files, e.g. of 'addFile', with chunked encoding
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                    if not size:
+                        # trailers end with an empty line
+                        while self.rfile.readline().strip():
+                            pass
+                        break
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                body = b"".join(chunks)
+            else:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            return body
+
+        def _reply(self, status: int, body=b"", content_type="application/json"):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return len(body)
+
+        def _handle(self, method: str):
+            start = time.perf_counter()
+            url = urlsplit(self.path)
+            params = parse_qs(url.query)
+            body = self._body() if method in ("POST", "PUT") else b""
+            if self.headers.get("Content-Type", "").startswith(
+                "application/x-www-form-urlencoded"
+            ):
+                params.update(parse_qs(body.decode("utf-8")))
+            try:
+                status, reply, content_type = self._route(method, url.path, params, body)
+            except Exception as error:
+                status, reply, content_type = 400, str(error).encode("utf-8"), "text/plain"
+            sent = self._reply(status, reply, content_type)
+            if url.path != "/_calls":
+                state.record(
+                    {
+                        "method": method,
+                        "path": url.path,
+                        "status": status,
+                        "params": {
+                            key: values if len(values) > 1 else values[0]
+                            for key, values in params.items()
+                            if key != "query"
+                        },
+                        "received": len(body),
+                        "sent": sent,
+                        "seconds": time.perf_counter() - start,
+                    }
+                )
+
+        def _route(self, method, path, params, body):
+            parts = [unquote(part) for part in path.strip("/").split("/") if part]
+            if parts == ["catalogs"]:
+                return 200, [{"id": "/"}], "application/json"
+            if parts[:1] == ["catalogs"]:
+                parts = parts[2:]
+            if path == "/_calls":
+                with state.lock:
+                    return 200, state.calls, "application/json"
+            if parts == ["version"]:
+                return 200, "7.0.0", "application/json"
+            if parts == ["repositories"]:
+                with state.lock:
+                    names = list(state.repositories)
+                return (
+                    200,
+                    [{"id": name, "title": name, "readable": True, "writable": True} for name in names],
+                    "application/json",
+                )
+            if len(parts) >= 2 and parts[0] == "sessions":
+                # the URL a session was opened with, in place of the repository
+                with state.lock:
+                    session = state.sessions.get(parts[1])
+                    if session is None:
+                        return 404, b"There is no such session", "text/plain"
+                    return self._repository(method, parts[2:], params, body, session)
+            if len(parts) < 2 or parts[0] != "repositories":
+                return 404, b"Unknown endpoint", "text/plain"
+            name, rest = parts[1], parts[2:]
+            with state.lock:
+                if not rest and method == "PUT":
+                    state.repositories[name] = Store()
+                    return 204, b"", "text/plain"
+                if not rest and method == "DELETE":
+                    state.repositories.pop(name, None)
+                    return 204, b"", "text/plain"
+                store = state.repositories.get(name)
+                if store is None:
+                    return 404, f"There is no repository named '{name}'".encode(), "text/plain"
+                if rest == ["session"] and method == "POST":
+                    if params.get("autoCommit", ["false"])[0].lower() == "true":
+                        return 400, b"Only sessions without autocommit", "text/plain"
+                    token = secrets.token_hex(8)
+                    state.sessions[token] = Session(token, store)
+                    host = self.headers.get("Host") or "127.0.0.1"
+                    return 200, f"http://{host}/sessions/{token}", "application/json"
+                return self._repository(method, rest, params, body, store)
+
+        def _repository(self, method, rest, params, body, target):
+            # `target` is a Store, or a Session whose writes wait for a commit
+            session = target if isinstance(target, Session) else None
+            store = session.store if session is not None else target
+            if session is not None:
+                if rest == ["session", "ping"]:
+                    return 204, b"", "text/plain"
+                if rest == ["session", "close"]:
+                    # whatever has not been committed is dropped
+                    state.sessions.pop(session.token, None)
+                    return 204, b"", "text/plain"
+                if rest == ["commit"]:
+                    session.commit()
+                    return 204, b"", "text/plain"
+                if rest == ["rollback"]:
+                    session.rollback()
+                    return 204, b"", "text/plain"
+            if rest == ["size"]:
+                n = session.size() if session is not None else len(store.triples)
+                return 200, n, "application/json"
+            # every write is committed at once outside of sessions
+            if rest in (["commit"], ["rollback"]):
+                return 204, b"", "text/plain"
+            if rest == ["statements"] and method == "POST":
+                if "file" in params:
+                    with open(params["file"][0], "rb") as fp:
+                        data = fp.read()
+                    if params["file"][0].endswith(".gz"):
+                        data = gzip.decompress(data)
+                else:
+                    data = body
+                triples = store.parse(data.decode("utf-8"))
+                if session is not None:
+                    return 200, session.write("extend", triples), "application/json"
+                return 200, store.extend(triples), "application/json"
+            if rest == ["statements", "duplicates"] and method == "DELETE":
+                if session is not None:
+                    return 200, session.write("delete_duplicates"), "application/json"
+                return 200, store.delete_duplicates(), "application/json"
+            if rest == ["suppressDuplicates"]:
+                if method == "PUT":
+                    store.suppress_duplicates = params["type"][0]
+                elif method == "DELETE":
+                    store.suppress_duplicates = "false"
+                else:
+                    return 200, store.suppress_duplicates, "application/json"
+                return 204, b"", "text/plain"
+            if rest == ["indices"]:
+                if "listValid" in params:
+                    return 200, INDICES, "application/json"
+                return 200, store.indices, "application/json"
+            if rest == ["indices", "optimize"]:
+                return 204, b"", "text/plain"
+            if len(rest) == 2 and rest[0] == "indices":
+                if rest[1] not in INDICES:
+                    return 400, f"Unknown index '{rest[1]}'".encode(), "text/plain"
+                if method == "PUT" and rest[1] not in store.indices:
+                    store.indices.append(rest[1])
+                elif method == "DELETE" and rest[1] in store.indices:
+                    if len(store.indices) == 1:
+                        return 400, b"Cannot drop the last index", "text/plain"
+                    store.indices.remove(rest[1])
+                return 204, b"", "text/plain"
+            if rest == ["statements", "delete"]:
+                if session is not None:
+                    return 200, session.write("delete", json.loads(body)), "application/json"
+                return 200, store.delete(json.loads(body)), "application/json"
+            if not rest and "query" in params:
+                reader = session.view() if session is not None else store
+                names, rows = reader.select(params["query"][0])
+                accept = self.headers.get("Accept", "application/json")
+                if "csv" in accept:
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer, lineterminator="\r\n")
+                    writer.writerow(names)
+                    writer.writerows([_plain(term) for term in row] for row in rows)
+                    return 200, buffer.getvalue().encode("utf-8"), "text/csv"
+                return 200, {"names": names, "values": rows}, "application/json"
+            return 404, b"Unknown endpoint", "text/plain"
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+    return Handler
+
+
+@plac.annotations(
+    host=("Address to listen on; default to be '127.0.0.1'", "option"),
+    port=("Port to listen on; default to be 10035", "option"),
+)
+def main(host: str = "127.0.0.1", port: str = "10035"):
+    server = ThreadingHTTPServer((host, int(port)), make_handler(StandIn()))
+    print(f"Listening on http://{host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(plac.call(main))
@@ -0,0 +1,125 @@
+"""
+File: bench_startup.py
+Created Date: Saturday, 17th October 2026 11:48:20 am
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import plac
+
+# Times short ag-transe-cli commands in fresh processes and checks which
+# dependencies each of them loaded.  Exits with an error if a command is over
+# the budget or loaded a module it must not need.
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY = ("numpy", "plac", "franz", "validators", "dotenv", "requests", "pycurl")
+CHILD = """
+import sys
+from ag_transe_cli.cli import main
+sys.argv = ["ag-transe-cli"] + sys.argv[1:]
+try:
+    main()
+except SystemExit:
+    pass
+print("\\nloaded:" + " ".join(sorted({m.split(".")[0] for m in sys.modules} & set(%r))))
+""" % (
+    HEAVY,
+)
+
+
+def write_openke(path: Path):
+    path.mkdir()
+    path.joinpath("entity2id.txt").write_text(
+        "3\n/m/a\t0\nhttp://example.org/b\t1\n/m/c\t2\n"
+    )
+    path.joinpath("relation2id.txt").write_text("1\n/r\t0\n")
+    path.joinpath("train2id.txt").write_text("2\n0 1 0\n1 2 0\n")
+    path.joinpath("valid2id.txt").write_text("1\n0 2 0\n")
+    path.joinpath("test2id.txt").write_text("1\n2 0 0\n")
+
+
+def measure(args, repeat: int, env) -> tuple:
+    # best wall time of `repeat` runs and the dependencies loaded by the last
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", CHILD, *args],
+            env=env,
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout
+        best = min(best, time.perf_counter() - start)
+    last = out.decode("utf-8").rstrip("\n").rsplit("\n", 1)[-1]
+    return best, last[len("loaded:") :].split()
+
+
+@plac.annotations(
+    budget=("Seconds each command may take at most; default to be 0.5", "option"),
+    repeat=("Number of runs of each command, the best is kept; default to be 5", "option"),
+)
+def main(budget: str = "0.5", repeat: str = "5"):
+    budget, repeat = float(budget), int(repeat)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+
+    with TemporaryDirectory() as tmp_dir:
+        data_dir = Path(tmp_dir).joinpath("openke")
+        write_openke(data_dir)
+        offline = [
+            "import",
+            "-training-data-dir",
+            str(data_dir),
+            "-save-ntriples-to",
+            str(Path(tmp_dir).joinpath("triples.nt")),
+            "-entity-uri-prefix",
+            "http://example.org/",
+            "-relation-uri-prefix",
+            "http://example.org/Property#",
+        ]
+        # (arguments, modules that must not be loaded)
+        cases = [
+            (["--version"], HEAVY),
+            (["-h"], HEAVY),
+            (["import", "-h"], ("franz", "validators", "dotenv", "requests", "pycurl")),
+            (["export", "-h"], ("franz", "validators", "dotenv", "requests", "pycurl")),
+            (["batch", "-h"], ("numpy", "franz", "validators", "dotenv", "requests", "pycurl")),
+            (offline, ("franz", "dotenv", "requests", "pycurl")),
+        ]
+        report, failed = [], False
+        for args, forbidden in cases:
+            seconds, loaded = measure(args, repeat, env)
+            unexpected = sorted(set(loaded) & set(forbidden))
+            ok = seconds <= budget and not unexpected
+            failed = failed or not ok
+            report.append(
+                {
+                    "command": " ".join(args[:2]),
+                    "seconds": seconds,
+                    "loaded": loaded,
+                    "unexpected": unexpected,
+                    "ok": ok,
+                }
+            )
+            print(
+                f"{'ok  ' if ok else 'FAIL'} {' '.join(args[:2]):28s} {seconds:6.3f}s"
+                f"  loaded: {', '.join(loaded) or '-'}",
+                file=sys.stderr,
+            )
+    print(json.dumps(report, indent=2))
+    if failed:
+        sys.exit(f"Startup is over the budget of {budget}s or loads unneeded modules")
+
+
+if __name__ == "__main__":
+    plac.call(main)
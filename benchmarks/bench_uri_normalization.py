@@ -0,0 +1,74 @@
+"""
+File: bench_uri_normalization.py
+Created Date: Friday, 16th October 2026 2:05:12 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import random
+import sys
+import time
+import urllib.parse
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import plac
+import validators
+from franz.openrdf.model.value import URI
+
+from ag_transe_cli.uris import SAFE, read_vocabulary
+
+
+def legacy_read_vocabulary(path: Path, nm: str):
+    d = {}
+    with path.open("r") as f:
+        f.readline()
+        for line in f:
+            s, i = line.split("\t")
+            if validators.url(urllib.parse.quote(s, safe=SAFE)):
+                s = urllib.parse.quote(s, safe=SAFE)
+                d[s] = int(i)
+            else:
+                d[URI(namespace=nm, localname=s).getURI()] = int(i)
+    return d
+
+
+def write_vocabulary(path: Path, size: int, url_ratio: float):
+    rng = random.Random(42)
+    with path.open("w") as fp:
+        fp.write(f"{size}\n")
+        for i in range(size):
+            if rng.random() < url_ratio:
+                fp.write(f"http://dbpedia.org/resource/Entity_{i}\t{i}\n")
+            else:
+                fp.write(f"/m/{i:07x}\t{i}\n")
+
+
+@plac.annotations(
+    size=("Number of names in the synthetic vocabulary; default to be 1000000", "option"),
+    url_ratio=("Ratio of names that are already URLs; default to be 0.5", "option"),
+    workers=("Number of processes for the new path; default to be 4", "option"),
+)
+def main(size: str = "1000000", url_ratio: str = "0.5", workers: str = "4"):
+    size, url_ratio, workers = int(size), float(url_ratio), int(workers)
+    prefix = "http://example.org/"
+    with TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir).joinpath("entity2id.txt")
+        write_vocabulary(path, size, url_ratio)
+
+        start = time.perf_counter()
+        expected = legacy_read_vocabulary(path, prefix)
+        legacy = time.perf_counter() - start
+        print(f"legacy          : {legacy:8.2f}s")
+
+        for n in sorted({1, workers}):
+            start = time.perf_counter()
+            pairs = read_vocabulary(path, prefix, n)
+            elapsed = time.perf_counter() - start
+            if dict(pairs) != expected:
+                sys.exit("Normalized names differ from the legacy path")
+            print(f"{n:2d} worker(s)    : {elapsed:8.2f}s ({legacy / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    plac.call(main)
@@ -0,0 +1,108 @@
+"""
+File: generate_openke.py
+Created Date: Friday, 16th October 2026 10:48:05 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+import plac
+
+from ag_transe_cli.triples import TripleWriter, unpack_triple_ids
+
+BLOCK_SIZE = 1000000
+
+
+def write_vocabulary(path: Path, size: int, name: str, url_ratio: float, seed: int):
+    rng = np.random.default_rng(seed)
+    with path.open("w") as fp:
+        fp.write(f"{size}\n")
+        for start in range(0, size, BLOCK_SIZE):
+            ids = range(start, min(start + BLOCK_SIZE, size))
+            urls = rng.random(len(ids)) < url_ratio
+            fp.write(
+                "".join(
+                    f"http://example.org/resource/{name}_{i}\t{i}\n"
+                    if url
+                    else f"/{name[0]}/{i:07x}\t{i}\n"
+                    for i, url in zip(ids, urls.tolist())
+                )
+            )
+
+
+def triple_keys(n_triples: int, n_keys: int, seed: int):
+    # distinct keys from one walk through all keys with a stride that is
+    # coprime with their number, so no duplicates are generated at any size
+    rng = np.random.default_rng(seed)
+    limit = (1 << 62) // BLOCK_SIZE
+    stride = int(rng.integers(1, min(n_keys, limit)))
+    while math.gcd(stride, n_keys) != 1:
+        stride += 1
+    start = int(rng.integers(0, n_keys))
+    for begin in range(0, n_triples, BLOCK_SIZE):
+        steps = np.arange(min(BLOCK_SIZE, n_triples - begin), dtype=np.int64)
+        base = (start + stride * begin) % n_keys
+        yield (base + (steps * stride) % n_keys) % n_keys
+
+
+@plac.annotations(
+    output_dir=("Folder to write the OpenKE files to", "option"),
+    triples=("Number of triples; default to be 1000000", "option"),
+    entities=("Number of entities; default to be a tenth of 'triples'", "option"),
+    relations=("Number of relations; default to be 100", "option"),
+    url_ratio=("Ratio of names that are already URLs; default to be 0.5", "option"),
+    seed=("Seed of the generator; default to be 42", "option"),
+)
+def main(
+    output_dir: str,
+    triples: str = "1000000",
+    entities: str = None,
+    relations: str = "100",
+    url_ratio: str = "0.5",
+    seed: str = "42",
+):
+    if not output_dir:
+        sys.exit("'output_dir' is not given")
+    n_triples, n_relations, seed = int(triples), int(relations), int(seed)
+    n_entities = int(entities) if entities else max(n_triples // 10, 2)
+    if n_triples > n_entities * n_entities * n_relations:
+        sys.exit("Too many triples for the numbers of entities and relations")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    write_vocabulary(
+        output_dir.joinpath("entity2id.txt"), n_entities, "Entity", float(url_ratio), seed
+    )
+    write_vocabulary(
+        output_dir.joinpath("relation2id.txt"),
+        n_relations,
+        "relation",
+        float(url_ratio),
+        seed + 1,
+    )
+
+    # 80% train, 10% valid and 10% test, written block by block
+    bounds = [0, int(n_triples * 0.8), int(n_triples * 0.9), n_triples]
+    writers = [
+        TripleWriter(output_dir.joinpath(fname))
+        for fname in ("train2id.txt", "valid2id.txt", "test2id.txt")
+    ]
+    offset = 0
+    for keys in triple_keys(n_triples, n_entities * n_entities * n_relations, seed):
+        ids = unpack_triple_ids(keys, n_entities, n_relations)
+        for writer, begin, end in zip(writers, bounds, bounds[1:]):
+            writer.write(ids[max(begin - offset, 0) : max(end - offset, 0)])
+        offset += len(ids)
+    for writer in writers:
+        writer.close()
+    print(
+        f"{n_triples} triples of {n_entities} entities and {n_relations} relations written to '{output_dir}'"
+    )
+
+
+if __name__ == "__main__":
+    plac.call(main)
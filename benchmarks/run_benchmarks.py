@@ -0,0 +1,190 @@
+"""
+File: run_benchmarks.py
+Created Date: Friday, 16th October 2026 11:20:44 pm
+Author: Tianyu Gu (gty@franz.com)
+"""
+
+
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import plac
+
+# Generates synthetic OpenKE folders, starts the AllegroGraph stand-in, and
+# times 'import' and 'export' runs against it, each in its own process, so
+# that peak RSS is the one of that run alone.  Results are written as JSON.
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+CLI = "from ag_transe_cli.cli import main; main()"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run(args, env) -> dict:
+    # wall time and peak RSS of one child process
+    start = time.perf_counter()
+    process = subprocess.Popen(args, env=env, cwd=ROOT)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = (
+        os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    )
+    return {
+        "returncode": process.returncode,
+        "wall_seconds": time.perf_counter() - start,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        # kilobytes on Linux, bytes on macOS
+        "peak_rss_mb": usage.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10),
+    }
+
+
+def fetch_calls(port: int) -> list:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_calls") as response:
+        return json.load(response)
+
+
+def summarize_calls(calls: list) -> dict:
+    summary = {}
+    for call in calls:
+        key = f"{call['method']} {call['path']}"
+        entry = summary.setdefault(key, {"count": 0, "seconds": 0.0, "received": 0, "sent": 0})
+        entry["count"] += 1
+        entry["seconds"] += call["seconds"]
+        entry["received"] += call["received"]
+        entry["sent"] += call["sent"]
+    return summary
+
+
+@plac.annotations(
+    sizes=("Comma separated numbers of triples to benchmark; default to be '1000000'", "option"),
+    work_dir=("Folder for generated data and outputs; default to be 'benchmarks/.work'", "option"),
+    import_args=("Extra arguments of every 'import' run, e.g. '-stream -workers 4'", "option"),
+    export_args=("Extra arguments of every 'export' run, e.g. '-raw-results'", "option"),
+    output=("File to write the JSON report to; default to be standard output", "option"),
+)
+def main(
+    sizes: str = "1000000",
+    work_dir: str = None,
+    import_args: str = "",
+    export_args: str = "",
+    output: str = None,
+):
+    work_dir = Path(work_dir) if work_dir else HERE.joinpath(".work")
+    work_dir.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+
+    port = free_port()
+    ag_env = work_dir.joinpath("ag.env")
+    ag_env.write_text(
+        f"AGRAPH_HOST=127.0.0.1\nAGRAPH_PORT={port}\nAGRAPH_USER=bench\nAGRAPH_PASSWORD=bench\n"
+    )
+    server = subprocess.Popen(
+        [sys.executable, str(HERE.joinpath("agraph_standin.py")), "-port", str(port)],
+        env=env,
+        stdout=subprocess.PIPE,
+    )
+    server.stdout.readline()
+
+    report = {"python": sys.version.split()[0], "runs": []}
+    try:
+        for size in (int(size) for size in sizes.split(",")):
+            data_dir = work_dir.joinpath(f"openke-{size}")
+            if not data_dir.joinpath("test2id.txt").exists():
+                subprocess.run(
+                    [
+                        sys.executable,
+                        str(HERE.joinpath("generate_openke.py")),
+                        "-output-dir",
+                        str(data_dir),
+                        "-triples",
+                        str(size),
+                    ],
+                    env=env,
+                    check=True,
+                )
+            repo = f"bench-{size}"
+            steps = [
+                (
+                    "import",
+                    [
+                        "import",
+                        "-training-data-dir",
+                        str(data_dir),
+                        "-repo",
+                        repo,
+                        "-ag-env",
+                        str(ag_env),
+                        "-entity-uri-prefix",
+                        "http://example.org/",
+                        "-relation-uri-prefix",
+                        "http://example.org/Property#",
+                        *shlex.split(import_args),
+                    ],
+                ),
+                (
+                    "export",
+                    [
+                        "export",
+                        "-output-dir",
+                        str(work_dir.joinpath(f"export-{size}")),
+                        "-repo",
+                        repo,
+                        "-ag-env",
+                        str(ag_env),
+                        "-random-state",
+                        "42",
+                        *shlex.split(export_args),
+                    ],
+                ),
+            ]
+            for name, args in steps:
+                metrics_file = work_dir.joinpath(f"{name}-{size}.metrics.json")
+                if metrics_file.exists():
+                    metrics_file.unlink()
+                args += ["-metrics", str(metrics_file)]
+                n_calls = len(fetch_calls(port))
+                result = run([sys.executable, "-c", CLI, *args], env)
+                result.update(
+                    {
+                        "command": name,
+                        "triples": size,
+                        "args": args[1:],
+                        "triples_per_second": size / result["wall_seconds"],
+                        "server_calls": summarize_calls(fetch_calls(port)[n_calls:]),
+                        "metrics": json.loads(metrics_file.read_text())
+                        if metrics_file.exists()
+                        else None,
+                    }
+                )
+                report["runs"].append(result)
+                print(
+                    f"{name:6s} {size:>11d} triples: {result['wall_seconds']:8.2f}s, "
+                    f"{result['triples_per_second']:10.0f} triples/s, "
+                    f"{result['peak_rss_mb']:8.1f} MiB peak RSS",
+                    file=sys.stderr,
+                )
+    finally:
+        server.terminate()
+        server.wait()
+
+    text = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    plac.call(main)